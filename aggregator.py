@@ -0,0 +1,238 @@
+"""Central plate-event aggregator for several gate Pis.
+
+    python aggregator.py                          # :8090, aggregator.db
+    python aggregator.py --port 18090 --db /tmp/agg.db   # local test instance
+
+Each Pi (sync_client.py) pushes its new plates rows here in gzip JSON
+batches and pulls back a digest of plates recently seen at the other
+sites, so an exit Pi knows the car it just read came in at the entry Pi.
+
+    POST /sync/events   gzip {"site", "epoch", "events": [[seq, plate, timestamp, track_id], ...]}
+                        -> {"acked": seq, "stored": n, "duplicates": n}
+    GET  /sync/digest?site=&since=   gzip {"cursor", "window", "plates": [[plate, timestamp, site], ...]}
+    GET  /sync/plates?plate=&limit=  combined recent sightings, newest first
+    GET  /sync/sites                 per-site last ack / contact / event count
+
+(site, epoch, seq) is unique, so a batch re-sent after a lost ack is
+stored once and acknowledged again. epoch changes when a Pi's plates.db
+is recreated and its row ids start over."""
+import argparse
+import gzip
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import metrics
+import retention
+from status_server import start_status_server, json_response
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+DB_PATH = "aggregator.db"
+PORT = 8090
+DIGEST_WINDOW_HOURS = 12     # sightings older than this are left out of the digest
+MAX_BATCH = 1000             # events accepted per POST
+PLATES_LIMIT = 100
+RETENTION_DAYS = 90          # events older than this go to archive/events/ (None = keep)
+
+RECEIVED = {result: metrics.counter("aggregator_events", "Plate events received from sites",
+                                    result=result)
+            for result in ("stored", "duplicate")}
+BATCHES = metrics.counter("aggregator_batches", "Event batches accepted")
+DIGESTS = metrics.counter("aggregator_digests", "Digests served")
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_db(db_path=DB_PATH):
+    conn = _connect(db_path)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")   # new DBs only; retention.py frees pages stepwise
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            site        TEXT NOT NULL,
+            epoch       TEXT NOT NULL,
+            seq         INTEGER NOT NULL,
+            plate       TEXT NOT NULL,
+            timestamp   TEXT NOT NULL,
+            track_id    INTEGER,
+            received_at TEXT NOT NULL,
+            UNIQUE (site, epoch, seq)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sites (
+            site         TEXT PRIMARY KEY,
+            epoch        TEXT,
+            acked_seq    INTEGER DEFAULT 0,
+            events       INTEGER DEFAULT 0,
+            last_contact TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_plate ON events(plate, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_received ON events(received_at)")
+    conn.commit()
+    conn.close()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _decode(body):
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    return json.loads(body or b"{}")
+
+
+def _gzip_json(obj):
+    body = gzip.compress(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+    return 200, "application/json", body, {"Content-Encoding": "gzip"}
+
+
+# ---------------------------
+# Sync API
+# ---------------------------
+def store_batch(db_path, batch):
+    """Insert one site's batch in a single transaction. Returns the highest
+    seq now held for it: everything the client sent up to there is safe."""
+    site, epoch = str(batch["site"]), str(batch.get("epoch", ""))
+    events = batch.get("events") or []
+    if not site or len(events) > MAX_BATCH:
+        raise ValueError(f"need a site and at most {MAX_BATCH} events")
+    received = _now()
+    conn = _connect(db_path)
+    try:
+        with conn:
+            before = conn.total_changes
+            conn.executemany("""
+                INSERT OR IGNORE INTO events (site, epoch, seq, plate, timestamp, track_id, received_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(site, epoch, int(seq), plate, ts, track_id, received)
+                  for seq, plate, ts, track_id in events])
+            stored = conn.total_changes - before
+            acked = max((int(e[0]) for e in events), default=0)
+            conn.execute("""
+                INSERT INTO sites (site, epoch, acked_seq, events, last_contact) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(site) DO UPDATE SET
+                    acked_seq = CASE WHEN epoch = excluded.epoch
+                                     THEN MAX(acked_seq, excluded.acked_seq)
+                                     ELSE excluded.acked_seq END,
+                    epoch = excluded.epoch,
+                    events = events + excluded.events,
+                    last_contact = excluded.last_contact
+            """, (site, epoch, acked, stored, received))
+    finally:
+        conn.close()
+    RECEIVED["stored"].inc(stored)
+    RECEIVED["duplicate"].inc(len(events) - stored)
+    BATCHES.inc()
+    return {"acked": acked, "stored": stored, "duplicates": len(events) - stored}
+
+
+def digest(db_path, exclude_site=None, since=0, window_hours=DIGEST_WINDOW_HOURS):
+    """Latest sighting per plate at sites other than exclude_site, received
+    after cursor `since` and within the window. The returned cursor goes
+    back in the next call, so steady-state pulls carry only what is new."""
+    lo = (datetime.now() - timedelta(hours=window_hours)).isoformat(timespec="seconds")
+    conn = _connect(db_path)
+    try:
+        cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        # SQLite: the bare columns come from the row holding MAX(timestamp)
+        rows = conn.execute("""
+            SELECT plate, MAX(timestamp) AS timestamp, site FROM events
+            WHERE received_at >= ? AND id > ? AND id <= ? AND site != ?
+            GROUP BY plate
+        """, (lo, since, cursor, exclude_site or "")).fetchall()
+    finally:
+        conn.close()
+    DIGESTS.inc()
+    return {"cursor": cursor, "window": window_hours * 3600,
+            "plates": [[r["plate"], r["timestamp"], r["site"]] for r in rows]}
+
+
+def recent_sightings(db_path, plate=None, limit=PLATES_LIMIT):
+    conn = _connect(db_path)
+    try:
+        if plate:
+            rows = conn.execute("""
+                SELECT site, plate, timestamp, track_id FROM events
+                WHERE plate = ? ORDER BY timestamp DESC LIMIT ?
+            """, (plate, limit)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT site, plate, timestamp, track_id FROM events ORDER BY id DESC LIMIT ?
+            """, (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def site_status(db_path):
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute("SELECT * FROM sites ORDER BY site").fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+# ---------------------------
+# HTTP (status_server routes)
+# ---------------------------
+def routes(db_path):
+    def param(q, name, default=None):
+        return q.get(name, [default])[0]
+
+    return {
+        "/healthz": lambda q: json_response({"status": "ok"}),
+        "/metrics": lambda q: (200, metrics.CONTENT_TYPE, metrics.render().encode("utf-8")),
+        "/sync/digest": lambda q: _gzip_json(digest(db_path, param(q, "site"),
+                                                    int(param(q, "since", 0)))),
+        "/sync/plates": lambda q: json_response(recent_sightings(
+            db_path, param(q, "plate"), min(1000, int(param(q, "limit", PLATES_LIMIT))))),
+        "/sync/sites": lambda q: json_response(site_status(db_path)),
+    }
+
+
+def post_routes(db_path):
+    def events(q, body):
+        try:
+            return json_response(store_batch(db_path, _decode(body)))
+        except (ValueError, KeyError, TypeError) as e:
+            return json_response({"error": f"bad batch: {e}"}, 400)
+
+    return {"/sync/events": events}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Central plate-event aggregator")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    args = ap.parse_args()
+
+    init_db(args.db)
+    if args.retention_days:
+        retention.RetentionJob([retention.TableRetention(args.db, "events", "received_at",
+                                                         args.retention_days)]).start()
+    start_status_server(args.port, routes(args.db), host=args.host, post_routes=post_routes(args.db))
+    print(f"[AGGREGATOR] {args.db} on :{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+from motion import MotionGate
+from propagate import TrackPropagator
+from roi import roi_for_camera, pick_imgsz
+from ocr_protocol import OcrClient
+import metrics
+import tracer
+
+# Stage building blocks shared by app.py, piwifitest.py, piwifitest1.py and
+# rpipaymnet.py. Each entry point wires them into a pipeline.Pipeline:
+#
+#   camera -> detect -> select crops -> OCR -> dedup/persist -> notify
+#
+# Items travel as plain dicts:
+#   frame packet: {seq, t_capture, frame, detections, fresh}
+#   crop job:     {seq, t_capture, track_id, box, crop, plate, conf}
+
+STATS_EVERY = 30             # frames between detect-stage stats snapshots
+
+# Hot-path histograms (seconds), exported on /metrics
+CAPTURE = metrics.histogram("capture_seconds", "Picamera2 capture_array()")
+FLIP = metrics.histogram("flip_seconds", "180 degree flip of the captured frame")
+TRACK = metrics.histogram("track_seconds", "Detector + tracker call (gated / propagated frames excluded)")
+SELECT = metrics.histogram("crop_select_seconds", "Picking and copying plate crops from a frame")
+OCR_ROUND_TRIP = metrics.histogram("ocr_round_trip_seconds", "Encode + send + server OCR + reply, per crop")
+OCR_ERRORS = metrics.counter("ocr_errors", "OCR requests that failed (network / server)")
+OCR_INVALID = metrics.counter("ocr_invalid_reads", "OCR replies that failed the plate-format check")
+DETECT_FRAMES = {kind: metrics.counter("detect_frames", "Frames through the detect stage", kind=kind)
+                 for kind in ("detected", "propagated", "gated")}
+
+
+# ---------------------------
+# Track bookkeeping
+# ---------------------------
+class TrackLedger:
+    """Which track IDs are queued for OCR and which are finished.
+    Shared by the select and OCR stages (both must be thread-placed)."""
+
+    def __init__(self):
+        self.in_flight = set()
+        self.processed = set()
+        self._lock = threading.Lock()
+
+    def claim(self, track_id):
+        with self._lock:
+            if track_id in self.processed or track_id in self.in_flight:
+                return False
+            self.in_flight.add(track_id)
+            return True
+
+    def done(self, track_id, processed=True):
+        with self._lock:
+            self.in_flight.discard(track_id)
+            if processed:
+                self.processed.add(track_id)
+
+    def release(self, job):
+        """on_drop hook: a dropped crop job frees its track for another try."""
+        self.done(job["track_id"], processed=False)
+
+
+# ---------------------------
+# Capture
+# ---------------------------
+class CameraSource:
+    """Picamera2 capture + 180° flip as a pipeline source."""
+
+    def __init__(self, size=(640, 480), fmt="BGR888", stride_none=False, settle=0.0):
+        self.size = size
+        self.fmt = fmt
+        self.stride_none = stride_none
+        self.settle = settle
+        self.picam2 = None
+        self.seq = 0
+
+    def open(self):
+        from picamera2 import Picamera2   # lazy: only on the Pi
+        picam2 = Picamera2()
+        picam2.preview_configuration.main.size = self.size
+        if self.stride_none:
+            picam2.preview_configuration.main.stride = None
+        picam2.preview_configuration.main.format = self.fmt
+        picam2.preview_configuration.align()
+        picam2.configure("preview")
+        picam2.start()
+        if self.settle:
+            time.sleep(self.settle)
+        self.picam2 = picam2
+
+    def close(self):
+        if self.picam2 is not None:
+            self.picam2.stop()
+
+    def __call__(self):
+        t_wall = time.time()
+        t0 = time.perf_counter()
+        frame = self.picam2.capture_array()
+        t1 = time.perf_counter()
+        frame = cv2.flip(frame, -1)
+        t2 = time.perf_counter()
+        CAPTURE.observe(t1 - t0)
+        FLIP.observe(t2 - t1)
+        self.seq += 1
+        tracer.TRACER.add("capture", t_wall, t1 - t0, "camera", seq=self.seq)
+        tracer.TRACER.add("flip", t_wall + (t1 - t0), t2 - t1, "camera", seq=self.seq)
+        return {"seq": self.seq, "t_capture": t_wall, "frame": frame}
+
+
+# ---------------------------
+# Detection (motion gate -> ROI -> detector / propagation)
+# ---------------------------
+class DetectStage:
+    """Holds only plain config until setup(), so it can run in a worker
+    process; the detector, ROI, motion gate and propagator are built there."""
+
+    def __init__(self, backend="auto", frame_size=(640, 480), camera_id="cam0",
+                 roi_polygons=None, expected_plate_px=None, motion_gate=True,
+                 motion_roi=None, detect_every=1, detect_adaptive=False,
+                 motion_report_every=900):
+        self.backend = backend
+        self.frame_size = frame_size
+        self.camera_id = camera_id
+        self.roi_polygons = roi_polygons or {}
+        self.expected_plate_px = expected_plate_px
+        self.use_motion_gate = motion_gate
+        self.motion_roi = motion_roi
+        self.detect_every = detect_every
+        self.detect_adaptive = detect_adaptive
+        self.motion_report_every = motion_report_every
+
+        self.detector = None
+        self.roi = None
+        self.imgsz = 640
+        self.motion_gate = None
+        self.propagator = None
+        self.last_detections = []
+        self.frames = 0
+
+    def setup(self):
+        w, h = self.frame_size
+        self.roi = roi_for_camera(self.roi_polygons, self.camera_id, (h, w))
+        if self.expected_plate_px:
+            self.imgsz = pick_imgsz(*(self.roi.size if self.roi else self.frame_size),
+                                    self.expected_plate_px)
+        print(f"[ROI] {self.roi.rect if self.roi else 'full frame'} | detector imgsz={self.imgsz}")
+
+        if self.use_motion_gate:
+            self.motion_gate = MotionGate(roi=self.motion_roi or (self.roi.rect if self.roi else None))
+        if self.detect_every > 1 or self.detect_adaptive:
+            self.propagator = TrackPropagator(every_n=self.detect_every, adaptive=self.detect_adaptive)
+
+        from detector import load_detector   # lazy: pulls in onnxruntime / torch
+        self.detector = load_detector(self.backend)
+        print(f"Model Classes: {self.detector.names} | backend: {self.detector.backend}")
+        self.detector.warmup(self.imgsz)
+
+    def __call__(self, pkt):
+        frame = pkt["frame"]
+        if self.motion_gate is not None and not self.motion_gate.should_detect(frame):
+            # Static scene: hold the last detections. Gated frames skip the
+            # tracker, which only ever sees frames that were actually detected.
+            detections, fresh = self.last_detections, False
+            if self.propagator is not None:
+                self.propagator.reset()   # re-sync with the detector on wake-up
+            DETECT_FRAMES["gated"].inc()
+        elif self.propagator is not None and not self.propagator.should_detect():
+            detections, fresh = self.propagator.propagate(frame), True
+            DETECT_FRAMES["propagated"].inc()
+        else:
+            t0 = time.time()
+            det_input = self.roi.crop(frame) if self.roi is not None else frame
+            # governor.py's cap; exported models with a static shape ignore it
+            imgsz = min(self.imgsz, pkt.get("imgsz_cap") or self.imgsz)
+            with TRACK.time(), tracer.span("track", "detect", seq=pkt["seq"]):
+                detections = self.detector.track(det_input, imgsz=imgsz)
+            DETECT_FRAMES["detected"].inc()
+            if self.roi is not None:
+                detections = self.roi.to_frame(detections)
+            if self.propagator is not None:
+                detections = self.propagator.on_detections(frame, detections, time.time() - t0)
+            fresh = True
+
+        self.last_detections = detections
+        self.frames += 1
+        pkt["detections"] = detections
+        pkt["fresh"] = fresh
+        pkt["imgsz_fixed"] = getattr(self.detector, "input_size", None)   # governor.observe
+        if self.frames % STATS_EVERY == 0:
+            pkt["detect_stats"] = self.stats()
+        if self.motion_gate is not None and self.frames % self.motion_report_every == 0:
+            st = self.motion_gate.stats()
+            print(f"[MOTION] {st['skipped']}/{st['frames']} frames skipped ({st['skip_ratio']:.1%})")
+        return pkt
+
+    def stats(self):
+        return {
+            "backend": self.detector.backend if self.detector else None,
+            "imgsz": self.imgsz,
+            "motion": self.motion_gate.stats() if self.motion_gate else None,
+            "propagation": self.propagator.stats() if self.propagator else None,
+        }
+
+
+# ---------------------------
+# Latest frame for display / web
+# ---------------------------
+class FrameSlot:
+    """Latest frame packet (raw frame + detections), read by the display
+    stage or web stream. Only a reference is stored, nothing is copied."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pkt = None
+        self.seq = 0
+        self.updated = 0.0
+        self.detect_stats = None
+
+    def publish(self, pkt):
+        with self.lock:
+            self.pkt = pkt
+            self.seq += 1
+            self.updated = time.time()
+            if "detect_stats" in pkt:
+                self.detect_stats = pkt["detect_stats"]
+
+    def get(self):
+        with self.lock:
+            return self.seq, self.pkt
+
+    def read(self, fn):
+        """(seq, fn(frame, detections)) for the latest frame; same call
+        shape as detector_service.RemoteDetector.read."""
+        seq, pkt = self.get()
+        if pkt is None:
+            return seq, None
+        return seq, fn(pkt["frame"], pkt["detections"])
+
+
+# ---------------------------
+# Crop selection
+# ---------------------------
+class SelectCrops:
+    """Publishes each frame to the slot (and on_frame, e.g. the governor's
+    traffic signal), then fans out one crop job per licence box whose track
+    still needs OCR."""
+
+    def __init__(self, ledger, min_size=(100, 30), slot=None, plate_class="licence",
+                 on_frame=None):
+        self.ledger = ledger
+        self.min_w, self.min_h = min_size
+        self.slot = slot
+        self.plate_class = plate_class
+        self.on_frame = on_frame
+
+    def __call__(self, pkt):
+        if self.slot is not None:
+            self.slot.publish(pkt)
+        if self.on_frame is not None:
+            self.on_frame(pkt)
+        if not pkt.get("fresh", True):
+            return None
+        with SELECT.time():
+            return self._select(pkt)
+
+    def _select(self, pkt):
+        frame = pkt["frame"]
+        jobs = []
+        for det in pkt["detections"]:
+            if det["class_name"].lower() != self.plate_class:
+                continue
+            x1, y1, x2, y2 = det["box"]
+            crop = frame[y1:y2, x1:x2]
+            if crop is None or crop.size == 0:
+                continue
+            if crop.shape[1] < self.min_w or crop.shape[0] < self.min_h:
+                continue
+            if not self.ledger.claim(det["track_id"]):
+                continue
+            jobs.append({
+                "seq": pkt["seq"],
+                "t_capture": pkt["t_capture"],
+                "track_id": det["track_id"],
+                "box": det["box"],
+                "crop": crop.copy(),
+            })
+        return jobs or None
+
+
+# ---------------------------
+# OCR
+# ---------------------------
+class OcrStage:
+    """Sends crop jobs to the OCR server (one persistent client per worker).
+    mark_on_empty: whether an empty read still marks the track as done."""
+
+    def __init__(self, ledger, host, port, timeout=5, codecs=("jpeg", "png", "raw"),
+                 gray=True, mark_on_empty=True, max_attempts=3):
+        self.ledger = ledger
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.codecs = codecs
+        self.gray = gray
+        self.mark_on_empty = mark_on_empty
+        self.max_attempts = max_attempts
+        self.invalid_reads = OrderedDict()   # track_id -> plate-format failures so far
+        self._attempts_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = OcrClient(self.host, self.port, timeout=self.timeout,
+                               codecs=self.codecs, gray=self.gray)
+            self._local.client = client
+        return client
+
+    def __call__(self, job):
+        track_id = job["track_id"]
+        job["request_id"] = request_id = tracer.new_request_id()
+        print(f"[INFO] Sending to OCR server (Track ID: {track_id}, request {request_id})...")
+        t0 = time.perf_counter()
+        try:
+            with tracer.span("ocr_request", "ocr", seq=job["seq"], track_id=track_id,
+                             request_id=request_id) as span_args:
+                reply = self._client().recognize(job["crop"], track_id, request_id=request_id)
+                span_args["text"] = reply.get("text", "")
+                span_args["cached"] = reply.get("cached", False)
+        except Exception as e:
+            OCR_ERRORS.inc()
+            tracer.instant("ocr_error", "ocr", track_id=track_id, request_id=request_id, error=str(e))
+            print(f"[OCR SERVER ERROR] {e}")
+            self.ledger.done(track_id, processed=False)
+            return None
+        OCR_ROUND_TRIP.observe(time.perf_counter() - t0)
+        plate_text = reply.get("text", "").strip()
+        print(f"[INFO] Plate: '{plate_text}'")
+        if not plate_text:
+            self.ledger.done(track_id, processed=self.mark_on_empty)
+            return None
+        if not reply.get("valid", True):    # older servers don't check the format
+            self._invalid(track_id, plate_text)
+            return None
+        with self._attempts_lock:
+            self.invalid_reads.pop(track_id, None)
+        self.ledger.done(track_id)
+        job["plate"] = plate_text
+        job["conf"] = reply.get("conf")
+        return job
+
+    def _invalid(self, track_id, plate_text):
+        """Not a plate-format read: free the track so a later frame's crop
+        is sent again, up to max_attempts; never persisted."""
+        OCR_INVALID.inc()
+        with self._attempts_lock:
+            tries = self.invalid_reads.pop(track_id, 0) + 1
+            if tries < self.max_attempts:
+                self.invalid_reads[track_id] = tries
+            while len(self.invalid_reads) > 1024:    # tracks that left the scene
+                self.invalid_reads.popitem(last=False)
+        retry = tries < self.max_attempts
+        print(f"[INFO] Invalid plate read '{plate_text}' (Track ID: {track_id}, "
+              f"try {tries}/{self.max_attempts})" + ("; retrying" if retry else "; giving up"))
+        self.ledger.done(track_id, processed=not retry)
+
+
+# ---------------------------
+# Local preview window (display stage)
+# ---------------------------
+def run_display(slot, title, pipeline, overlays=None, show=True, box_color=(0, 255, 0)):
+    """Main-thread display loop. Draws only when a window is shown;
+    headless runs just wait. ESC or Ctrl+C stops."""
+    from overlay import annotate
+
+    last_seq = 0
+    try:
+        while pipeline.source_alive() or not show:
+            if not show:
+                time.sleep(0.5)
+                if not pipeline.source_alive():
+                    break
+                continue
+            seq, pkt = slot.get()
+            if pkt is not None and seq != last_seq:
+                last_seq = seq
+                labels, links = (), ()
+                if overlays is not None:
+                    labels, links = overlays.current({d["track_id"] for d in pkt["detections"]})
+                cv2.imshow(title, annotate(pkt["frame"], pkt["detections"], labels, links,
+                                           box_color=box_color))
+            if cv2.waitKey(1) & 0xFF == 27:
+                break
+    except KeyboardInterrupt:
+        print("[INFO] Stopped.")
+    if show:
+        cv2.destroyAllWindows()
@@ -1,17 +1,25 @@
 
-from flask import Flask, render_template, Response, jsonify
+from flask import Flask, render_template, Response, jsonify, request
+import metrics
+import tracer
 import cv2
-from ultralytics import YOLO
-import cvzone
-from picamera2 import Picamera2
-import socket
-import struct
 import threading
 import time
 from datetime import datetime
 import json
 import sqlite3
 import os
+import sys
+from overlay import annotate
+from startup import Startup
+from pipeline import Pipeline, Stage, DROP_OLDEST
+from anpr_stages import (TrackLedger, CameraSource, DetectStage, FrameSlot,
+                         SelectCrops, OcrStage)
+from frame_source import open_source
+from crop_store import CropWriter
+import retention
+from governor import Governor
+from sync_client import SyncClient
 
 app = Flask(__name__)
 
@@ -20,7 +28,48 @@ app = Flask(__name__)
 # ---------------------------
 WINDOWS_IP = "192.168.0.101"   # ?? CHANGE THIS
 PORT = 9999
+OCR_CODECS = ("jpeg", "png", "raw")   # preference order offered to the OCR server
+OCR_GRAY = True                  # send greyscale crops normalized to the recognizer height
 DB_PATH = "plates.db"
+BLOB_FOLDER = "plate_blobs"      # content-addressed plate crops + thumbnails (crop_store.py)
+BLOB_MAX_BYTES = 200 * 1024 * 1024   # oldest blobs evicted beyond this
+THUMB_HEIGHT = 48                # dashboard thumbnail height in px
+BLOB_CACHE_SECONDS = 365 * 86400     # blobs never change under a name: cache "forever"
+RETENTION_DAYS = 90              # plates rows / blobs older than this go to ARCHIVE_DIR (None = keep)
+ARCHIVE_DIR = "archive"          # per-day gzip archives, readable via /api/history?date=
+RETENTION_INTERVAL_HOURS = 24
+DETECTOR_BACKEND = "auto"        # "auto" | "ultralytics" | "onnx" | "openvino" | "ncnn"
+CAMERA_ID = "cam0"
+FRAME_SIZE = (640, 480)
+FRAME_SOURCE = "camera"          # or "video:gate.mp4", "dir:frames/", "synthetic" (see frame_source.py)
+ROI_POLYGONS = {}                # {"cam0": [[(x, y), (x, y), ...], ...]} lane polygons
+EXPECTED_PLATE_PX = None         # typical plate height in px; picks detector imgsz
+MOTION_GATE = True               # skip YOLO while the gate is empty
+MOTION_ROI = None                # (x1, y1, x2, y2); None = ROI_POLYGONS box / full frame
+MOTION_REPORT_EVERY = 900        # frames between [MOTION] log lines
+DETECT_EVERY = 1                 # run YOLO every Nth frame, optical flow in between
+DETECT_ADAPTIVE = False          # pick N from measured inference time instead
+DETECT_PLACEMENT = "thread"      # "thread" or "process" (own interpreter, no GIL contention)
+OCR_WORKERS = 1                  # concurrent OCR requests in flight
+OCR_MAX_ATTEMPTS = 3             # crops sent per track while the server says "not a plate format"
+FRAME_INTERVAL = 0.03            # seconds between camera captures (GOVERNOR = False)
+GOVERNOR = True                  # pick capture rate / detector input size from CPU, SoC temp, traffic
+GOVERNOR_TARGET_CPU = 0.75
+GOVERNOR_TEMP_SENSOR = "sysfs"   # or "file:/tmp/soc_temp" (plain °C) to test off the Pi
+LOOP_STALL_SECONDS = 10          # /readyz fails if no frame was processed for this long
+SERVER_MODE = "threaded"         # "threaded": Flask, one thread per connection
+                                 # "async": asyncio server (async_server.py), + /api/events push
+WEB_PORT = 5000
+DETECTOR_MODE = "inline"         # "inline": one process | "spawn": detector in a supervised child
+                                 # | "external": run detector_service.py separately (e.g. systemd)
+RING_NAME = "anpr_frames"        # shared-memory frame ring (split modes)
+DETECTOR_IPC_PORT = 5002         # detector -> web plate events / stats (localhost)
+DETECTOR_STATUS_PORT = 5001      # detector process /healthz /readyz /metrics /trace
+IPC_AUTHKEY = b"anpr-local"
+SITE_ID = "gate1"                # this Pi's name at the aggregator ("entry", "exit", ...)
+SYNC_URL = None                  # aggregator.py, e.g. "http://192.168.0.50:8090" (None = standalone)
+SYNC_DEDUP_SECONDS = 0           # >0: a plate another site read this recently is not saved again
+                                 # (cameras covering the same lane); otherwise it is a revisit
 
 # ---------------------------
 # SQLite Setup
@@ -28,6 +77,7 @@ DB_PATH = "plates.db"
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")   # new DBs only; retention.py frees pages stepwise
     c.execute('''
         CREATE TABLE IF NOT EXISTS plates (
             id        INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,17 +88,23 @@ def init_db():
             timestamp TEXT NOT NULL
         )
     ''')
+    # Added later: blob names of the plate crop / thumbnail (crop_store.py)
+    columns = {row[1] for row in c.execute("PRAGMA table_info(plates)")}
+    for column in ("crop_blob", "thumb_blob"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE plates ADD COLUMN {column} TEXT")
     conn.commit()
     conn.close()
 
-def save_plate_to_db(track_id, plate, date, time_str, timestamp):
+def save_plate_to_db(track_id, plate, date, time_str, timestamp, crop_blob=None, thumb_blob=None):
     """Save plate only if same plate text not seen in last 60 seconds.
-    Returns (True, None) if saved, (False, last_record) if duplicate."""
+    Returns (True, None, row_id) if saved, (False, last_record, last_row_id)
+    if duplicate."""
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     # Get most recent record for this plate
     c.execute(
-        "SELECT date, time, timestamp FROM plates WHERE plate = ? ORDER BY id DESC LIMIT 1",
+        "SELECT date, time, timestamp, id FROM plates WHERE plate = ? ORDER BY id DESC LIMIT 1",
         (plate,)
     )
     last = c.fetchone()
@@ -60,14 +116,56 @@ def save_plate_to_db(track_id, plate, date, time_str, timestamp):
     count = c.fetchone()[0]
     if count == 0:
         c.execute(
-            "INSERT INTO plates (track_id, plate, date, time, timestamp) VALUES (?,?,?,?,?)",
-            (track_id, plate, date, time_str, timestamp)
+            "INSERT INTO plates (track_id, plate, date, time, timestamp, crop_blob, thumb_blob) "
+            "VALUES (?,?,?,?,?,?,?)",
+            (track_id, plate, date, time_str, timestamp, crop_blob, thumb_blob)
         )
+        row_id = c.lastrowid
         conn.commit()
         conn.close()
-        return True, None
+        return True, None, row_id
+    conn.close()
+    if not last:
+        return False, None, None
+    return False, {"date": last[0], "time": last[1], "timestamp": last[2]}, last[3]
+
+def encode_blobs(crop):
+    """JPEG bytes of the plate crop + thumbnail keyed by their blob names
+    ({"crop_blob": (name, data), "thumb_blob": ...}), or {} without a
+    store / crop. Names are content hashes, so they go into the plates row
+    with the INSERT and the files follow on the blob store's thread."""
+    if blob_store is None or crop is None or crop.size == 0:
+        return {}
+    ok, crop_jpg = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    h, w = crop.shape[:2]
+    thumb = cv2.resize(crop, (max(1, w * THUMB_HEIGHT // h), THUMB_HEIGHT), interpolation=cv2.INTER_AREA)
+    ok_t, thumb_jpg = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    if not (ok and ok_t):
+        return {}
+    return {column: (CropWriter.name_for(data), data)
+            for column, data in (("crop_blob", crop_jpg.tobytes()), ("thumb_blob", thumb_jpg.tobytes()))}
+
+def unlink_blobs(row_id, columns):
+    """Clear blob links (crop_blob / thumb_blob) whose write was dropped."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(f"UPDATE plates SET {', '.join(c + ' = NULL' for c in columns)} WHERE id = ?", (row_id,))
+    conn.commit()
     conn.close()
-    return False, {"date": last[0], "time": last[1], "timestamp": last[2]} if last else None
+
+def plate_blob(row_id, kind="thumb"):
+    """(etag, path) of a plate's stored crop / thumbnail, or None if the
+    row has none or the blob was evicted. The blob name is its content
+    hash, so it doubles as a strong ETag."""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute(f"SELECT {'thumb_blob' if kind == 'thumb' else 'crop_blob'} "
+                       "FROM plates WHERE id = ?", (row_id,)).fetchone()
+    conn.close()
+    if not row or not row[0]:
+        return None
+    path = os.path.join(BLOB_FOLDER, row[0])
+    if not os.path.exists(path):
+        return None
+    return '"%s"' % row[0].rsplit(".", 1)[0], path
 
 def load_processed_plates():
     """On startup, load recently detected plates from DB to avoid re-saving after restart."""
@@ -78,169 +176,264 @@ def load_processed_plates():
     conn.close()
     return rows
 
-init_db()
-recently_seen_plates = load_processed_plates()  # plates seen in last 5 min before restart
-print(f"[DB] Loaded {len(recently_seen_plates)} recently seen plates from DB")
-
 # ---------------------------
 # Shared State
 # ---------------------------
-detected_plates = []          # List of dicts: {id, plate, time, date, crop_b64}
-processed_ids = set()
-frame_lock = threading.Lock()
+recently_seen_plates = set()  # filled by the "db" startup phase
+detected_plates = []          # List of dicts: {id, plate, time, date, thumb}
 plates_lock = threading.Lock()
-latest_frame = None
+plate_listeners = []          # called with each new card (split mode: sent to the web process)
+blob_store = None             # CropWriter for plate crops / thumbnails, opened by start_db
+sync_client = None            # SyncClient to the aggregator (SYNC_URL), started by start_db
+viewer_count = 0             # open /video_feed connections
+viewers_lock = threading.Lock()
+
+DB_WRITE = metrics.histogram("db_write_seconds", "Dedup check + insert into plates.db")
+NOTIFY = metrics.histogram("notify_seconds", "Pushing a plate card to the dashboard")
+CAMERA_TO_DB = metrics.histogram("camera_to_db_seconds", "Frame capture to plate row written")
+STREAM_ENCODE = metrics.histogram("stream_encode_seconds", "Annotate + JPEG-encode a /video_feed frame")
+metrics.gauge("viewers", "Open /video_feed connections", fn=lambda: viewer_count)
+metrics.gauge("blob_store_bytes", "Plate crops + thumbnails on disk",
+              fn=lambda: blob_store.total_bytes if blob_store else 0)
+BLOB_REQUESTS = {result: metrics.counter("blob_requests", "Plate image requests", result=result)
+                 for result in ("ok", "not_modified", "missing")}
 
 # ---------------------------
-# Load YOLO Model
+# Pipeline Stages (dedup/persist, notify)
 # ---------------------------
-model = YOLO("best.pt")
-names = model.names
-print("Model Classes:", names)
+def persist_plate(job):
+    """Save plate unless seen in the last 60 s; tags revisits, including
+    plates another site reported (aggregator digest)."""
+    plate_text, track_id = job["plate"], job["track_id"]
+    now = datetime.now()
+    remote = sync_client.seen_elsewhere(plate_text) if sync_client else None
+    if remote and remote["age"] < SYNC_DEDUP_SECONDS:
+        # Same vehicle, other camera on this lane: already recorded there
+        print(f"[DUPLICATE] Plate: {plate_text} | Seen at {remote['site']} {remote['age']:.0f}s ago")
+        job.update(now=now, saved=False, revisit=True, last_record=remote, row_id=None)
+        return job
+    blobs = encode_blobs(job.get("crop"))     # outside the db_write timing
+    with DB_WRITE.time(), tracer.span("db_write", "db", track_id=track_id, plate=plate_text,
+                                      request_id=job.get("request_id")) as span_args:
+        saved, last_record, row_id = save_plate_to_db(
+            int(track_id),
+            plate_text,
+            now.strftime("%d %b %Y"),
+            now.strftime("%H:%M:%S"),
+            now.isoformat(),
+            **{column: name for column, (name, _) in blobs.items()}
+        )
+        span_args["saved"] = saved
+    if saved:
+        # Keep a link only to blobs the store accepted (its queue drops when full)
+        dropped = [column for column, (name, data) in blobs.items() if blob_store.submit(data) is None]
+        if dropped:
+            unlink_blobs(row_id, dropped)
+    CAMERA_TO_DB.observe(time.time() - job["t_capture"])
+    if saved:
+        recently_seen_plates.add(plate_text)
+        print(f"[SAVED] Plate: {plate_text} | ID: {track_id}")
+        if remote:
+            # New here, but the vehicle was read at another site first
+            print(f"[REVISIT] Plate: {plate_text} | Last seen at {remote['site']}: {remote['timestamp']}")
+            last_record = remote
+    else:
+        print(f"[REVISIT] Plate: {plate_text} | Last seen: {last_record}")
+    job.update(now=now, saved=saved, revisit=not saved or remote is not None,
+               last_record=last_record, row_id=row_id)
+    return job
+
+def notify_dashboard(job):
+    """Push a new / revisit card to /api/plates."""
+    with NOTIFY.time():
+        _push_card(job)
+    return None
+
+def _push_card(job):
+    now, last_record = job["now"], job["last_record"]
+    entry = {
+        "id": int(job["track_id"]),
+        "plate": job["plate"],
+        "time": now.strftime("%H:%M:%S"),
+        "date": now.strftime("%d %b %Y"),
+        "timestamp": now.isoformat(),
+        "revisit": job["revisit"],
+        "last_time": None,
+        "last_date": None,
+        "last_site": None,
+        # revisits show the thumbnail of the row they match
+        "thumb": f"/plates/{job['row_id']}/thumb.jpg" if job.get("row_id") else None
+    }
+    if job["revisit"]:
+        # Plate seen again (here, or at another site) — show revisit card
+        entry["last_time"] = last_record["time"] if last_record else "—"
+        entry["last_date"] = last_record["date"] if last_record else "—"
+        entry["last_site"] = last_record.get("site") if last_record else None
+
+    publish_card(entry)
+
+def publish_card(entry):
+    """Dashboard list + listeners (event hub / async push channel)."""
+    add_plate_card(entry)
+    for listener in plate_listeners:
+        listener(entry)
+
+def add_plate_card(entry):
+    with plates_lock:
+        detected_plates.insert(0, entry)
+        if len(detected_plates) > 50:
+            detected_plates.pop()
 
 # ---------------------------
-# Camera Setup
+# Pipeline: camera -> detect -> select crop -> OCR -> dedup/persist -> notify
 # ---------------------------
-picam2 = Picamera2()
-picam2.preview_configuration.main.size = (640, 480)
-picam2.preview_configuration.main.stride = None
-picam2.preview_configuration.main.format = "BGR888"
-picam2.preview_configuration.align()
-picam2.configure("preview")
-picam2.start()
+def build_pipeline(source, slot, ledger, ocr_host=WINDOWS_IP, ocr_port=PORT,
+                   backend=DETECTOR_BACKEND, name="anpr-pi", source_interval=FRAME_INTERVAL,
+                   governor=None, detect_drop=DROP_OLDEST):
+    """The Pi pipeline around any frame source (camera, replay, synthetic).
+    With a governor, it paces the source instead of source_interval.
+    detect_drop=BLOCK makes a replay wait for the detector instead of
+    dropping frames (bench.py)."""
+    if governor is not None:
+        source, source_interval = governor.wrap(source), 0
+    return Pipeline(name, source, [
+        Stage("detect", DetectStage(
+            backend=backend, frame_size=FRAME_SIZE, camera_id=CAMERA_ID,
+            roi_polygons=ROI_POLYGONS, expected_plate_px=EXPECTED_PLATE_PX,
+            motion_gate=MOTION_GATE, motion_roi=MOTION_ROI, detect_every=DETECT_EVERY,
+            detect_adaptive=DETECT_ADAPTIVE, motion_report_every=MOTION_REPORT_EVERY),
+            placement=DETECT_PLACEMENT, queue_size=1, drop=detect_drop),
+        Stage("select", SelectCrops(ledger, (100, 30), slot=slot,
+                                    on_frame=governor.observe if governor else None),
+              queue_size=2, drop=DROP_OLDEST),
+        Stage("ocr", OcrStage(ledger, ocr_host, ocr_port, timeout=5, codecs=OCR_CODECS,
+                              gray=OCR_GRAY, mark_on_empty=True, max_attempts=OCR_MAX_ATTEMPTS),
+              workers=OCR_WORKERS, queue_size=8, drop=DROP_OLDEST, on_drop=ledger.release),
+        Stage("persist", persist_plate, queue_size=32),
+        Stage("notify", notify_dashboard, queue_size=32),
+    ], source_interval=source_interval)
+
+ledger = TrackLedger()
+frame_slot = FrameSlot()      # latest raw frame + detections for the web stream
+                              # (split modes: replaced by a RemoteDetector on startup)
+if FRAME_SOURCE == "camera":
+    camera = CameraSource(FRAME_SIZE, "BGR888", stride_none=True)
+else:
+    camera = open_source(FRAME_SOURCE, FRAME_SIZE)
+# Split modes: detector_service.py builds its own pipeline (and governor) in the detector process
+governor = None
+if GOVERNOR and DETECTOR_MODE == "inline":
+    governor = Governor(target_cpu=GOVERNOR_TARGET_CPU, temp_sensor=GOVERNOR_TEMP_SENSOR,
+                        max_fps=1.0 / FRAME_INTERVAL)
+pipeline = build_pipeline(camera, frame_slot, ledger, governor=governor) \
+    if DETECTOR_MODE == "inline" else None
 
 # ---------------------------
-# Detection Thread
+# Startup Phases
 # ---------------------------
-def detection_loop():
-    global latest_frame
-    while True:
-        frame = picam2.capture_array()
-        frame = cv2.flip(frame, -1)
-        results = model.track(frame, persist=True)
-
-        if results and results[0].boxes.id is not None:
-            ids = results[0].boxes.id.cpu().numpy().astype(int)
-            boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-            class_ids = results[0].boxes.cls.int().cpu().tolist()
-
-            for box, track_id, class_id in zip(boxes, ids, class_ids):
-                x1, y1, x2, y2 = box
-                class_name = names[class_id]
-                h, w, _ = frame.shape
-                x1, y1 = max(0, x1), max(0, y1)
-                x2, y2 = min(w, x2), min(h, y2)
-
-                # Draw bounding box on live feed
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 200, 255), 2)
-                cvzone.putTextRect(frame, f"{class_name} ID:{track_id}", (x1, max(0, y1 - 10)), 1, 1)
-
-                if class_name.lower() == "licence" and track_id not in processed_ids:
-                    crop = frame[y1:y2, x1:x2]
-                    if crop is None or crop.size == 0:
-                        continue
-                    if crop.shape[1] < 100 or crop.shape[0] < 30:
-                        continue
-
-                    _, img_encoded = cv2.imencode(".jpg", crop)
-                    img_bytes = img_encoded.tobytes()
-
-                    try:
-                        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        client.settimeout(5)
-                        client.connect((WINDOWS_IP, PORT))
-                        client.sendall(struct.pack(">I", track_id))
-                        client.sendall(struct.pack(">I", len(img_bytes)))
-                        client.sendall(img_bytes)
-
-                        result_size_data = client.recv(4)
-                        result_size = struct.unpack(">I", result_size_data)[0]
-                        result_data = b""
-                        while len(result_data) < result_size:
-                            packet = client.recv(4096)
-                            if not packet:
-                                break
-                            result_data += packet
-
-                        plate_text = result_data.decode("utf-8").strip()
-                        client.close()
-
-                        # Mark track_id as processed regardless (avoid re-sending to OCR)
-                        processed_ids.add(track_id)
-
-                        if plate_text:
-                            now = datetime.now()
-                            saved, last_record = save_plate_to_db(
-                                int(track_id),
-                                plate_text,
-                                now.strftime("%d %b %Y"),
-                                now.strftime("%H:%M:%S"),
-                                now.isoformat()
-                            )
-                            if saved:
-                                recently_seen_plates.add(plate_text)
-                                entry = {
-                                    "id": int(track_id),
-                                    "plate": plate_text,
-                                    "time": now.strftime("%H:%M:%S"),
-                                    "date": now.strftime("%d %b %Y"),
-                                    "timestamp": now.isoformat(),
-                                    "revisit": False,
-                                    "last_time": None,
-                                    "last_date": None
-                                }
-                                print(f"[SAVED] Plate: {plate_text} | ID: {track_id}")
-                            else:
-                                # Plate seen again — show revisit card
-                                entry = {
-                                    "id": int(track_id),
-                                    "plate": plate_text,
-                                    "time": now.strftime("%H:%M:%S"),
-                                    "date": now.strftime("%d %b %Y"),
-                                    "timestamp": now.isoformat(),
-                                    "revisit": True,
-                                    "last_time": last_record["time"] if last_record else "—",
-                                    "last_date": last_record["date"] if last_record else "—"
-                                }
-                                print(f"[REVISIT] Plate: {plate_text} | Last seen: {last_record}")
-
-                            with plates_lock:
-                                detected_plates.insert(0, entry)
-                                if len(detected_plates) > 50:
-                                    detected_plates.pop()
-
-                    except Exception as e:
-                        print(f"[ERROR] Connection: {e}")
-
-        with frame_lock:
-            latest_frame = frame.copy()
-
-        time.sleep(0.03)
-
-# Start detection in background
-t = threading.Thread(target=detection_loop, daemon=True)
-t.start()
+# Nothing heavy happens at import time: the web server comes up first and
+# these phases run on a background thread, reported via /readyz.
+startup = Startup("anpr-pi")
+FRAMES_COMPONENT = "pipeline" if DETECTOR_MODE == "inline" else "detector_process"
+if DETECTOR_MODE == "inline":
+    startup.expect("db", "detector", "camera", "pipeline")
+else:
+    startup.expect("db", "detector_process")
+
+def start_db():
+    global recently_seen_plates, blob_store, sync_client
+    init_db()
+    blob_store = CropWriter(BLOB_FOLDER, max_files=None, max_bytes=BLOB_MAX_BYTES, max_age_days=None)
+    if RETENTION_DAYS:
+        # Runs where the rows are written (inline, or the detector process)
+        retention.RetentionJob([
+            retention.TableRetention(DB_PATH, "plates", "timestamp", RETENTION_DAYS, ARCHIVE_DIR),
+            retention.FolderRetention(BLOB_FOLDER, RETENTION_DAYS, store=blob_store),
+        ], RETENTION_INTERVAL_HOURS).start()
+    if SYNC_URL:
+        # Where the rows are written, like retention; never blocks the pipeline
+        sync_client = SyncClient(DB_PATH, SITE_ID, SYNC_URL).start()
+    recently_seen_plates = load_processed_plates()  # plates seen in last 5 min before restart
+    print(f"[DB] Loaded {len(recently_seen_plates)} recently seen plates from DB")
+
+def start_frames():
+    pipeline.start_source()
+    # Ready once the first frame has gone through detection
+    while frame_slot.seq == 0:
+        if not pipeline.source_alive():
+            raise RuntimeError("camera source exited during startup")
+        time.sleep(0.01)
+
+def connect_detector():
+    """Split modes: map the detector's frame ring + subscribe to its events."""
+    global frame_slot
+    from detector_service import RemoteDetector, supervise
+    if DETECTOR_MODE == "spawn":
+        threading.Thread(target=supervise, daemon=True, name="detector-supervisor").start()
+    frame_slot = RemoteDetector(RING_NAME, ("127.0.0.1", DETECTOR_IPC_PORT), IPC_AUTHKEY,
+                                on_plate=publish_card)
+    while frame_slot.seq == 0:
+        time.sleep(0.05)
+
+def start_services():
+    try:
+        if DETECTOR_MODE != "inline":
+            startup.run("db", init_db)     # history only; the detector process writes
+            startup.run("detector_process", connect_detector)
+        else:
+            startup.run("db", start_db)
+            # Model load (inside the detect stage's setup) and camera bring-up
+            # are independent: overlap them
+            startup.run_parallel({"detector": pipeline.start_stages, "camera": camera.open})
+            startup.run("pipeline", start_frames)
+    except Exception:
+        pass   # recorded per component; /readyz stays 503
+    startup.finish()
 
 # ---------------------------
 # Video Stream Generator
 # ---------------------------
+stream_lock = threading.Lock()
+stream_cache = (-1, None)    # (frame seq, jpeg bytes) shared by all viewers
+
+def _encode(frame, detections):
+    out = annotate(frame, detections)
+    # Ensure exactly 640x480
+    out = cv2.resize(out, (640, 480))
+    ret, buffer = cv2.imencode('.jpg', out, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buffer.tobytes() if ret else None
+
+def encode_stream_frame():
+    """Annotate + JPEG-encode the latest frame once per new frame.
+    Split modes read the frame in place from the shared-memory ring."""
+    global stream_cache
+    with stream_lock:
+        if stream_cache[0] == frame_slot.seq:
+            return stream_cache[1]
+        t0 = time.perf_counter()
+        seq, jpeg = frame_slot.read(_encode)
+        if jpeg is None:
+            return stream_cache[1]
+        STREAM_ENCODE.observe(time.perf_counter() - t0)
+        stream_cache = (seq, jpeg)
+        return jpeg
+
 def generate_frames():
-    while True:
-        with frame_lock:
-            if latest_frame is None:
+    global viewer_count
+    with viewers_lock:
+        viewer_count += 1
+    try:
+        while True:
+            frame_bytes = encode_stream_frame()
+            if frame_bytes is None:
                 time.sleep(0.05)
                 continue
-            frame = latest_frame.copy()
-
-        # Ensure exactly 640x480
-        frame = cv2.resize(frame, (640, 480))
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        if not ret:
-            continue
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        time.sleep(0.04)
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            time.sleep(0.04)
+    finally:
+        with viewers_lock:
+            viewer_count -= 1
 
 # ---------------------------
 # Routes
@@ -254,34 +447,149 @@ def video_feed():
     return Response(generate_frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the web process is up (used by the watchdog)."""
+    return jsonify(health_payload())
+
+@app.route('/readyz')
+def readyz():
+    """Readiness per component; 503 until everything is up and frames flow."""
+    report = readiness_report()
+    return jsonify(report), (200 if report["ready"] else 503)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape: per-stage latency histograms, counters, queue depths."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/trace')
+def debug_trace():
+    """Last N seconds of per-frame spans as Chrome trace JSON (open in Perfetto).
+    ?seconds=30; seconds=0 returns the whole ring buffer."""
+    seconds = request.args.get("seconds", tracer.DUMP_SECONDS, type=float)
+    return jsonify(tracer.TRACER.dump(seconds))
+
+@app.route('/plates/<int:row_id>/thumb.jpg')
+@app.route('/plates/<int:row_id>/crop.jpg')
+def plate_image(row_id):
+    """Stored plate thumbnail / crop. Blobs are immutable, so clients keep
+    them for a year and revalidate with If-None-Match."""
+    kind = "thumb" if request.path.endswith("thumb.jpg") else "crop"
+    status, headers, body = plate_image_response(row_id, kind, request.headers.get("If-None-Match"))
+    return Response(body, status=status, headers=headers, mimetype="image/jpeg")
+
 @app.route('/api/plates')
 def get_plates():
-    with plates_lock:
-        return jsonify(detected_plates[:20])
+    return jsonify(recent_plates())
 
 @app.route('/api/history')
 def get_history():
-    """Return all saved plates from SQLite DB."""
+    """Latest 200 plates, or ?date=YYYY-MM-DD for one day (archived days included)."""
+    day = request.args.get("date")
+    if day and not valid_day(day):
+        return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+    return jsonify(history_rows(day))
+
+@app.route('/api/history/days')
+def get_history_days():
+    return jsonify(history_days())
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify(stats_payload())
+
+# ---------------------------
+# Payloads (shared by the Flask routes and async_server.py)
+# ---------------------------
+def health_payload():
+    return {"status": "ok", "uptime": startup.report()["uptime"]}
+
+def readiness_report():
+    if startup.components[FRAMES_COMPONENT]["ready"]:
+        idle = time.time() - frame_slot.updated
+        stalled = idle > LOOP_STALL_SECONDS
+        startup.set_ready(FRAMES_COMPONENT, not stalled, "no frame for %.0fs" % idle if stalled else None)
+    return startup.report()
+
+def plate_image_response(row_id, kind, if_none_match=None):
+    """(status, headers, body) for /plates/<id>/{thumb,crop}.jpg."""
+    blob = plate_blob(row_id, kind)
+    if blob is None:
+        BLOB_REQUESTS["missing"].inc()
+        return 404, {"Cache-Control": "no-cache"}, b""
+    etag, path = blob
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={BLOB_CACHE_SECONDS}, immutable"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        BLOB_REQUESTS["not_modified"].inc()
+        return 304, headers, b""
+    with open(path, "rb") as f:
+        body = f.read()
+    BLOB_REQUESTS["ok"].inc()
+    return 200, headers, body
+
+def recent_plates():
+    with plates_lock:
+        return detected_plates[:20]
+
+def valid_day(day):
+    try:
+        return datetime.strptime(day, "%Y-%m-%d").strftime("%Y-%m-%d") == day
+    except ValueError:
+        return False
+
+def history_rows(day=None):
+    """Saved plates from SQLite DB: the latest 200, or every row of one
+    day merged with that day's archive (retention.py) if it has one."""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM plates ORDER BY id DESC LIMIT 200")
+    if day:
+        c.execute("SELECT * FROM plates WHERE substr(timestamp, 1, 10) = ? ORDER BY id DESC", (day,))
+    else:
+        c.execute("SELECT * FROM plates ORDER BY id DESC LIMIT 200")
     rows = [dict(r) for r in c.fetchall()]
     conn.close()
-    return jsonify(rows)
+    for r in rows:
+        r["thumb"] = f"/plates/{r['id']}/thumb.jpg" if r.get("thumb_blob") else None
+    if day:
+        hot = {r["id"] for r in rows}
+        archived = [dict(r, thumb=None, archived=True)
+                    for r in retention.read_archive(ARCHIVE_DIR, "plates", day) if r["id"] not in hot]
+        rows = sorted(rows + archived, key=lambda r: r["id"], reverse=True)
+    return rows
 
-@app.route('/api/stats')
-def get_stats():
+def history_days():
+    return {"archived": retention.archived_days(ARCHIVE_DIR, "plates"),
+            "retention_days": RETENTION_DAYS}
+
+def stats_payload():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute("SELECT COUNT(*) FROM plates")
     total = c.fetchone()[0]
     conn.close()
-    return jsonify({
+    return {
         "total": total,
+        "viewers": viewer_count,
+        "detect": frame_slot.detect_stats,
+        "pipeline": pipeline.stats() if pipeline else getattr(frame_slot, "pipeline_stats", None),
+        "latency": metrics.REGISTRY.snapshot(),
+        "detector_latency": None if pipeline else getattr(frame_slot, "latency", None),
+        "governor": governor.stats() if governor else getattr(frame_slot, "governor_stats", None),
+        "sync": sync_client.stats() if sync_client else getattr(frame_slot, "sync_stats", None),
         "time": datetime.now().strftime("%H:%M:%S"),
         "date": datetime.now().strftime("%A, %d %B %Y")
-    })
+    }
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    tracer.set_process_name("anpr-pi")
+    tracer.install_signal_dump()     # kill -USR1 <pid> -> traces/anpr-pi-*.json
+    threading.Thread(target=start_services, daemon=True).start()
+    if SERVER_MODE == "async":
+        # async_server does `import app`: make that this module, not a second copy
+        sys.modules.setdefault("app", sys.modules[__name__])
+        import async_server
+        async_server.run(host='0.0.0.0', port=WEB_PORT)
+    else:
+        app.run(host='0.0.0.0', port=WEB_PORT, debug=False, threaded=True)
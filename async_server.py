@@ -0,0 +1,352 @@
+"""asyncio serving mode for app.py (SERVER_MODE = "async").
+
+Same routes as the Flask app, but every connection is a coroutine instead
+of an OS thread: an idle /video_feed viewer or dashboard tab costs one
+socket and a few KB. One pump task encodes each new frame once and wakes
+all viewers; a viewer whose send buffer is still full from earlier frames
+simply skips frames instead of buffering them. Also serves /api/events, a
+Server-Sent Events push channel (plate cards + stats) the dashboard uses
+instead of polling when it is available.
+
+Blocking work (JPEG encode, SQLite, metrics / trace rendering) runs on a
+small thread pool so the event loop never waits on it. Stdlib only."""
+import asyncio
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import app
+import metrics
+import tracer
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+SEND_BUFFER_LIMIT = 128 * 1024   # bytes queued per client before frames are dropped
+SOCKET_SNDBUF = 64 * 1024        # kernel send buffer for streaming sockets
+STREAM_INTERVAL = 0.04           # pump: min seconds between encoded frames
+EVENT_QUEUE = 64                 # pending SSE events per client; oldest dropped when full
+STATS_PUSH_SECONDS = 2.0         # one stats_payload() per interval, shared by all SSE clients
+KEEPALIVE_SECONDS = 15           # SSE ping / idle check interval
+IDLE_SECONDS = 30                # close a keep-alive connection idle this long
+MAX_HEADER_BYTES = 16384
+EXECUTOR_WORKERS = 4
+BACKLOG = 512
+
+STREAM_DROPS = metrics.counter("stream_frames_dropped", "MJPEG frames skipped for slow viewers")
+EVENT_DROPS = metrics.counter("events_dropped", "SSE events dropped for slow subscribers")
+CONNECTIONS = metrics.gauge("web_connections", "Open connections to the async web server")
+SUBSCRIBERS = metrics.gauge("event_subscribers", "Open /api/events streams")
+
+_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _head(status, ctype, extra=(), length=None, keep_alive=False):
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {ctype}"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    lines.extend(extra)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _json(obj, status=200):
+    return status, "application/json", json.dumps(obj).encode("utf-8")
+
+
+def _over_limit(writer):
+    return writer.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT
+
+
+def _shrink_sndbuf(writer):
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+        except OSError:
+            pass
+
+
+async def _blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+# ---------------------------
+# MJPEG fan-out
+# ---------------------------
+class FrameFeed:
+    """Encodes the newest frame once (app.encode_stream_frame) and wakes
+    every viewer. Runs only while someone is watching."""
+
+    def __init__(self):
+        self.jpeg = None
+        self.version = 0
+        self.viewers = 0
+        self.cond = asyncio.Condition()
+        self.task = None
+
+    def join(self):
+        self.viewers += 1
+        with app.viewers_lock:
+            app.viewer_count += 1
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._pump())
+
+    def leave(self):
+        self.viewers -= 1
+        with app.viewers_lock:
+            app.viewer_count -= 1
+
+    async def _pump(self):
+        last = None
+        try:
+            while self.viewers:
+                seq = app.frame_slot.seq
+                if seq != last:
+                    jpeg = await _blocking(app.encode_stream_frame)
+                    if jpeg is not None and jpeg is not self.jpeg:
+                        last = seq
+                        self.jpeg = jpeg
+                        self.version += 1
+                        async with self.cond:
+                            self.cond.notify_all()
+                await asyncio.sleep(STREAM_INTERVAL)
+        finally:
+            self.task = None
+
+    async def wait(self, seen):
+        """Newest (version, jpeg) after `seen`, or None after KEEPALIVE_SECONDS."""
+        async with self.cond:
+            try:
+                await asyncio.wait_for(self.cond.wait_for(lambda: self.version != seen),
+                                       KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                return None
+            return self.version, self.jpeg
+
+
+# ---------------------------
+# Server-Sent Events
+# ---------------------------
+class EventFeed:
+    """Bounded per-subscriber queues, filled on the event loop thread."""
+
+    def __init__(self):
+        self.queues = set()
+
+    def publish(self, name, obj):
+        data = f"event: {name}\ndata: {json.dumps(obj)}\n\n".encode("utf-8")
+        for q in self.queues:
+            if q.full():
+                q.get_nowait()
+                EVENT_DROPS.inc()
+            q.put_nowait(data)
+
+    def subscribe(self):
+        q = asyncio.Queue(EVENT_QUEUE)
+        self.queues.add(q)
+        SUBSCRIBERS.inc()
+        return q
+
+    def unsubscribe(self, q):
+        self.queues.discard(q)
+        SUBSCRIBERS.dec()
+
+    async def push_stats(self):
+        while True:
+            if self.queues:
+                try:
+                    self.publish("stats", await _blocking(app.stats_payload))
+                except Exception as e:
+                    print(f"[WEB] stats push failed: {e}")
+            await asyncio.sleep(STATS_PUSH_SECONDS)
+
+
+# ---------------------------
+# HTTP
+# ---------------------------
+class AsyncWebServer:
+    def __init__(self):
+        self.feed = FrameFeed()
+        self.events = EventFeed()
+        self.routes = {
+            "/": self.index,
+            "/healthz": lambda q: _json(app.health_payload()),
+            "/readyz": self.readyz,
+            "/metrics": self.prometheus_metrics,
+            "/debug/trace": self.debug_trace,
+            "/api/plates": lambda q: _json(app.recent_plates()),
+            "/api/history": self.history,
+            "/api/history/days": lambda q: _json(app.history_days()),
+            "/api/stats": self.stats,
+        }
+        self.streams = {
+            "/video_feed": self.video_feed,
+            "/api/events": self.event_stream,
+        }
+        self._index = None
+
+    # --- plain routes: handler(query) -> (status, content_type, body[, extra headers]) ---
+    def index(self, query):
+        if self._index is None:
+            flask_app = app.app
+            path = os.path.join(flask_app.root_path, flask_app.template_folder, "index.html")
+            if not os.path.exists(path):
+                path = os.path.join(flask_app.root_path, "index.html")
+            with open(path, "rb") as f:
+                self._index = f.read()
+        return 200, "text/html; charset=utf-8", self._index
+
+    def readyz(self, query):
+        report = app.readiness_report()
+        return _json(report, 200 if report["ready"] else 503)
+
+    async def prometheus_metrics(self, query):
+        return 200, metrics.CONTENT_TYPE, (await _blocking(metrics.render)).encode("utf-8")
+
+    async def debug_trace(self, query):
+        seconds = float(query.get("seconds", [tracer.DUMP_SECONDS])[0])
+        return _json(await _blocking(tracer.TRACER.dump, seconds))
+
+    async def plate_image(self, path, headers):
+        """/plates/<id>/thumb.jpg | crop.jpg, with ETag revalidation."""
+        parts = path.strip("/").split("/")
+        if len(parts) != 3 or not parts[1].isdigit() or parts[2] not in ("thumb.jpg", "crop.jpg"):
+            return _json({"error": "not found"}, 404)
+        status, extra, body = await _blocking(app.plate_image_response, int(parts[1]),
+                                              parts[2][:-4], headers.get("if-none-match"))
+        return status, "image/jpeg", body, [f"{k}: {v}" for k, v in extra.items()]
+
+    async def history(self, query):
+        day = query.get("date", [None])[0]
+        if day and not app.valid_day(day):
+            return _json({"error": "date must be YYYY-MM-DD"}, 400)
+        return _json(await _blocking(app.history_rows, day))
+
+    async def stats(self, query):
+        return _json(await _blocking(app.stats_payload))
+
+    # --- streams: handler(query, writer), own the connection until it closes ---
+    async def video_feed(self, query, writer):
+        _shrink_sndbuf(writer)
+        writer.write(_head(200, "multipart/x-mixed-replace; boundary=frame",
+                           ["Cache-Control: no-cache"]))
+        self.feed.join()
+        seen = 0
+        try:
+            while not writer.is_closing():
+                got = await self.feed.wait(seen)
+                if got is None:
+                    continue
+                seen, jpeg = got
+                if _over_limit(writer):
+                    STREAM_DROPS.inc()        # still sending older frames: skip this one
+                    continue
+                writer.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            self.feed.leave()
+
+    async def event_stream(self, query, writer):
+        _shrink_sndbuf(writer)
+        writer.write(_head(200, "text/event-stream",
+                           ["Cache-Control: no-cache", "X-Accel-Buffering: no"]))
+        writer.write(b"retry: 3000\n\n")
+        q = self.events.subscribe()
+        try:
+            while not writer.is_closing():
+                try:
+                    data = await asyncio.wait_for(q.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    data = b": ping\n\n"
+                if _over_limit(writer):
+                    # Too far behind: hang up, the browser reconnects and re-syncs via /api/plates
+                    EVENT_DROPS.inc()
+                    break
+                writer.write(data)
+        finally:
+            self.events.unsubscribe(q)
+
+    async def handle(self, reader, writer):
+        CONNECTIONS.inc()
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    status, ctype, body = _json({"error": "bad request"}, 400)
+                    writer.write(_head(status, ctype, length=len(body)) + body)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                url = urlsplit(target)
+                query = parse_qs(url.query)
+
+                extra = ()
+                if method not in ("GET", "HEAD"):
+                    status, ctype, body = _json({"error": "method not allowed"}, 405)
+                    keep_alive = False
+                elif url.path in self.streams:
+                    if method == "GET":
+                        await self.streams[url.path](query, writer)
+                        break
+                    # A stream has no length to report: HEAD is not offered
+                    status, ctype, body = _json({"error": "method not allowed"}, 405)
+                    extra = ["Allow: GET"]
+                elif url.path in self.routes or url.path.startswith("/plates/"):
+                    try:
+                        if url.path in self.routes:
+                            result = self.routes[url.path](query)
+                        else:
+                            result = self.plate_image(url.path, headers)
+                        if asyncio.iscoroutine(result):
+                            result = await result
+                        status, ctype, body = result[:3]
+                        extra = result[3] if len(result) > 3 else ()
+                    except Exception as e:
+                        status, ctype, body = _json({"error": str(e)}, 500)
+                else:
+                    status, ctype, body = _json({"error": "not found"}, 404)
+
+                writer.write(_head(status, ctype, extra, length=len(body), keep_alive=keep_alive))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            CONNECTIONS.dec()
+            writer.close()
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(EXECUTOR_WORKERS, thread_name_prefix="web"))
+        # Plate cards arrive on pipeline / event-channel threads
+        app.plate_listeners.append(
+            lambda entry: loop.call_soon_threadsafe(self.events.publish, "plate", entry))
+        server = await asyncio.start_server(self.handle, host, port,
+                                            limit=MAX_HEADER_BYTES, backlog=BACKLOG)
+        print(f"[WEB] asyncio server on http://{host}:{port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.events.push_stats())
+
+
+def run(host="0.0.0.0", port=5000):
+    try:
+        asyncio.run(AsyncWebServer().serve(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -2,37 +2,111 @@ import socket
 import struct
 import numpy as np
 import cv2
-import os
-from datetime import datetime
-from paddleocr import PaddleOCR
 import re
+import threading
+import time
+import queue
+import metrics
+import tracer
+from startup import Startup
+from status_server import start_status_server, json_response
+from crop_store import CropWriter
+import ocr_protocol as proto
+from ocr_cache import PHashCache, phash
+import plate_grammar
 
 # ---------------------------
 # CONFIG
 # ---------------------------
 PORT = 9999
+HEALTH_PORT = 9998            # /healthz, /readyz
 SAVE_FOLDER = "received_plates"
-os.makedirs(SAVE_FOLDER, exist_ok=True)
+SAVE_MAX_FILES = 20000        # retention caps for SAVE_FOLDER (oldest go first)
+SAVE_MAX_MB = 500
+SAVE_MAX_AGE_DAYS = 30
+SAVE_SAMPLE_RATE = 1.0        # fraction of crops kept (e.g. 0.2 on busy sites)
+OCR_CODECS = ["jpeg", "png", "raw"]   # v2 codecs we accept, in our preference order
+REC_HEIGHT = proto.REC_HEIGHT         # crops normalized to this height skip our resize
+OCR_CACHE_SIZE = 512          # perceptual-hash result cache (0 = off)
+OCR_CACHE_MAX_DISTANCE = 6    # Hamming bits (of 64) for a cache hit
+OCR_CACHE_TTL = 120           # seconds a cached read stays valid
+IDLE_TIMEOUT = 300            # close idle persistent connections after this many seconds
+OCR_MIN_SCORE = 0.3           # text lines below this recognizer score are ignored
+OCR_WORKERS = 1               # PaddleOCR instances (each ~300 MB); requests share them
+PLATE_GRAMMAR = True          # decode reads onto the Indian plate format (plate_grammar.py)
+
+ocr_pool = queue.Queue()      # idle instances; PaddleOCR itself is not thread-safe
+crop_writer = None
+ocr_cache = (PHashCache(OCR_CACHE_SIZE, OCR_CACHE_MAX_DISTANCE, OCR_CACHE_TTL)
+             if OCR_CACHE_SIZE else None)
+startup = Startup("ocr-server")
+startup.expect("paddleocr", "warmup", "tcp_listener")
+
+DECODE = metrics.histogram("server_decode_seconds", "Decoding a received crop")
+INFERENCE = metrics.histogram("ocr_inference_seconds", "PaddleOCR predict()")
+POOL_WAIT = metrics.histogram("ocr_pool_wait_seconds", "Waiting for a free OCR worker")
+REQUEST = metrics.histogram("server_request_seconds", "Whole OCR request on the server (decode to reply)")
+REQUESTS = {proto_name: metrics.counter("server_requests", "OCR requests served", protocol=proto_name)
+            for proto_name in ("legacy", "v2")}
+CACHE_HITS = metrics.counter("ocr_cache_hits", "Requests answered from the pHash cache")
+DECODE_ERRORS = metrics.counter("server_decode_errors", "Crops that failed to decode")
+CONNECTIONS = metrics.gauge("server_connections", "Open Pi connections")
+PLATE_READS = {result: metrics.counter("plate_reads", "OCR reads by plate-format check", result=result)
+               for result in ("valid", "repaired", "invalid")}
 
 # ---------------------------
 # Load PaddleOCR (once)
 # ---------------------------
-print("🔄 Loading PaddleOCR...")
-ocr = PaddleOCR(
-    use_doc_orientation_classify=False,
-    use_doc_unwarping=False,
-    use_textline_orientation=False,
-    lang="en"
-)
-print("✅ PaddleOCR Ready!\n")
+def load_ocr(workers=None):
+    workers = workers or OCR_WORKERS
+    print(f"🔄 Loading PaddleOCR x{workers}...")
+    from paddleocr import PaddleOCR   # lazy: heavy import, timed by startup
+    set_ocr_engines([
+        PaddleOCR(
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+            lang="en"
+        )
+        for _ in range(workers)
+    ])
+    print("✅ PaddleOCR Ready!\n")
+
+
+def set_ocr_engines(engines):
+    """Put OCR engines (anything with predict(img)) in the worker pool."""
+    for engine in engines:
+        ocr_pool.put(engine)
+
+
+def warmup_ocr():
+    """Run one synthetic plate through OCR so the first real crop is not slow."""
+    img = np.full((48, 220, 3), 255, dtype=np.uint8)
+    cv2.putText(img, "MH12AB1234", (6, 36), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+    for _ in range(ocr_pool.qsize()):   # the pool is FIFO: this touches every worker
+        print(f"🔥 Warmup OCR: '{run_ocr(img)}'")
 
 # ---------------------------
 # OCR Function (predict API)
 # ---------------------------
-def run_ocr(img):
-    result = ocr.predict(img)
+def run_ocr_detail(img):
+    """Returns (plate_text, mean confidence of the kept text lines)."""
+    t0 = time.perf_counter()
+    engine = ocr_pool.get()          # blocks while all workers are busy
+    POOL_WAIT.observe(time.perf_counter() - t0)
+    try:
+        with INFERENCE.time(), tracer.span("ocr_inference", "ocr"):
+            result = engine.predict(img)
+    finally:
+        ocr_pool.put(engine)
+    return parse_ocr_result(result)
 
+
+def parse_ocr_result(result, min_score=None):
+    """PaddleOCR predict() output -> (plate_text, mean confidence of kept lines)."""
+    min_score = OCR_MIN_SCORE if min_score is None else min_score
     plate_text = ""
+    kept = []
 
     if result and isinstance(result, list):
         if len(result) > 0 and "rec_texts" in result[0]:
@@ -40,81 +114,276 @@ def run_ocr(img):
             scores = result[0].get("rec_scores", [])
 
             for text, score in zip(texts, scores):
-                if score > 0.3:
+                if score > min_score:
                     plate_text += text.upper().strip() + " "
+                    kept.append(float(score))
 
     # Clean plate
     plate_text = re.sub(r'[^A-Z0-9]', '', plate_text)
 
-    return plate_text.strip()
+    return plate_text.strip(), (sum(kept) / len(kept) if kept else 0.0)
+
+
+def run_ocr(img):
+    return run_ocr_detail(img)[0]
+
+
+def check_plate(plate_text, conf):
+    """(plate_text, valid): the read decoded onto the plate format with
+    letter/digit repair, or the raw read flagged invalid."""
+    if not PLATE_GRAMMAR or not plate_text:
+        return plate_text, bool(plate_text)
+    read = plate_grammar.decode_text(plate_text, conf)
+    if not read["valid"]:
+        PLATE_READS["invalid"].inc()
+        print(f"⚠️  Not a plate format: '{plate_text}'")
+        return plate_text, False
+    if read["text"] != plate_text:
+        PLATE_READS["repaired"].inc()
+        print(f"🔧 Repaired: '{plate_text}' -> '{read['text']}' {read['repairs']}")
+    else:
+        PLATE_READS["valid"].inc()
+    return read["text"], True
+
+
+def run_ocr_cached(img, use_cache=True):
+    """run_ocr_detail + check_plate behind the perceptual-hash cache.
+    Returns (plate_text, conf, cache_hit, valid). Only valid reads are
+    cached, so a retry of an invalid read runs OCR again. use_cache=False
+    (v2 header "no_cache", loadgen.py) always runs OCR."""
+    h = phash(img) if ocr_cache is not None and use_cache else None
+    hit = ocr_cache.get(h) if h is not None else None
+    if hit is not None:
+        return hit[0], hit[1], True, True
+    plate_text, conf = run_ocr_detail(img)
+    plate_text, valid = check_plate(plate_text, conf)
+    if h is not None and plate_text and valid:
+        ocr_cache.put(h, plate_text, conf)
+    return plate_text, conf, False, valid
+
+
+def prepare_crop(img, header):
+    """Bring a decoded crop to what PaddleOCR wants, skipping steps the
+    Pi already did (height normalization)."""
+    if header.get("height") != REC_HEIGHT and img.shape[0] != REC_HEIGHT:
+        img = proto.normalize_crop(img, REC_HEIGHT, gray=False)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img
+
+
+def store_crop(payload, header):
+    """Queue the received bytes for storage; raw frames become PNG on the writer thread."""
+    codec = header.get("codec", "jpeg")
+    if codec == "raw":
+        shape = header["shape"]
+        return crop_writer.submit(payload, "png", encode=lambda d: proto.encode_crop(
+            np.frombuffer(d, np.uint8).reshape(shape), "png"))
+    return crop_writer.submit(payload, "png" if codec == "png" else "jpg")
 
 
 # ---------------------------
-# Start TCP Server
+# Handle one Pi connection
 # ---------------------------
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind(("0.0.0.0", PORT))
-server.listen(5)
-
-print(f"🚀 Windows OCR Server listening on port {PORT}")
-print("Waiting for Raspberry Pi...\n")
+def handle_legacy(conn, track_id_data):
+    """Original one-shot framing: track id, size, JPEG -> plain text."""
+    track_id = struct.unpack(">I", track_id_data)[0]
 
-while True:
-    try:
-        conn, addr = server.accept()
-        print(f"📡 Connected from: {addr}")
+    # ---- Receive Image Size ----
+    size = struct.unpack(">I", proto.recv_exact(conn, 4))[0]
 
-        # ---- Receive Track ID ----
-        track_id_data = conn.recv(4)
-        track_id = struct.unpack(">I", track_id_data)[0]
+    print(f"   Track ID: {track_id} | Image Size: {size} bytes")
 
-        # ---- Receive Image Size ----
-        size_data = conn.recv(4)
-        size = struct.unpack(">I", size_data)[0]
+    # ---- Receive Image Data ----
+    data = proto.recv_exact(conn, size)
 
-        print(f"   Track ID: {track_id} | Image Size: {size} bytes")
+    # ---- Decode Image ----
+    t0 = time.perf_counter()
+    t_wall = time.time()
+    np_arr = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    DECODE.observe(time.perf_counter() - t0)
+    tracer.TRACER.add("decode", t_wall, time.perf_counter() - t0, "ocr", codec="jpeg")
+    REQUESTS["legacy"].inc()
 
-        # ---- Receive Image Data ----
-        data = b""
-        while len(data) < size:
-            packet = conn.recv(4096)
-            if not packet:
-                break
-            data += packet
-
-        # ---- Decode Image ----
-        np_arr = np.frombuffer(data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-        if img is None:
-            print("❌ Image decode failed")
-            result_bytes = "".encode("utf-8")
-            conn.sendall(struct.pack(">I", len(result_bytes)))
-            conn.sendall(result_bytes)
-            conn.close()
-            continue
-
-        # ---- Save Image ----
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.join(SAVE_FOLDER, f"plate_{track_id}_{timestamp}.jpg")
-        cv2.imwrite(filename, img)
-        print(f"💾 Saved: {filename}")
+    if img is None:
+        DECODE_ERRORS.inc()
+        print("❌ Image decode failed")
+        plate_text = ""
+    else:
+        # ---- Save Image (received JPEG bytes as-is, written in background) ----
+        saved = crop_writer.submit(data)
+        if saved:
+            print(f"💾 Queued: {saved}")
 
         # ---- Run OCR ----
-        plate_text = run_ocr(img)
-        print(f"🔤 OCR Result: '{plate_text}'")
+        plate_text, _, hit, valid = run_ocr_cached(img)
+        if hit:
+            CACHE_HITS.inc()
+        print(f"🔤 OCR Result: '{plate_text}'" + (" (cache)" if hit else ""))
+        if not valid:
+            plate_text = ""     # legacy Pis persist any text: send nothing instead of junk
 
-        # ---- Send Back Result ----
-        result_bytes = plate_text.encode("utf-8")
-        conn.sendall(struct.pack(">I", len(result_bytes)))
-        conn.sendall(result_bytes)
+    # ---- Send Back Result ----
+    result_bytes = plate_text.encode("utf-8")
+    conn.sendall(struct.pack(">I", len(result_bytes)))
+    conn.sendall(result_bytes)
+    REQUEST.observe(time.perf_counter() - t0)
+    tracer.TRACER.add("ocr_request", t_wall, time.perf_counter() - t0, "ocr",
+                      track_id=track_id, protocol="legacy", text=plate_text)
+    print("✅ Result sent back to Pi\n")
 
-        conn.close()
-        print("✅ Result sent back to Pi\n")
 
-    except KeyboardInterrupt:
-        print("Server stopped.")
-        break
+def handle_v2_request(header, payload):
+    if header.get("type") == "hello":
+        caps = proto.negotiate(header, OCR_CODECS, REC_HEIGHT)
+        print(f"🤝 Negotiated: {caps['codec']} q={caps['quality']} h={caps['rec_height']}")
+        return caps
+
+    track_id = header.get("track_id")
+    request_id = header.get("request_id")
+    print(f"   Track ID: {track_id} | {header.get('codec')} {header.get('shape')} | {len(payload)} bytes"
+          + (f" | request {request_id}" if request_id else ""))
+    REQUESTS["v2"].inc()
+    with DECODE.time(), tracer.span("decode", "ocr", codec=header.get("codec")):
+        img = proto.decode_crop(payload, header)
+    if img is None or img.size == 0:
+        DECODE_ERRORS.inc()
+        print("❌ Image decode failed")
+        return {"text": "", "conf": 0.0, "error": "decode", "request_id": request_id}
+
+    saved = store_crop(payload, header)
+    if saved:
+        print(f"💾 Queued: {saved}")
+
+    plate_text, conf, hit, valid = run_ocr_cached(prepare_crop(img, header),
+                                                  use_cache=not header.get("no_cache"))
+    if hit:
+        CACHE_HITS.inc()
+    print(f"🔤 OCR Result: '{plate_text}' ({conf:.2f})" + (" (cache)" if hit else ""))
+    return {"text": plate_text, "conf": round(conf, 4), "cached": hit, "valid": valid,
+            "request_id": request_id}
+
+
+def handle_client(conn, addr):
+    print(f"📡 Connected from: {addr}")
+    conn.settimeout(IDLE_TIMEOUT)
+    CONNECTIONS.inc()
+    try:
+        first = proto.recv_exact(conn, 4)
+        if first != proto.MAGIC:
+            handle_legacy(conn, first)
+            return
+        # v2: keep serving requests on this connection until the Pi hangs up
+        while first == proto.MAGIC:
+            header, payload = proto.recv_frame_body(conn)
+            t0 = time.perf_counter()
+            t_wall = time.time()
+            reply = handle_v2_request(header, payload)
+            proto.send_reply(conn, reply)
+            if header.get("type") != "hello":
+                REQUEST.observe(time.perf_counter() - t0)
+                # Same request_id as the Pi's ocr_request span: line the two traces up on it
+                tracer.TRACER.add("ocr_request", t_wall, time.perf_counter() - t0, "ocr",
+                                  track_id=header.get("track_id"), protocol="v2",
+                                  request_id=header.get("request_id"), text=reply.get("text"),
+                                  cached=reply.get("cached"))
+            first = proto.recv_exact(conn, 4)   # ConnectionError on clean close
+        print("❌ Bad frame, closing")
+    except (ConnectionError, socket.timeout):
+        pass
     except Exception as e:
         print("❌ Error:", e)
+    finally:
+        CONNECTIONS.dec()
+        conn.close()
+
+
+# ---------------------------
+# Start TCP Server
+# ---------------------------
+def open_server(port=None, host="0.0.0.0"):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, PORT if port is None else port))
+    server.listen(5)
+    return server
+
+
+def serve_forever(server):
+    """Accept loop: one thread per Pi connection."""
+    while True:
+        try:
+            conn, addr = server.accept()
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+        except KeyboardInterrupt:
+            print("Server stopped.")
+            break
+        except OSError as e:
+            if server.fileno() == -1:   # closed by the owner (bench / tests)
+                break
+            print("❌ Error:", e)
+        except Exception as e:
+            print("❌ Error:", e)
+
+
+def health(query):
+    return json_response({"status": "ok", "uptime": startup.report()["uptime"]})
+
+
+def ready(query):
+    report = startup.report()
+    return json_response(report, 200 if report["ready"] else 503)
+
+
+def stats(query):
+    return json_response({
+        "cpu_seconds": round(time.process_time(), 3),   # whole process, all threads
+        "uptime": startup.report()["uptime"],
+        "ocr_workers": OCR_WORKERS,
+        "crops": crop_writer.stats() if crop_writer else None,
+        "ocr_cache": ocr_cache.stats() if ocr_cache else None,
+    })
+
+
+def prometheus(query):
+    return 200, metrics.CONTENT_TYPE, metrics.render().encode("utf-8")
+
+
+# Crop writer backlog, read at scrape time
+metrics.gauge("crop_writer_pending", "Crops waiting to be written",
+              fn=lambda: crop_writer.queue.qsize() if crop_writer else 0)
+metrics.counter("crop_writer_dropped", "Crops dropped because the write queue was full",
+                fn=lambda: crop_writer.dropped if crop_writer else 0)
+
+
+def trace_dump(query):
+    """?seconds=30 -> Chrome trace JSON of recent requests (open in Perfetto)."""
+    seconds = float(query.get("seconds", [tracer.DUMP_SECONDS])[0])
+    return json_response(tracer.TRACER.dump(seconds))
+
+
+def main():
+    global crop_writer
+    tracer.set_process_name("ocr-server")
+    tracer.install_signal_dump()     # kill -USR1 <pid> (not on Windows: use /trace)
+    crop_writer = CropWriter(SAVE_FOLDER, max_files=SAVE_MAX_FILES,
+                             max_bytes=SAVE_MAX_MB * 1024 * 1024,
+                             max_age_days=SAVE_MAX_AGE_DAYS, sample_rate=SAVE_SAMPLE_RATE)
+    # Health endpoints come up first so a supervisor can watch startup
+    start_status_server(HEALTH_PORT, {"/healthz": health, "/readyz": ready, "/stats": stats,
+                                      "/metrics": prometheus, "/trace": trace_dump})
+
+    startup.run("paddleocr", load_ocr)
+    startup.run("warmup", warmup_ocr)
+    # Only accept Pi connections once OCR is warm
+    server = startup.run("tcp_listener", open_server)
+    startup.finish()
+
+    print(f"🚀 Windows OCR Server listening on port {PORT}")
+    print("Waiting for Raspberry Pi...\n")
+    serve_forever(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""End-to-end benchmark: replay frames through the app.py pipeline.
+
+    python bench.py --source synthetic:900 --detector stub --ocr local-stub
+    python bench.py --source video:gate.mp4 --fps 25 --ocr local
+    python bench.py --source dir:frames/ --ocr 192.168.0.101:9999 --out runs/pi4.json
+
+--source  any frame_source spec (video:, dir:, synthetic[:n])
+--ocr     local       basewindow.py in a child process with PaddleOCR
+          local-stub  basewindow.py in a child process, OCR replaced by a fixed delay
+          host:port   an already running OCR server
+Reports sustained fps, camera-to-DB latency percentiles, OCR calls per
+vehicle and CPU/RAM as JSON, so runs can be diffed over time. cpu_* and
+*rss_mb are the Pi side only; a local OCR server's usage is reported
+separately under ocr_server. The plates DB and received crops go to a
+temp dir, never the live ones.
+
+Without --fps the detect channel blocks, so every frame is detected and
+sustained_fps is the pipeline's rate; with --fps it drops the oldest
+frame like the Pi does and frames_dropped shows what a live camera would
+lose. Pipeline logs go to stderr: `bench.py > run.json` is the report."""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import metrics
+from anpr_stages import FrameSlot, TrackLedger
+from frame_source import open_source
+from pipeline import BLOCK, DROP_OLDEST
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+STUB_OCR_MS = 60             # local-stub inference time
+JOIN_TIMEOUT = 600
+
+
+class TapSlot(FrameSlot):
+    """FrameSlot that also records every plate track ID seen (= vehicles)."""
+
+    def __init__(self, plate_class="licence"):
+        super().__init__()
+        self.plate_class = plate_class
+        self.plate_tracks = set()
+
+    def publish(self, pkt):
+        super().publish(pkt)
+        for d in pkt["detections"]:
+            if d["class_name"].lower() == self.plate_class:
+                self.plate_tracks.add(d["track_id"])
+
+
+class StubOcr:
+    """PaddleOCR stand-in with a fixed delay; text derives from the crop hash
+    so the server's cache and the Pi's dedup still see distinct plates."""
+
+    def __init__(self, delay_ms=STUB_OCR_MS):
+        self.delay = delay_ms / 1000.0
+
+    def predict(self, img):
+        from ocr_cache import phash
+        time.sleep(self.delay)
+        h = phash(img)
+        # plate-format text, so it passes the server's plate_grammar check
+        return [{"rec_texts": ["MH%02dAB%04d" % ((h >> 56) % 100, (h >> 40) % 10000)],
+                 "rec_scores": [0.99]}]
+
+
+def _local_ocr_main(stub, workdir, stub_ms, conn):
+    """Child process: basewindow.py's server on a free local port."""
+    sys.stdout = sys.stderr          # server prints are logs, not the report
+    import basewindow
+    from crop_store import CropWriter
+    basewindow.crop_writer = CropWriter(os.path.join(workdir, "received_plates"))
+    if stub:
+        basewindow.set_ocr_engines([StubOcr(stub_ms) for _ in range(basewindow.OCR_WORKERS)])
+    else:
+        basewindow.load_ocr()
+        basewindow.warmup_ocr()
+    server = basewindow.open_server(port=0, host="127.0.0.1")
+    conn.send(server.getsockname()[1])
+    conn.close()
+    basewindow.serve_forever(server)
+
+
+def start_local_ocr(stub, workdir, stub_ms=STUB_OCR_MS):
+    """Run the OCR server in its own process, so its CPU and memory stay
+    out of the Pi-side numbers; returns (process, port)."""
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_local_ocr_main, args=(stub, workdir, stub_ms, child),
+                       daemon=True, name="bench-ocr")
+    proc.start()
+    child.close()
+    if not parent.poll(JOIN_TIMEOUT):
+        proc.terminate()
+        raise SystemExit("[BENCH] local OCR server did not start")
+    return proc, parent.recv()
+
+
+def rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def proc_usage(pid):
+    """(cpu seconds, peak RSS MB) of another process from /proc, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            hwm = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, ValueError, StopIteration):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")   # utime + stime
+    return cpu, hwm / 1024.0
+
+
+def hist(name):
+    return metrics.histogram(name).snapshot()
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="anpr-bench-")
+    ocr_proc = None
+    if args.ocr in ("local", "local-stub"):
+        ocr_proc, port = start_local_ocr(args.ocr == "local-stub", workdir, args.stub_ms)
+        host = "127.0.0.1"
+    else:
+        host, _, port = args.ocr.rpartition(":")
+        port = int(port)
+    try:
+        return _run(args, workdir, host, port, ocr_proc)
+    finally:
+        if ocr_proc is not None:
+            ocr_proc.terminate()
+            ocr_proc.join(5)
+
+
+def _run(args, workdir, host, port, ocr_proc):
+
+    import app      # the real pipeline configuration (Flask is not started)
+    app.DB_PATH = os.path.join(workdir, "plates.db")
+    app.init_db()
+
+    source = open_source(args.source, app.FRAME_SIZE, fps=args.fps)
+    slot = TapSlot()
+    pipeline = app.build_pipeline(source, slot, TrackLedger(), host, port,
+                                  backend=args.detector, name="bench", source_interval=0,
+                                  detect_drop=DROP_OLDEST if args.fps else BLOCK)
+
+    pipeline.start_stages()
+    source.open()
+    ocr0 = proc_usage(ocr_proc.pid) if ocr_proc else None
+    ru0, t0 = resource.getrusage(resource.RUSAGE_SELF), time.perf_counter()
+    pipeline.start_source()
+    pipeline.join(args.timeout)
+    elapsed = time.perf_counter() - t0
+    ru1 = resource.getrusage(resource.RUSAGE_SELF)
+    ocr1 = proc_usage(ocr_proc.pid) if ocr_proc else None
+    source.close()
+    ocr_server = None
+    if ocr0 and ocr1:
+        ocr_server = {"cpu_seconds": round(ocr1[0] - ocr0[0], 3),
+                      "cpu_percent": round(100.0 * (ocr1[0] - ocr0[0]) / elapsed, 1),
+                      "rss_mb": rss_mb(ocr_proc.pid),
+                      "max_rss_mb": round(ocr1[1], 1)}
+
+    stages = pipeline.stats()["stages"]
+    cpu = (ru1.ru_utime - ru0.ru_utime) + (ru1.ru_stime - ru0.ru_stime)
+    vehicles = len(slot.plate_tracks)
+    ocr_calls = stages["ocr"]["processed"]
+    with app.sqlite3.connect(app.DB_PATH) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM plates").fetchone()[0]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "config": {
+            "source": args.source,
+            "replay_fps": args.fps,
+            "detect_channel": DROP_OLDEST if args.fps else BLOCK,
+            "detector": args.detector,
+            "ocr": args.ocr,
+            "frame_size": list(app.FRAME_SIZE),
+            "detect_every": app.DETECT_EVERY,
+            "motion_gate": app.MOTION_GATE,
+            "ocr_workers": app.OCR_WORKERS,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "frames_in": pipeline.source_count,
+        "frames_detected": stages["detect"]["processed"],
+        "frames_dropped": stages["detect"]["dropped"],
+        "source_fps": round(pipeline.source_count / elapsed, 2),
+        "sustained_fps": round(stages["detect"]["processed"] / elapsed, 2),
+        "latency": {
+            "camera_to_db": hist("camera_to_db_seconds"),
+            "track": hist("track_seconds"),
+            "ocr_round_trip": hist("ocr_round_trip_seconds"),
+            "db_write": hist("db_write_seconds"),
+        },
+        "vehicles": vehicles,
+        "ocr_calls": ocr_calls,
+        "ocr_calls_per_vehicle": round(ocr_calls / vehicles, 3) if vehicles else None,
+        "plates_saved": rows,
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(100.0 * cpu / elapsed, 1),
+        "rss_mb": rss_mb(),
+        "max_rss_mb": round(ru1.ru_maxrss / 1024.0, 1),   # KB on Linux
+        "ocr_server": ocr_server,                           # local OCR child, or None
+        "stages": stages,
+        "workdir": workdir,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay frames through the ANPR pipeline and report")
+    ap.add_argument("--source", default="synthetic:600", help="frame_source spec")
+    ap.add_argument("--fps", type=float, default=None,
+                    help="replay rate, dropping frames the detector misses "
+                         "(default: every frame, as fast as the pipeline detects them)")
+    ap.add_argument("--detector", default="stub",
+                    help="stub | auto | ultralytics | onnx | openvino | ncnn")
+    ap.add_argument("--ocr", default="local-stub", help="local | local-stub | host:port")
+    ap.add_argument("--stub-ms", type=float, default=STUB_OCR_MS)
+    ap.add_argument("--timeout", type=float, default=JOIN_TIMEOUT)
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):     # pipeline prints are logs
+        report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+MAX_FILES = 20000            # keep at most this many crops (None = no limit)
+MAX_BYTES = 500 * 1024 * 1024
+MAX_AGE_DAYS = 30            # older crops are pruned (None = keep)
+SAMPLE_RATE = 1.0            # fraction of received crops that get stored
+QUEUE_SIZE = 256             # pending writes; new crops are dropped when full
+
+
+# ---------------------------
+# Content-addressed async crop writer
+# ---------------------------
+class CropWriter:
+    """Writes received crop bytes as-is on a background thread.
+
+    Files are named by the SHA-1 of their content, so a repeated crop is
+    stored once. Size, count and age caps evict the oldest files first.
+    submit() never blocks the request path: when the queue is full the
+    crop is dropped and counted."""
+
+    def __init__(self, folder, max_files=MAX_FILES, max_bytes=MAX_BYTES,
+                 max_age_days=MAX_AGE_DAYS, sample_rate=SAMPLE_RATE, queue_size=QUEUE_SIZE):
+        self.folder = folder
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.sample_rate = sample_rate
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.files = OrderedDict()   # name -> (size, mtime), oldest first
+        self.total_bytes = 0
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _scan(self):
+        entries = []
+        for e in os.scandir(self.folder):
+            if e.is_file() and not e.name.endswith(".tmp"):
+                st = e.stat()
+                entries.append((st.st_mtime, e.name, st.st_size))
+        for mtime, name, size in sorted(entries):
+            self.files[name] = (size, mtime)
+            self.total_bytes += size
+
+    @staticmethod
+    def name_for(data, ext="jpg"):
+        return f"{hashlib.sha1(data).hexdigest()}.{ext}"
+
+    def submit(self, data, ext="jpg", encode=None):
+        """Queue bytes for writing. Returns the file name it will have,
+        or None if sampled out / dropped. encode, if given, converts the
+        bytes on the writer thread (e.g. raw pixels -> PNG)."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return None
+        name = self.name_for(data, ext)
+        try:
+            self.queue.put_nowait((name, data, encode))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return name
+
+    def _run(self):
+        last_age_check = 0.0
+        while True:
+            name, data, encode = self.queue.get()
+            try:
+                self._write(name, data, encode)
+                now = time.time()
+                if self.max_age and now - last_age_check > 60:
+                    last_age_check = now
+                    self._evict_old(now)
+                self._evict_over_cap()
+            except Exception as e:
+                print(f"❌ Crop write failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, name, data, encode=None):
+        path = os.path.join(self.folder, name)
+        with self._lock:
+            if name in self.files:
+                # Still wanted: refresh its age and move it to the newest end,
+                # so eviction / pruning don't take a blob that is being linked
+                now = time.time()
+                try:
+                    os.utime(path, (now, now))
+                except FileNotFoundError:
+                    # Deleted behind the index (retention.py run by hand):
+                    # forget it and write it again
+                    self.total_bytes -= self.files.pop(name)[0]
+                else:
+                    self.duplicates += 1
+                    self.files[name] = (self.files[name][0], now)
+                    self.files.move_to_end(name)
+                    return
+        if encode is not None:
+            data = encode(data)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.files[name] = (len(data), time.time())
+            self.total_bytes += len(data)
+            self.written += 1
+
+    def _remove(self, name):
+        size, _ = self.files.pop(name)
+        self.total_bytes -= size
+        self.evicted += 1
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+
+    def _evict_over_cap(self):
+        with self._lock:
+            while self.files and (
+                (self.max_files and len(self.files) > self.max_files)
+                or (self.max_bytes and self.total_bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self.files)))
+
+    def _evict_old(self, now, max_age=None):
+        max_age = max_age or self.max_age
+        with self._lock:
+            while self.files:
+                name, (size, mtime) = next(iter(self.files.items()))
+                if now - mtime <= max_age:
+                    break
+                self._remove(name)
+
+    def prune(self, max_age_days):
+        """Drop files older than max_age_days now (retention job); returns
+        how many went. Goes through the index so dedup never points at a
+        deleted file."""
+        before = self.evicted
+        self._evict_old(time.time(), max_age_days * 86400)
+        return self.evicted - before
+
+    def flush(self):
+        self.queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self.files),
+                "bytes": self.total_bytes,
+                "written": self.written,
+                "duplicates": self.duplicates,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "evicted": self.evicted,
+                "pending": self.queue.qsize(),
+            }
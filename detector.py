@@ -0,0 +1,307 @@
+import abc
+import ast
+import os
+import cv2
+import numpy as np
+
+from overlay import extract_detections
+from propagate import iou
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+WEIGHTS = "best.pt"
+ONNX_PATH = "best.onnx"
+OPENVINO_DIR = "best_openvino_model"
+NCNN_DIR = "best_ncnn_model"
+CONF_THRESHOLD = 0.25
+NMS_IOU = 0.45
+TRACK_IOU = 0.3              # IouTracker: min overlap to continue a track
+TRACK_MAX_AGE = 30           # IouTracker: frames a lost track is kept
+
+
+# ---------------------------
+# Shared pre/post-processing for exported models (numpy + cv2 only)
+# ---------------------------
+def letterbox(frame, size):
+    """Resize keeping aspect ratio and pad to size x size (YOLO style).
+    Returns (padded image, scale, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    resized = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - nw) // 2, (size - nh) // 2
+    out = np.full((size, size, 3), 114, dtype=np.uint8)
+    out[pad_y:pad_y + nh, pad_x:pad_x + nw] = resized
+    return out, scale, (pad_x, pad_y)
+
+
+def to_blob(img):
+    """HWC BGR uint8 -> 1x3xHxW RGB float32 in [0, 1]."""
+    rgb = img[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(rgb, dtype=np.float32)[None] / 255.0
+
+
+def decode_yolo(output, scale, pad, frame_shape, conf=CONF_THRESHOLD, nms_iou=NMS_IOU):
+    """YOLOv8 head output (1, 4 + nc, N) -> [(box, score, class_id)] in frame pixels."""
+    pred = np.squeeze(output, 0)
+    if pred.shape[0] > pred.shape[1]:
+        pred = pred.T
+    boxes_xywh, scores_all = pred[:4].T, pred[4:].T
+    class_ids = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(class_ids)), class_ids]
+    keep = scores >= conf
+    if not keep.any():
+        return []
+    boxes_xywh, scores, class_ids = boxes_xywh[keep], scores[keep], class_ids[keep]
+
+    h, w = frame_shape[:2]
+    cx, cy, bw, bh = boxes_xywh.T
+    x1 = np.clip((cx - bw / 2 - pad[0]) / scale, 0, w)
+    y1 = np.clip((cy - bh / 2 - pad[1]) / scale, 0, h)
+    x2 = np.clip((cx + bw / 2 - pad[0]) / scale, 0, w)
+    y2 = np.clip((cy + bh / 2 - pad[1]) / scale, 0, h)
+
+    rects = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).tolist()
+    idx = cv2.dnn.NMSBoxesBatched(rects, scores.tolist(), class_ids.tolist(), conf, nms_iou)
+    out = []
+    for i in np.array(idx).reshape(-1):
+        out.append(((int(x1[i]), int(y1[i]), int(x2[i]), int(y2[i])),
+                    float(scores[i]), int(class_ids[i])))
+    return out
+
+
+def parse_names(meta_names):
+    """Ultralytics stores class names in export metadata as a dict repr."""
+    if isinstance(meta_names, dict):
+        return {int(k): v for k, v in meta_names.items()}
+    return {int(k): v for k, v in ast.literal_eval(meta_names).items()}
+
+
+# ---------------------------
+# Torch-free tracker
+# ---------------------------
+class IouTracker:
+    """Greedy IoU tracker giving exported backends persistent track IDs
+    (the role ByteTrack plays inside model.track)."""
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_age=TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = {}             # track_id -> {box, class_id, age}
+        self.next_id = 1
+
+    def update(self, raw):
+        """raw: [(box, score, class_id)] -> [(box, track_id, class_id, score)]"""
+        out = []
+        unmatched = set(self.tracks)
+        for box, score, class_id in sorted(raw, key=lambda r: -r[1]):
+            best, best_iou = None, self.iou_threshold
+            for tid in unmatched:
+                t = self.tracks[tid]
+                if t["class_id"] != class_id:
+                    continue
+                score_iou = iou(t["box"], box)
+                if score_iou >= best_iou:
+                    best, best_iou = tid, score_iou
+            if best is None:
+                best = self.next_id
+                self.next_id += 1
+            else:
+                unmatched.discard(best)
+            self.tracks[best] = {"box": box, "class_id": class_id, "age": 0}
+            out.append((box, best, class_id, score))
+
+        for tid in unmatched:
+            self.tracks[tid]["age"] += 1
+            if self.tracks[tid]["age"] > self.max_age:
+                del self.tracks[tid]
+        return out
+
+
+# ---------------------------
+# Backends
+# ---------------------------
+class UltralyticsDetector:
+    """PyTorch weights through ultralytics (needs torch)."""
+    backend = "ultralytics"
+
+    def __init__(self, weights=WEIGHTS):
+        from ultralytics import YOLO
+        self.model = YOLO(weights)
+        self.names = self.model.names
+
+    def track(self, frame, imgsz=640):
+        results = self.model.track(frame, persist=True, imgsz=imgsz, verbose=False)
+        return extract_detections(results, self.names, frame.shape)
+
+    def warmup(self, imgsz=640):
+        """One inference on a synthetic frame so the first real frame is not slow."""
+        self.detect(np.full((imgsz, imgsz, 3), 114, dtype=np.uint8), imgsz)
+
+    def detect(self, frame, imgsz=640):
+        """Untracked boxes: [(box, score, class_id)]; used by the parity check."""
+        r = self.model.predict(frame, imgsz=imgsz, conf=CONF_THRESHOLD, verbose=False)[0]
+        boxes = r.boxes.xyxy.cpu().numpy().astype(int)
+        return [(tuple(int(v) for v in b), float(s), int(c))
+                for b, s, c in zip(boxes, r.boxes.conf.cpu().tolist(), r.boxes.cls.int().cpu().tolist())]
+
+
+class _TrackingDetector(abc.ABC):
+    """detect() -> IouTracker path shared by every non-ultralytics backend."""
+    backend = None
+    input_size = None            # fixed export size, or None if dynamic
+
+    def __init__(self):
+        self.tracker = IouTracker()
+
+    @abc.abstractmethod
+    def detect(self, frame, imgsz=640):
+        """[(box, score, class_id), ...] in frame pixels."""
+
+    def warmup(self, imgsz=640):
+        """One inference on a synthetic frame so the first real frame is not slow."""
+        self.detect(np.full((imgsz, imgsz, 3), 114, dtype=np.uint8), imgsz)
+
+    def track(self, frame, imgsz=640):
+        detections = []
+        for box, track_id, class_id, score in self.tracker.update(self.detect(frame, imgsz)):
+            detections.append({
+                "box": box,
+                "track_id": track_id,
+                "class_id": class_id,
+                "class_name": self.names[class_id],
+                "conf": score,
+            })
+        return detections
+
+
+class _ExportedDetector(_TrackingDetector):
+    """Common letterbox -> infer -> decode path of exported models."""
+
+    @abc.abstractmethod
+    def _infer(self, blob):
+        """Raw model output for one NCHW float blob."""
+
+    def detect(self, frame, imgsz=640):
+        size = self.input_size or imgsz
+        img, scale, pad = letterbox(frame, size)
+        output = self._infer(to_blob(img))
+        return decode_yolo(output, scale, pad, frame.shape)
+
+
+class OnnxDetector(_ExportedDetector):
+    """ONNX Runtime on CPU (FP32 or INT8 QDQ model), no torch needed."""
+    backend = "onnx"
+
+    def __init__(self, path=ONNX_PATH, threads=None):
+        super().__init__()
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        if isinstance(inp.shape[2], int):
+            self.input_size = inp.shape[2]
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = parse_names(meta.get("names", "{0: 'licence'}"))
+
+    def _infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoDetector(_ExportedDetector):
+    """OpenVINO runtime on an ultralytics *_openvino_model directory."""
+    backend = "openvino"
+
+    def __init__(self, model_dir=OPENVINO_DIR):
+        super().__init__()
+        import openvino as ov
+        import yaml
+        xml = next(f for f in os.listdir(model_dir) if f.endswith(".xml"))
+        core = ov.Core()
+        model = core.read_model(os.path.join(model_dir, xml))
+        shape = model.inputs[0].get_partial_shape()
+        if shape[2].is_static:
+            self.input_size = shape[2].get_length()
+        self.compiled = core.compile_model(model, "CPU")
+        with open(os.path.join(model_dir, "metadata.yaml")) as f:
+            self.names = parse_names(yaml.safe_load(f)["names"])
+
+    def _infer(self, blob):
+        return self.compiled(blob)[0]
+
+
+class NcnnDetector(_ExportedDetector):
+    """NCNN runtime on an ultralytics *_ncnn_model directory."""
+    backend = "ncnn"
+
+    def __init__(self, model_dir=NCNN_DIR, threads=4):
+        super().__init__()
+        import ncnn
+        import yaml
+        self._ncnn = ncnn
+        self.net = ncnn.Net()
+        self.net.opt.num_threads = threads
+        self.net.load_param(os.path.join(model_dir, "model.ncnn.param"))
+        self.net.load_model(os.path.join(model_dir, "model.ncnn.bin"))
+        with open(os.path.join(model_dir, "metadata.yaml")) as f:
+            meta = yaml.safe_load(f)
+        self.names = parse_names(meta["names"])
+        self.input_size = int(meta.get("imgsz", [640])[0])
+
+    def _infer(self, blob):
+        ex = self.net.create_extractor()
+        ex.input("in0", self._ncnn.Mat(blob[0]).clone())
+        _, out = ex.extract("out0")
+        return np.array(out)[None]
+
+
+class StubDetector(_TrackingDetector):
+    """Model-free stand-in for benchmarks: bright plate-shaped blobs are
+    "licence" boxes. Matches frame_source.SyntheticSource; on real footage
+    it only gives a rough load, not accuracy."""
+    backend = "stub"
+
+    def __init__(self, min_area=800, aspect=(2.0, 6.0), threshold=200):
+        super().__init__()
+        self.names = {0: "licence"}
+        self.min_area = min_area
+        self.aspect = aspect
+        self.threshold = threshold
+
+    def detect(self, frame, imgsz=640):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        _, mask = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        out = []
+        for c in contours:
+            x, y, w, h = cv2.boundingRect(c)
+            if w * h >= self.min_area and self.aspect[0] <= w / float(h) <= self.aspect[1]:
+                out.append(((x, y, x + w, y + h), 0.9, 0))
+        return out
+
+
+BACKENDS = {
+    "ultralytics": lambda: UltralyticsDetector(WEIGHTS),
+    "onnx": lambda: OnnxDetector(ONNX_PATH),
+    "openvino": lambda: OpenVinoDetector(OPENVINO_DIR),
+    "ncnn": lambda: NcnnDetector(NCNN_DIR),
+    "stub": StubDetector,
+}
+
+
+def load_detector(backend="auto"):
+    """Pick a detector backend. "auto" prefers an exported model next to
+    the weights (ONNX, then OpenVINO, then NCNN) and falls back to torch."""
+    if backend != "auto":
+        return BACKENDS[backend]()
+    for name, path in (("onnx", ONNX_PATH), ("openvino", OPENVINO_DIR), ("ncnn", NCNN_DIR)):
+        if os.path.exists(path):
+            try:
+                return BACKENDS[name]()
+            except ImportError as e:
+                print(f"[DETECTOR] {name} model found but runtime missing: {e}")
+    return BACKENDS["ultralytics"]()
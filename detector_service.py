@@ -0,0 +1,228 @@
+"""Detection process for the split deployment of app.py.
+
+    python detector_service.py      # camera + pipeline + DB writes
+    python app.py                   # with DETECTOR_MODE = "external": web only
+
+The detector publishes every frame (plus its detections) into a
+shared-memory ring and plate events / stats over a local event channel.
+The web process maps the ring and encodes MJPEG straight from it, so
+dashboard viewers never compete with detection for the GIL, and either
+process can crash and restart without taking the other down.
+DETECTOR_MODE = "spawn" makes app.py start and supervise this process."""
+import atexit
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+import tracer
+from anpr_stages import FrameSlot, TrackLedger
+from event_channel import EventHub, EventSubscriber
+from governor import Governor
+from shm_ring import FrameRingReader, FrameRingWriter
+from startup import Startup
+from status_server import start_status_server, json_response
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+STATS_SECONDS = 1.0          # detector -> web stats push interval
+POLL_SECONDS = 0.01          # web: how often the ring's write counter is checked
+REATTACH_SECONDS = 3.0       # web: re-open the ring after this long without frames
+RESTART_DELAY = 2.0          # spawn mode: first restart back-off (doubles, max 30 s)
+
+
+# ---------------------------
+# Detector side
+# ---------------------------
+class SharedFrameSlot(FrameSlot):
+    """FrameSlot that also writes each frame + detections into the ring.
+    The ring is created on the first frame, so its shape always matches."""
+
+    def __init__(self, ring_name):
+        super().__init__()
+        self.ring_name = ring_name
+        self.ring = None
+
+    def publish(self, pkt):
+        super().publish(pkt)
+        frame = pkt["frame"]
+        if self.ring is None:
+            shape = frame.shape if frame.ndim == 3 else frame.shape + (1,)
+            self.ring = FrameRingWriter(self.ring_name, shape)
+            print(f"[RING] {self.ring_name} {shape} x{self.ring.slots}")
+        self.ring.write(frame, pkt["seq"], pkt["t_capture"],
+                        {"detections": pkt["detections"]})
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+
+
+def main():
+    import app       # pipeline configuration + DB helpers (Flask is not started)
+
+    tracer.set_process_name("anpr-detector")
+    tracer.install_signal_dump()
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))   # run the finally: unlink the ring
+
+    startup = Startup("anpr-detector")
+    startup.expect("db", "detector", "camera", "pipeline")
+    hub = EventHub(("127.0.0.1", app.DETECTOR_IPC_PORT), app.IPC_AUTHKEY)
+    slot = SharedFrameSlot(app.RING_NAME)
+    app.plate_listeners.append(lambda entry: hub.send({"type": "plate", "entry": entry}))
+    governor = None
+    if app.GOVERNOR:
+        governor = Governor(target_cpu=app.GOVERNOR_TARGET_CPU, temp_sensor=app.GOVERNOR_TEMP_SENSOR,
+                            max_fps=1.0 / app.FRAME_INTERVAL)
+    pipeline = app.build_pipeline(app.camera, slot, TrackLedger(), governor=governor)
+
+    def ready(query):
+        report = startup.report()
+        return json_response(report, 200 if report["ready"] else 503)
+
+    start_status_server(app.DETECTOR_STATUS_PORT, {
+        "/healthz": lambda q: json_response({"status": "ok"}),
+        "/readyz": ready,
+        "/metrics": lambda q: (200, metrics.CONTENT_TYPE, metrics.render().encode("utf-8")),
+        "/trace": lambda q: json_response(tracer.TRACER.dump(float(q.get("seconds", [30])[0]))),
+    })
+
+    def first_frame():
+        pipeline.start_source()
+        while slot.seq == 0:
+            if not pipeline.source_alive():
+                raise RuntimeError("camera source exited during startup")
+            time.sleep(0.01)
+
+    try:
+        startup.run("db", app.start_db)
+        startup.run_parallel({"detector": pipeline.start_stages, "camera": app.camera.open})
+        startup.run("pipeline", first_frame)
+        startup.finish()
+        while pipeline.source_alive():
+            hub.send({"type": "stats", "detect": slot.detect_stats, "pipeline": pipeline.stats(),
+                      "startup": startup.report(), "latency": metrics.REGISTRY.snapshot(),
+                      "governor": governor.stats() if governor else None,
+                      "sync": app.sync_client.stats() if app.sync_client else None})
+            time.sleep(STATS_SECONDS)
+        print("[DETECTOR] frame source stopped")
+        return 1
+    finally:
+        pipeline.stop()
+        app.camera.close()
+        slot.close()
+        hub.close()
+
+
+# ---------------------------
+# Web side
+# ---------------------------
+class RemoteDetector:
+    """The web process's view of the detector: the newest frame from the
+    ring (read in place, under the slot's seqlock) plus events / stats.
+    Exposes the FrameSlot attributes the web code uses (seq, updated,
+    detect_stats, read)."""
+
+    def __init__(self, ring_name, ipc_address, authkey, on_plate=None):
+        self.ring_name = ring_name
+        self.reader = None
+        self.seq = 0                 # bumps once per new frame seen
+        self.updated = 0.0
+        self.detect_stats = None
+        self.pipeline_stats = None
+        self.latency = None
+        self.detector_startup = None
+        self.governor_stats = None
+        self.sync_stats = None
+        self.on_plate = on_plate
+        self.events = EventSubscriber(ipc_address, authkey, self._on_event)
+        threading.Thread(target=self._watch, daemon=True, name="ring-watch").start()
+
+    def _on_event(self, event):
+        if event["type"] == "plate":
+            if self.on_plate is not None:
+                self.on_plate(event["entry"])
+        elif event["type"] == "stats":
+            self.detect_stats = event.get("detect")
+            self.pipeline_stats = event.get("pipeline")
+            self.latency = event.get("latency")
+            self.detector_startup = event.get("startup")
+            self.governor_stats = event.get("governor")
+            self.sync_stats = event.get("sync")
+
+    def _watch(self):
+        """Attach to the ring, follow its write counter, re-attach after
+        the detector restarts (new segment, new generation)."""
+        last_writes = 0
+        while True:
+            reader = self.reader
+            if reader is None:
+                try:
+                    reader = FrameRingReader(self.ring_name)
+                except (FileNotFoundError, ValueError):
+                    time.sleep(0.5)
+                    continue
+                self.reader, last_writes = reader, 0
+                print(f"[RING] attached {self.ring_name} {reader.shape}")
+            writes = reader.writes()
+            if writes != last_writes:
+                last_writes = writes
+                self.seq += 1
+                self.updated = time.time()
+            elif time.time() - self.updated > REATTACH_SECONDS and \
+                    reader.current_generation() != reader.generation:
+                self.reader = None
+                try:
+                    reader.close()
+                except BufferError:
+                    pass                 # a reader still holds a view; the mapping is just leaked
+            time.sleep(POLL_SECONDS)
+
+    def read(self, fn):
+        seq, reader = self.seq, self.reader
+        if reader is None:
+            return seq, None
+        r = reader.read(lambda frame, meta: fn(frame, meta.get("detections", [])))
+        return seq, (None if r is None else r[2])
+
+    def connected(self):
+        return self.reader is not None and self.events.connected
+
+
+_children = []                # spawn mode: the running detector, stopped with this process
+
+
+@atexit.register
+def _stop_children():
+    for proc in list(_children):
+        proc.terminate()          # SIGTERM: the detector's finally unlinks the ring
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def supervise():
+    """spawn mode: run this file as its own program and restart it on exit.
+    Not a multiprocessing child: spawn would re-run the parent's __main__
+    (app.py, with all its module-level setup) in the detector before
+    importing it again as `app`."""
+    delay = RESTART_DELAY
+    while True:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)])
+        _children.append(proc)
+        t0 = time.time()
+        print(f"[DETECTOR] started pid {proc.pid}")
+        proc.wait()
+        _children.remove(proc)
+        print(f"[DETECTOR] exited with {proc.returncode}; restarting in {delay:.0f}s")
+        delay = RESTART_DELAY if time.time() - t0 > 60 else min(delay * 2, 30)
+        time.sleep(delay)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+CLIENT_QUEUE = 256           # pending events per subscriber; oldest dropped when full
+RECONNECT_SECONDS = 1.0
+
+# Small pickled messages (plate events, stats) from the detector process to
+# any number of web processes over a local socket. A slow or dead subscriber
+# never blocks the publisher, and either side can restart independently.
+
+
+class EventHub:
+    """Publisher side: accepts subscribers and fans out send(obj)."""
+
+    def __init__(self, address, authkey):
+        self.listener = Listener(address, authkey=authkey)
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        threading.Thread(target=self._accept, daemon=True, name="event-hub").start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return                        # listener closed
+            except Exception as e:            # bad authkey / handshake
+                print(f"[EVENTS] rejected subscriber: {e}")
+                continue
+            q = queue.Queue(CLIENT_QUEUE)
+            with self._lock:
+                self.subscribers.append(q)
+            threading.Thread(target=self._pump, args=(conn, q), daemon=True).start()
+
+    def _pump(self, conn, q):
+        try:
+            while True:
+                conn.send(q.get())
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                if q in self.subscribers:
+                    self.subscribers.remove(q)
+            conn.close()
+
+    def send(self, obj):
+        with self._lock:
+            subs = list(self.subscribers)
+        for q in subs:
+            while True:
+                try:
+                    q.put_nowait(obj)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.sent += 1
+
+    def close(self):
+        self.listener.close()
+
+
+class EventSubscriber:
+    """Subscriber side: keeps (re)connecting and calls handler(obj) per event."""
+
+    def __init__(self, address, authkey, handler):
+        self.address = address
+        self.authkey = authkey
+        self.handler = handler
+        self.connected = False
+        self.last_event = 0.0
+        threading.Thread(target=self._run, daemon=True, name="event-sub").start()
+
+    def _run(self):
+        while True:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except OSError:
+                time.sleep(RECONNECT_SECONDS)
+                continue
+            self.connected = True
+            try:
+                while True:
+                    obj = conn.recv()
+                    self.last_event = time.time()
+                    try:
+                        self.handler(obj)
+                    except Exception as e:
+                        print(f"[EVENTS] handler error: {e}")
+            except (OSError, EOFError):
+                pass
+            finally:
+                self.connected = False
+                conn.close()
+            time.sleep(RECONNECT_SECONDS)
@@ -0,0 +1,226 @@
+"""Export best.pt to a CPU-friendly backend and check it against PyTorch.
+
+    python export_model.py --format onnx                 # FP32 ONNX
+    python export_model.py --format onnx --int8          # + static INT8 (QDQ)
+    python export_model.py --format openvino --int8
+    python export_model.py --format ncnn
+    python export_model.py --parity onnx --frames video:gate.mp4
+
+Export and the parity check need ultralytics/torch (run them on a PC);
+the Pi then only needs the runtime for the exported model.
+INT8 calibration uses the saved crops in received_plates/. Parity runs
+on full camera frames (any frame_source.py spec, default frames/): the
+detector never sees crops in service, and a set on which PyTorch finds
+no boxes compares nothing, so it fails."""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+import detector
+from detector import letterbox, to_blob
+from frame_source import open_source
+from propagate import iou
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+CALIB_DIR = "received_plates"
+CALIB_MAX_IMAGES = 300
+PARITY_FRAMES = "frames"     # full camera frames: "dir:frames/", "video:gate.mp4", ...
+PARITY_MIN_RECALL = 0.95     # share of torch boxes the backend must also find
+PARITY_MIN_IOU = 0.85        # mean IoU of matched boxes
+PARITY_MAX_CONF_DIFF = 0.10  # mean |conf_torch - conf_backend| of matched boxes
+
+
+def list_images(folder, limit=None):
+    files = []
+    for ext in ("*.jpg", "*.jpeg", "*.png"):
+        files += glob.glob(os.path.join(folder, ext))
+    files.sort()
+    return files[:limit] if limit else files
+
+
+# ---------------------------
+# Export
+# ---------------------------
+class CropCalibrationReader:
+    """onnxruntime CalibrationDataReader over letterboxed saved crops."""
+
+    def __init__(self, input_name, files, imgsz):
+        self.input_name = input_name
+        self.files = iter(files)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.files:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            padded, _, _ = letterbox(img, self.imgsz)
+            return {self.input_name: to_blob(padded)}
+        return None
+
+
+def quantize_onnx(fp32_path, int8_path, calib_dir, imgsz):
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    import onnxruntime as ort
+
+    files = list_images(calib_dir, CALIB_MAX_IMAGES)
+    if not files:
+        sys.exit(f"[EXPORT] No calibration images in {calib_dir}/")
+    print(f"[EXPORT] Calibrating INT8 on {len(files)} crops from {calib_dir}/")
+
+    prep_path = fp32_path.replace(".onnx", ".prep.onnx")
+    quant_pre_process(fp32_path, prep_path)
+    input_name = ort.InferenceSession(prep_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        prep_path, int8_path,
+        CropCalibrationReader(input_name, files, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    os.remove(prep_path)
+
+    # quantize_static drops custom metadata; carry class names over
+    import onnx
+    src, dst = onnx.load(fp32_path), onnx.load(int8_path)
+    for prop in src.metadata_props:
+        dst.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(dst, int8_path)
+
+
+def calibration_yaml(calib_dir, names):
+    """Ultralytics INT8 export wants a dataset yaml; point it at the crops."""
+    tmp = tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False)
+    tmp.write(f"path: {os.path.abspath(calib_dir)}\ntrain: .\nval: .\nnames:\n")
+    for k, v in names.items():
+        tmp.write(f"  {k}: {v}\n")
+    tmp.close()
+    return tmp.name
+
+
+def export(fmt, weights, imgsz, int8, calib_dir):
+    from ultralytics import YOLO
+    model = YOLO(weights)
+
+    if fmt == "onnx":
+        path = model.export(format="onnx", imgsz=imgsz, simplify=True, dynamic=False)
+        if int8:
+            fp32 = path.replace(".onnx", ".fp32.onnx")
+            shutil.move(path, fp32)
+            quantize_onnx(fp32, path, calib_dir, imgsz)
+        return path
+
+    if fmt == "openvino":
+        kw = {}
+        if int8:
+            kw = {"int8": True, "data": calibration_yaml(calib_dir, model.names)}
+        return model.export(format="openvino", imgsz=imgsz, **kw)
+
+    if fmt == "ncnn":
+        if int8:
+            print("[EXPORT] NCNN INT8 is not supported by the exporter; writing FP16/FP32")
+        return model.export(format="ncnn", imgsz=imgsz)
+
+    sys.exit(f"[EXPORT] Unknown format: {fmt}")
+
+
+# ---------------------------
+# Parity check
+# ---------------------------
+def match_boxes(ref, got):
+    """Greedy same-class IoU matching. Returns [(ref, got, iou)]."""
+    pairs, used = [], set()
+    for r_box, r_conf, r_cls in sorted(ref, key=lambda r: -r[1]):
+        best, best_iou = None, 0.5
+        for j, (g_box, g_conf, g_cls) in enumerate(got):
+            if j in used or g_cls != r_cls:
+                continue
+            score = iou(r_box, g_box)
+            if score >= best_iou:
+                best, best_iou = j, score
+        if best is not None:
+            used.add(best)
+            pairs.append(((r_box, r_conf, r_cls), got[best], best_iou))
+    return pairs
+
+
+def parity(backend, weights, frames, imgsz, limit):
+    detector.WEIGHTS = weights
+    ref_model = detector.UltralyticsDetector(weights)
+    test_model = detector.load_detector(backend)
+    source = open_source(frames)
+    source.open()
+    n_frames = n_ref = n_match = 0
+    ious, conf_diffs = [], []
+    try:
+        while n_frames < limit:
+            try:
+                img = source()["frame"]
+            except StopIteration:
+                break
+            n_frames += 1
+            ref = ref_model.detect(img, imgsz)
+            got = test_model.detect(img, imgsz)
+            pairs = match_boxes(ref, got)
+            n_ref += len(ref)
+            n_match += len(pairs)
+            ious += [p[2] for p in pairs]
+            conf_diffs += [abs(p[0][1] - p[1][1]) for p in pairs]
+    finally:
+        source.close()
+    if not n_frames:
+        sys.exit(f"[PARITY] No frames from {frames}")
+    if not n_ref:
+        print(f"[PARITY] PyTorch found no boxes in {n_frames} frames of {frames}: nothing compared; "
+              f"use full frames with vehicles in view")
+        print("[PARITY] FAIL")
+        return False
+
+    recall = n_match / n_ref
+    mean_iou = float(np.mean(ious)) if ious else 0.0
+    mean_conf = float(np.mean(conf_diffs)) if conf_diffs else 0.0
+    ok = recall >= PARITY_MIN_RECALL and mean_iou >= PARITY_MIN_IOU and mean_conf <= PARITY_MAX_CONF_DIFF
+
+    print(f"[PARITY] backend={test_model.backend} frames={n_frames} torch_boxes={n_ref}")
+    print(f"[PARITY] recall={recall:.3f} (>= {PARITY_MIN_RECALL})  "
+          f"mean_iou={mean_iou:.3f} (>= {PARITY_MIN_IOU})  "
+          f"mean_conf_diff={mean_conf:.3f} (<= {PARITY_MAX_CONF_DIFF})")
+    print("[PARITY] PASS" if ok else "[PARITY] FAIL")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--weights", default=detector.WEIGHTS)
+    ap.add_argument("--format", choices=["onnx", "openvino", "ncnn"])
+    ap.add_argument("--int8", action="store_true")
+    ap.add_argument("--calib", default=CALIB_DIR)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--parity", choices=["onnx", "openvino", "ncnn"])
+    ap.add_argument("--frames", default=PARITY_FRAMES,
+                    help="parity frames: a frame_source.py spec or a folder of full frames")
+    ap.add_argument("--limit", type=int, default=200)
+    args = ap.parse_args()
+
+    if args.format:
+        path = export(args.format, args.weights, args.imgsz, args.int8, args.calib)
+        print(f"[EXPORT] Wrote {path}")
+    if args.parity:
+        if not parity(args.parity, args.weights, args.frames, args.imgsz, args.limit):
+            sys.exit(1)
+    if not args.format and not args.parity:
+        ap.print_help()
+
+
+if __name__ == "__main__":
+    main()
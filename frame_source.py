@@ -0,0 +1,183 @@
+import abc
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+# ---------------------------
+# Frame sources
+# ---------------------------
+# Anything with open() / close() / __call__() -> {seq, t_capture, frame}
+# can feed a pipeline.Pipeline; __call__ raises StopIteration at the end
+# of a recording. anpr_stages.CameraSource is the Picamera2 one; these let
+# the same pipelines run off-device on recordings or generated frames.
+#
+#   "camera"                   Picamera2 (Pi only)
+#   "video:path.mp4"           video file
+#   "dir:folder"               image directory (sorted by name)
+#   "synthetic[:n_frames]"     moving plate-like boxes, no files needed
+
+
+class _ReplaySource(abc.ABC):
+    """Common pacing / looping / resizing for recorded sources.
+    fps=None reads as fast as the source can; whether the pipeline keeps
+    up depends on its first channel (DROP_OLDEST on the Pi, BLOCK in bench.py)."""
+
+    def __init__(self, size=None, fps=None, loop=False, flip=False):
+        self.size = size
+        self.fps = fps
+        self.loop = loop
+        self.flip = flip
+        self.seq = 0
+        self._next_due = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def _read(self):
+        """Next BGR frame or None at the end of the recording."""
+
+    @abc.abstractmethod
+    def _rewind(self):
+        """Back to the first frame (loop=True)."""
+
+    def _pace(self):
+        if not self.fps:
+            return
+        now = time.perf_counter()
+        if self._next_due is None:
+            self._next_due = now
+        if self._next_due > now:
+            time.sleep(self._next_due - now)
+        self._next_due = max(self._next_due + 1.0 / self.fps, now - 1.0)
+
+    def __call__(self):
+        frame = self._read()
+        if frame is None and self.loop and self.seq:
+            self._rewind()
+            frame = self._read()
+        if frame is None:
+            raise StopIteration
+        if self.size and (frame.shape[1], frame.shape[0]) != tuple(self.size):
+            frame = cv2.resize(frame, tuple(self.size), interpolation=cv2.INTER_AREA)
+        if self.flip:
+            frame = cv2.flip(frame, -1)
+        self._pace()
+        self.seq += 1
+        return {"seq": self.seq, "t_capture": time.time(), "frame": frame}
+
+
+class VideoFileSource(_ReplaySource):
+    def __init__(self, path, size=None, fps=None, loop=False, flip=False):
+        super().__init__(size, fps, loop, flip)
+        self.path = path
+        self.cap = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            raise IOError(f"cannot open video {self.path}")
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    def native_fps(self):
+        return self.cap.get(cv2.CAP_PROP_FPS) if self.cap is not None else 0.0
+
+    def _read(self):
+        ok, frame = self.cap.read()
+        return frame if ok else None
+
+    def _rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class ImageDirSource(_ReplaySource):
+    def __init__(self, folder, size=None, fps=None, loop=False, flip=False):
+        super().__init__(size, fps, loop, flip)
+        self.folder = folder
+        self.files = []
+        self.index = 0
+
+    def open(self):
+        for ext in ("*.jpg", "*.jpeg", "*.png", "*.bmp"):
+            self.files += glob.glob(os.path.join(self.folder, ext))
+        self.files.sort()
+        if not self.files:
+            raise IOError(f"no images in {self.folder}")
+
+    def _read(self):
+        while self.index < len(self.files):
+            frame = cv2.imread(self.files[self.index], cv2.IMREAD_COLOR)
+            self.index += 1
+            if frame is not None:
+                return frame
+        return None
+
+    def _rewind(self):
+        self.index = 0
+
+
+class SyntheticSource(_ReplaySource):
+    """Vehicles (a dark body with a white plate) crossing a static road scene,
+    one every `gap` frames. Deterministic for a given seed."""
+
+    PLATES = ("MH12AB1234", "KA01XY5678", "DL3CAF0001", "MH47CD4321", "GJ05EF9876")
+
+    def __init__(self, size=(640, 480), n_frames=600, fps=None, speed=6, gap=90, seed=0):
+        super().__init__(None, fps, False, False)
+        self.size = size
+        self.n_frames = n_frames
+        self.speed = speed
+        self.gap = gap
+        rng = np.random.default_rng(seed)
+        w, h = size
+        self.background = rng.integers(70, 110, (h, w, 3), dtype=np.uint8)
+        cv2.rectangle(self.background, (0, h // 3), (w, h), (60, 60, 60), -1)   # road
+        self.vehicles_started = 0
+
+    def _read(self):
+        if self.seq >= self.n_frames:
+            return None
+        w, h = self.size
+        frame = self.background.copy()
+        for start in range(0, self.seq + 1, self.gap):
+            x = -200 + (self.seq - start) * self.speed
+            if x > w:
+                continue
+            idx = start // self.gap
+            self.vehicles_started = max(self.vehicles_started, idx + 1)
+            y = h // 2
+            cv2.rectangle(frame, (x, y - 60), (x + 200, y + 80), (40, 30, 120), -1)
+            cv2.rectangle(frame, (x + 40, y + 20), (x + 160, y + 56), (255, 255, 255), -1)
+            cv2.putText(frame, self.PLATES[idx % len(self.PLATES)], (x + 44, y + 46),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        return frame
+
+    def _rewind(self):
+        pass                         # never loops: n_frames is the recording
+
+
+def open_source(spec, size=None, fps=None, loop=False, flip=False):
+    """Build a frame source from a spec string (see the table above)."""
+    kind, _, arg = spec.partition(":")
+    if kind == "camera":
+        from anpr_stages import CameraSource   # lazy: picamera2 only on the Pi
+        return CameraSource(size or (640, 480))
+    if kind == "synthetic":
+        return SyntheticSource(size or (640, 480), n_frames=int(arg or 600), fps=fps)
+    if kind == "video":
+        return VideoFileSource(arg, size, fps, loop, flip)
+    if kind == "dir":
+        return ImageDirSource(arg, size, fps, loop, flip)
+    # bare path: guess from what it is
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, size, fps, loop, flip)
+    return VideoFileSource(spec, size, fps, loop, flip)
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+
+import metrics
+from roi import IMGSZ_MIN, IMGSZ_STRIDE
+
+# ---------------------------
+# CONFIG (defaults, override per site)
+# ---------------------------
+TARGET_CPU = 0.75            # busy fraction of all cores the Pi should stay under
+TEMP_SOFT = 70.0             # °C: start trading frame rate for temperature
+TEMP_HARD = 80.0             # °C: minimum rate (firmware soft-throttles at 80-85)
+MAX_FPS = 30.0               # with a vehicle in view
+IDLE_FPS = 8.0               # empty gate: enough to catch the next arrival
+MIN_FPS = 2.0
+TRAFFIC_HOLD = 3.0           # seconds at full rate after the last detection
+UPDATE_SECONDS = 1.0         # how often the rate / input size are re-decided
+SHRINK_PRESSURE = 0.5        # pressure above which the detector input shrinks a step
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+
+# Sets the capture rate and the detector input size from three signals:
+# CPU utilisation against TARGET_CPU, SoC temperature between TEMP_SOFT and
+# TEMP_HARD, and traffic (full rate only while vehicles are in view).
+# The pipeline source is wrapped so each capture waits for its slot and
+# carries the current input-size cap to the detect stage.
+
+
+# ---------------------------
+# Sensors (any callable returning a float or None)
+# ---------------------------
+class SysfsTemperature:
+    """SoC temperature in °C from a thermal zone (millidegrees), or None
+    off-device."""
+
+    def __init__(self, path=THERMAL_PATH):
+        self.path = path
+
+    def __call__(self):
+        try:
+            with open(self.path) as f:
+                value = float(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        return value / 1000.0 if value > 1000 else value
+
+
+class CpuUsage:
+    """Busy fraction of all cores since the previous call, from /proc/stat;
+    falls back to this process's CPU time where /proc is missing."""
+
+    def __init__(self, path="/proc/stat"):
+        self.path = path
+        self.cores = os.cpu_count() or 1
+        self.last = self._sample()
+
+    def _sample(self):
+        try:
+            with open(self.path) as f:
+                fields = [float(x) for x in f.readline().split()[1:]]
+            idle = fields[3] + (fields[4] if len(fields) > 4 else 0.0)   # idle + iowait
+            return "proc", sum(fields) - idle, sum(fields)
+        except (OSError, ValueError, IndexError):
+            return "process", time.process_time(), time.monotonic() * self.cores
+
+    def __call__(self):
+        now = self._sample()
+        kind, busy0, total0 = self.last
+        self.last = now
+        if now[0] != kind or now[2] <= total0:
+            return None
+        return min(1.0, max(0.0, (now[1] - busy0) / (now[2] - total0)))
+
+
+def make_temperature_sensor(spec="sysfs"):
+    """"sysfs" | "sysfs:<path>" | "file:<path>" (plain °C, for testing off
+    the Pi) | None | any callable."""
+    if spec is None or callable(spec):
+        return spec
+    if spec == "sysfs":
+        return SysfsTemperature()
+    kind, _, path = spec.partition(":")
+    if kind in ("sysfs", "file"):
+        return SysfsTemperature(path)
+    raise ValueError(f"unknown temperature sensor {spec!r}")
+
+
+# ---------------------------
+# Governor
+# ---------------------------
+class Governor:
+    def __init__(self, imgsz=640, imgsz_min=IMGSZ_MIN, temp_sensor="sysfs", cpu_sensor=None,
+                 target_cpu=TARGET_CPU, temp_soft=TEMP_SOFT, temp_hard=TEMP_HARD,
+                 max_fps=MAX_FPS, idle_fps=IDLE_FPS, min_fps=MIN_FPS,
+                 traffic_hold=TRAFFIC_HOLD, update_seconds=UPDATE_SECONDS):
+        self.imgsz_max = imgsz
+        self.imgsz_min = min(imgsz_min, imgsz)
+        self.temp_sensor = make_temperature_sensor(temp_sensor)
+        self.cpu_sensor = cpu_sensor or CpuUsage()
+        self.target_cpu = target_cpu
+        self.temp_soft = temp_soft
+        self.temp_hard = temp_hard
+        self.max_fps = max_fps
+        self.idle_fps = idle_fps
+        self.min_fps = min_fps
+        self.traffic_hold = traffic_hold
+        self.update_seconds = update_seconds
+
+        self.fps = max_fps
+        self.imgsz = imgsz
+        self.imgsz_fixed = None      # static-shape export: input size cannot change
+        self.cpu_scale = 1.0         # multiplicative back-off from CPU pressure
+        self.cpu = None
+        self.temperature = None
+        self.limited_by = "none"
+        self.last_traffic = 0.0
+        self.decisions = 0
+        self._next_frame = 0.0
+        self._next_update = 0.0
+        self._lock = threading.Lock()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        metrics.gauge("governor_fps", "Capture rate chosen by the governor", fn=lambda: self.fps)
+        metrics.gauge("governor_imgsz", "Detector input size cap chosen by the governor",
+                      fn=lambda: self.imgsz)
+        metrics.gauge("governor_cpu_utilisation", "Busy fraction of all cores (governor input)",
+                      fn=lambda: float("nan") if self.cpu is None else self.cpu)
+        metrics.gauge("governor_soc_temperature_celsius", "SoC temperature (governor input)",
+                      fn=lambda: float("nan") if self.temperature is None else self.temperature)
+        metrics.gauge("governor_traffic", "1 while vehicles are in view (governor input)",
+                      fn=lambda: int(self.traffic()))
+        metrics.counter("governor_decisions", "Rate / input size changes", fn=lambda: self.decisions)
+        for reason in ("none", "idle", "cpu", "thermal"):
+            metrics.gauge("governor_limited_by", "What currently caps the rate (1 = active)",
+                          fn=lambda r=reason: int(self.limited_by == r), reason=reason)
+
+    # --- inputs ---
+    def observe(self, pkt):
+        """Traffic signal: every detected frame packet (SelectCrops on_frame).
+        Only fresh detections count: frames the motion gate held carry the
+        last detections (fresh=False), and a parked car must not keep the
+        rate at max. Also learns whether the detector's input size is fixed
+        (DetectStage tags imgsz_fixed), in which case only the rate is governed."""
+        if pkt.get("fresh") and pkt.get("detections"):
+            self.last_traffic = time.time()
+        fixed = pkt.get("imgsz_fixed")
+        if fixed and fixed != self.imgsz_fixed:
+            self.imgsz_fixed = self.imgsz = fixed
+
+    def traffic(self):
+        return time.time() - self.last_traffic < self.traffic_hold
+
+    # --- decisions ---
+    def _thermal_factor(self):
+        if self.temperature is None or self.temperature <= self.temp_soft:
+            return 1.0
+        if self.temperature >= self.temp_hard:
+            return 0.0
+        return 1.0 - (self.temperature - self.temp_soft) / (self.temp_hard - self.temp_soft)
+
+    def update(self):
+        self.cpu = self.cpu_sensor()
+        self.temperature = self.temp_sensor() if self.temp_sensor else None
+
+        if self.cpu is not None:
+            if self.cpu > self.target_cpu:
+                self.cpu_scale = max(0.1, self.cpu_scale * max(0.5, self.target_cpu / self.cpu))
+            elif self.cpu < self.target_cpu * 0.9:
+                self.cpu_scale = min(1.0, self.cpu_scale * 1.1)
+        thermal = self._thermal_factor()
+        scale = min(self.cpu_scale, thermal)
+
+        want = self.max_fps if self.traffic() else self.idle_fps
+        fps = max(self.min_fps, want * scale)
+        if scale < 1.0:
+            self.limited_by = "thermal" if thermal <= self.cpu_scale else "cpu"
+        else:
+            self.limited_by = "none" if want == self.max_fps else "idle"
+
+        # Under sustained pressure a smaller detector input buys more than a
+        # lower rate alone; grow back one step at a time once there is headroom
+        imgsz = self.imgsz
+        if self.imgsz_fixed:
+            pass                     # static export: only the rate can give
+        elif 1.0 - scale > SHRINK_PRESSURE:
+            imgsz = max(self.imgsz_min, imgsz - IMGSZ_STRIDE)
+        elif scale >= 1.0:
+            imgsz = min(self.imgsz_max, imgsz + IMGSZ_STRIDE)
+
+        if abs(fps - self.fps) > 0.5 or imgsz != self.imgsz:
+            self.decisions += 1
+        self.fps = round(fps, 1)
+        self.imgsz = imgsz
+
+    def pace(self):
+        """Block until the next capture slot (replaces the fixed sleep)."""
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_update:
+                self.update()
+                self._next_update = now + self.update_seconds
+            slot = max(now, self._next_frame)
+            self._next_frame = slot + 1.0 / self.fps
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def wrap(self, source):
+        return GovernedSource(source, self)
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "imgsz": self.imgsz,
+            "imgsz_fixed": bool(self.imgsz_fixed),
+            "limited_by": self.limited_by,
+            "cpu": None if self.cpu is None else round(self.cpu, 3),
+            "temperature": self.temperature,
+            "traffic": self.traffic(),
+            "decisions": self.decisions,
+        }
+
+
+class GovernedSource:
+    """Pipeline source wrapper: waits for the governor's slot, then tags the
+    packet with the detector input-size cap (read by DetectStage)."""
+
+    def __init__(self, source, governor):
+        self.source = source
+        self.governor = governor
+
+    def __call__(self):
+        self.governor.pace()
+        pkt = self.source()
+        if pkt is not None:
+            pkt["imgsz_cap"] = self.governor.imgsz
+        return pkt
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)      # open / close / seq of the wrapped source
@@ -0,0 +1,311 @@
+"""Load generator for the OCR server (basewindow.py).
+
+    python loadgen.py --host 127.0.0.1 --clients 4 --duration 30                  # closed loop, v2
+    python loadgen.py --protocol legacy --rate 20 --clients 16 --duration 30      # open loop, 20 req/s
+    python loadgen.py --sweep 1,2,4,8,16 --duration 20 --out runs/ocr-box.json    # find saturation
+
+Replays the crops in received_plates/ from many simulated Pis.
+--protocol  v2       persistent connection, negotiated codec (what the Pi uses)
+            v2-once  v2 framing, new connection per request
+            legacy   original one-shot JPEG framing
+Closed loop (default): each client sends its next crop as soon as the
+reply arrives. Open loop (--rate): requests are scheduled at a fixed
+total rate regardless of replies, and latency counts from the scheduled
+time, so queueing at a saturated server shows up instead of being hidden.
+At most --clients requests wait beyond those in flight: a request with no
+room is counted as dropped, one that starts more than a slot late as late.
+Each step stops its clients at the deadline, so nothing from one --sweep
+step spills into the next, and rps counts replies within the deadline.
+Server CPU comes from the status port's /stats (--status-port).
+The same crops repeat, so by default v2 requests ask the server to skip
+its pHash cache (--cache bypass) and the numbers are OCR numbers; --cache
+use measures with the cache, and cached_share reports the hit fraction.
+Legacy requests cannot bypass it."""
+import argparse
+import glob
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import urllib.request
+
+import cv2
+
+from ocr_protocol import OcrClient
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+CROPS_DIR = "received_plates"
+MAX_CROPS = 500
+TIMEOUT = 10
+STATUS_PORT = 9998
+SATURATION_GAIN = 0.05       # sweep: <5% more req/s for more clients = saturated
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_crops(folder, limit=MAX_CROPS):
+    files = []
+    for ext in ("*.jpg", "*.jpeg", "*.png"):
+        files += glob.glob(os.path.join(folder, ext))
+    crops = []
+    for path in sorted(files)[:limit]:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None and img.size:
+            crops.append(img)
+    if not crops:
+        raise SystemExit(f"no crops in {folder}")
+    return crops
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(p / 100.0 * len(sorted_vals)))]
+
+
+def server_cpu(host, port):
+    """(process cpu seconds, uptime) from the OCR server's /stats, or None."""
+    if not port:
+        return None
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/stats", timeout=2) as r:
+            st = json.loads(r.read().decode("utf-8"))
+        return st.get("cpu_seconds"), st.get("uptime")
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------------------
+# Simulated Pi
+# ---------------------------
+class SimClient:
+    def __init__(self, host, port, protocol, timeout, no_cache=True):
+        self.client = OcrClient(host, port, timeout=timeout,
+                                persistent=(protocol == "v2"))
+        if protocol == "legacy":
+            self.client.legacy = True
+        self.extra = {"no_cache": True} if no_cache else {}
+
+    def request(self, crop, track_id):
+        return self.client.recognize(crop, track_id, **self.extra)
+
+    def close(self):
+        self.client.close()
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.ok = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.empty = 0
+        self.cached = 0
+        self.cache_known = 0         # replies carrying "cached" (v2 only)
+        self.dropped = 0             # open loop: no room to queue at its scheduled time
+        self.late = 0                # open loop: started more than one slot after schedule
+        self.in_window = 0           # ok replies that arrived before the deadline
+        self.deadline = None
+        self.closed = False          # step over: stragglers are not counted
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record(self, latency, reply=None, error=None):
+        with self._lock:
+            if self.closed:
+                return
+            if error is None:
+                if self.deadline is None or time.perf_counter() <= self.deadline:
+                    self.in_window += 1
+                self.ok += 1
+                self.latencies.append(latency)
+                if not reply.get("text"):
+                    self.empty += 1
+                if "cached" in reply:
+                    self.cache_known += 1
+                    self.cached += bool(reply["cached"])
+            elif isinstance(error, socket.timeout):
+                self.timeouts += 1
+            else:
+                self.errors += 1
+
+
+def _send(sim, crop, track_id, t_start, results):
+    try:
+        reply = sim.request(crop, track_id)
+    except Exception as e:
+        sim.close()
+        results.record(None, error=e)
+        return
+    results.record(time.perf_counter() - t_start, reply)
+
+
+def run_closed(args, crops, clients):
+    results = Results()
+    stop_at = results.deadline = time.perf_counter() + args.duration
+
+    def client_loop(idx):
+        sim = SimClient(args.host, args.port, args.protocol, args.timeout, args.cache == "bypass")
+        i = idx
+        while time.perf_counter() < stop_at:
+            _send(sim, crops[i % len(crops)], i, time.perf_counter(), results)
+            i += clients
+            if args.think:
+                time.sleep(args.think)
+        sim.close()
+
+    threads = [threading.Thread(target=client_loop, args=(c,), daemon=True) for c in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(max(0.0, stop_at - time.perf_counter()) + args.timeout + 1)
+    results.closed = True
+    return results
+
+
+def run_open(args, crops, clients):
+    """Fixed total rate; `clients` bounds requests in flight and waiting."""
+    results = Results()
+    work = queue.Queue(maxsize=clients)
+    interval = 1.0 / args.rate
+    stop = threading.Event()
+
+    def client_loop():
+        sim = SimClient(args.host, args.port, args.protocol, args.timeout, args.cache == "bypass")
+        while not stop.is_set():
+            try:
+                i, t_sched = work.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if stop.is_set():
+                break
+            if time.perf_counter() - t_sched > interval:
+                results.add("late")
+            _send(sim, crops[i % len(crops)], i, t_sched, results)
+        sim.close()
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    t0 = time.perf_counter()
+    results.deadline = t0 + args.duration
+    i = 0
+    while True:
+        t_sched = t0 + i * interval
+        if t_sched - t0 >= args.duration:
+            break
+        delay = t_sched - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            work.put_nowait((i, t_sched))
+        except queue.Full:
+            results.add("dropped")    # every client busy and the backlog full
+        i += 1
+    time.sleep(max(0.0, results.deadline - time.perf_counter()))
+    stop.set()                        # queued requests are not sent; in-flight ones finish
+    for t in threads:
+        t.join(args.timeout + 1)
+    results.closed = True
+    return results
+
+
+def run_step(args, crops, clients):
+    cpu0 = server_cpu(args.host, args.status_port)
+    t0 = time.perf_counter()
+    results = (run_open if args.rate else run_closed)(args, crops, clients)
+    cpu1 = server_cpu(args.host, args.status_port)
+    wall = time.perf_counter() - t0
+    elapsed = results.deadline - t0 if results.deadline else wall
+
+    lat = sorted(results.latencies)
+    total = results.ok + results.errors + results.timeouts
+    report = {
+        "clients": clients,
+        "mode": "open" if args.rate else "closed",
+        "target_rate": args.rate,
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "ok": results.ok,
+        "rps": round(results.in_window / elapsed, 2),
+        "error_rate": round(results.errors / total, 4) if total else 0.0,
+        "timeout_rate": round(results.timeouts / total, 4) if total else 0.0,
+        "empty_text": results.empty,
+        "dropped": results.dropped,
+        "late": results.late,
+        "cache": args.cache,
+        "cached_share": (round(results.cached / results.cache_known, 4)
+                         if results.cache_known else None),
+        "latency_ms": {f"p{p}": round(percentile(lat, p) * 1000, 2) if lat else None
+                       for p in PERCENTILES},
+    }
+    report["latency_ms"]["max"] = round(lat[-1] * 1000, 2) if lat else None
+    report["latency_ms"]["mean"] = round(sum(lat) / len(lat) * 1000, 2) if lat else None
+    if cpu0 and cpu1 and cpu0[0] is not None and cpu1[0] is not None:
+        # % of one core; > 100 means several OCR workers busy at once
+        report["server_cpu_percent"] = round(100.0 * (cpu1[0] - cpu0[0]) / wall, 1)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the OCR server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9999)
+    ap.add_argument("--status-port", type=int, default=STATUS_PORT,
+                    help="OCR server /stats port for CPU (0 = skip)")
+    ap.add_argument("--crops", default=CROPS_DIR)
+    ap.add_argument("--max-crops", type=int, default=MAX_CROPS)
+    ap.add_argument("--protocol", choices=("v2", "v2-once", "legacy"), default="v2")
+    ap.add_argument("--clients", type=int, default=4, help="simulated Pis (max in flight)")
+    ap.add_argument("--rate", type=float, default=None, help="open loop: total requests/s")
+    ap.add_argument("--think", type=float, default=0.0, help="closed loop: pause between requests (s)")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per run / sweep step")
+    ap.add_argument("--timeout", type=float, default=TIMEOUT)
+    ap.add_argument("--cache", choices=("bypass", "use"), default="bypass",
+                    help="server pHash cache: bypass (OCR numbers) or use (v2 only)")
+    ap.add_argument("--sweep", help="comma-separated client counts, e.g. 1,2,4,8,16")
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args()
+
+    crops = load_crops(args.crops, args.max_crops)
+    print(f"[LOAD] {len(crops)} crops | {args.protocol} | "
+          f"{'open %.1f req/s' % args.rate if args.rate else 'closed loop'}", file=sys.stderr)
+    if args.protocol == "legacy" and args.cache == "bypass":
+        print("[LOAD] legacy framing cannot bypass the server cache: repeated crops may be cache hits",
+              file=sys.stderr)
+
+    if not args.sweep:
+        report = run_step(args, crops, args.clients)
+    else:
+        steps, best, saturated_at = [], None, None
+        for clients in [int(c) for c in args.sweep.split(",")]:
+            step = run_step(args, crops, clients)
+            steps.append(step)
+            print(f"[LOAD] {clients:>3} clients: {step['rps']:>8} req/s "
+                  f"p95 {step['latency_ms']['p95']} ms", file=sys.stderr)
+            if best is not None and step["rps"] < best["rps"] * (1 + SATURATION_GAIN):
+                saturated_at = saturated_at or best["clients"]
+            if best is None or step["rps"] > best["rps"]:
+                best = step
+        report = {"protocol": args.protocol, "steps": steps,
+                  "max_rps": best["rps"] if best else None,
+                  "saturation_clients": saturated_at}
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
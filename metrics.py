@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+# Seconds; covers a sub-ms flip up to a multi-second OCR round trip
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW = 1024                # recent samples kept per histogram for p50/p95/p99
+QUANTILES = (0.5, 0.95, 0.99)
+
+# In-process only: stages placed in a worker process record into that
+# process's registry, which /metrics does not see (queue depths and stage
+# counters still come from pipeline.Stage's shared values).
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                     for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+def _fmt(v):
+    if v == float("inf"):
+        return "+Inf"
+    if v != v:
+        return "NaN"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+# ---------------------------
+# Metric types
+# ---------------------------
+class Counter:
+    """inc() it, or read a monotonic total from fn() at scrape time."""
+    kind = "counter"
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def get(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float("nan")
+        return self.value
+
+    def samples(self, name, labels):
+        return [(name + "_total", labels, self.get())]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Gauge:
+    """Set directly, or read from fn() at scrape time (queue depths)."""
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+        self._lock = threading.Lock()
+
+    def set(self, v):
+        self.value = v
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def get(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float("nan")
+        return self.value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.get())]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a window of recent samples
+    for p50/p95/p99 (exported alongside as <name>_window quantiles)."""
+    kind = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=WINDOW):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, v):
+        i = 0
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                break
+        else:
+            i = len(self.buckets)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+            self.recent.append(v)
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def quantiles(self, qs=QUANTILES):
+        with self._lock:
+            data = sorted(self.recent)
+        if not data:
+            return {q: 0.0 for q in qs}
+        return {q: data[min(len(data) - 1, int(q * len(data)))] for q in qs}
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        out, acc = [], 0
+        for b, c in zip(self.buckets + (float("inf"),), counts):
+            acc += c
+            out.append((name + "_bucket", dict(labels, le=_fmt(b)), acc))
+        out.append((name + "_sum", labels, total))
+        out.append((name + "_count", labels, n))
+        return out
+
+    def snapshot(self):
+        q = self.quantiles()
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "p50": round(q[0.5], 6), "p95": round(q[0.95], 6), "p99": round(q[0.99], 6)}
+
+
+# ---------------------------
+# Registry
+# ---------------------------
+class Registry:
+    def __init__(self, prefix="anpr_"):
+        self.prefix = prefix
+        self.families = {}           # name -> (kind, help, {label tuple: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kw):
+        name = self.prefix + name
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            fam = self.families.get(name)
+            if fam is None:
+                fam = self.families[name] = (cls.kind, help, {})
+            elif fam[0] != cls.kind:
+                raise ValueError(f"metric {name} already registered as {fam[0]}")
+            metric = fam[2].get(key)
+            if metric is None:
+                metric = fam[2][key] = cls(**kw)
+            elif kw.get("fn") is not None:
+                metric.fn = kw["fn"]     # re-registered callback replaces the old one
+            return metric
+
+    def counter(self, name, help="", fn=None, **labels):
+        return self._get(Counter, name, help, labels, fn=fn)
+
+    def gauge(self, name, help="", fn=None, **labels):
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            families = [(n, k, h, list(m.items())) for n, (k, h, m) in sorted(self.families.items())]
+        for name, kind, help, members in families:
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in members:
+                for sname, slabels, value in metric.samples(name, dict(key)):
+                    lines.append(f"{sname}{_label_str(slabels)} {_fmt(value)}")
+            if kind == "histogram":
+                lines.append(f"# TYPE {name}_window summary")
+                for key, metric in members:
+                    for q, v in metric.quantiles().items():
+                        lines.append(f"{name}_window{_label_str(dict(key, quantile=q))} {_fmt(v)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly view (for /api/stats style endpoints)."""
+        out = {}
+        with self._lock:
+            families = list(self.families.items())
+        for name, (_, _, members) in families:
+            for key, metric in members.items():
+                label = ",".join(f"{k}={v}" for k, v in key)
+                out[name + (f"{{{label}}}" if label else "")] = metric.snapshot()
+        return out
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name, help="", fn=None, **labels):
+    return REGISTRY.counter(name, help, fn, **labels)
+
+
+def gauge(name, help="", fn=None, **labels):
+    return REGISTRY.gauge(name, help, fn, **labels)
+
+
+def histogram(name, help="", buckets=LATENCY_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help, buckets, **labels)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+import threading
+
+# ---------------------------
+# CONFIG (defaults, override per site)
+# ---------------------------
+MOTION_SCALE = 0.25          # downscale factor before differencing
+MOTION_PIXEL_DELTA = 18      # per-pixel grey-level change that counts as motion
+MOTION_MIN_AREA = 0.004      # fraction of ROI pixels that must change
+MOTION_BG_ALPHA = 0.05       # background running-average rate
+MOTION_COOLDOWN = 15         # keep detector awake this many frames after motion
+MOTION_REFRESH = 300         # force one detector run every N idle frames
+
+
+# ---------------------------
+# Motion / scene-change gate
+# ---------------------------
+class MotionGate:
+    """Cheap gate in front of the detector.
+
+    Compares a downscaled greyscale ROI against a running-average
+    background. should_detect() returns True while something is moving
+    (plus a short cooldown), so an empty gate never reaches YOLO.
+    roi is (x1, y1, x2, y2) in frame pixels, or None for the full frame."""
+
+    def __init__(self, roi=None, scale=MOTION_SCALE, pixel_delta=MOTION_PIXEL_DELTA,
+                 min_area=MOTION_MIN_AREA, bg_alpha=MOTION_BG_ALPHA,
+                 cooldown=MOTION_COOLDOWN, refresh=MOTION_REFRESH):
+        self.roi = roi
+        self.scale = scale
+        self.pixel_delta = pixel_delta
+        self.min_area = min_area
+        self.bg_alpha = bg_alpha
+        self.cooldown = cooldown
+        self.refresh = refresh
+
+        self._bg = None
+        self._awake_for = 0
+        self._idle_run = 0
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.skipped = 0
+        self.last_motion = 0.0       # changed-pixel fraction of the last frame
+
+    def _small_gray(self, frame):
+        if self.roi is not None:
+            x1, y1, x2, y2 = self.roi
+            frame = frame[y1:y2, x1:x2]
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def should_detect(self, frame):
+        gray = self._small_gray(frame)
+        if self._bg is None or self._bg.shape != gray.shape:
+            self._bg = gray.astype(np.float32)
+            motion = 1.0
+        else:
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._bg))
+            motion = np.count_nonzero(diff > self.pixel_delta) / diff.size
+            cv2.accumulateWeighted(gray, self._bg, self.bg_alpha)
+
+        with self._lock:
+            self.frames += 1
+            self.last_motion = float(motion)
+            if motion >= self.min_area:
+                self._awake_for = self.cooldown
+            if self._awake_for > 0:
+                self._awake_for -= 1
+                self._idle_run = 0
+                return True
+            self._idle_run += 1
+            if self.refresh and self._idle_run >= self.refresh:
+                self._idle_run = 0
+                return True
+            self.skipped += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "skip_ratio": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+                "last_motion": round(self.last_motion, 4),
+            }
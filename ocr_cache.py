@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+CACHE_SIZE = 512             # max cached OCR results
+MAX_DISTANCE = 6             # Hamming distance (of 64 bits) still counted as "same crop"
+TTL_SECONDS = 120            # results older than this are ignored and dropped
+
+
+# ---------------------------
+# Perceptual hash
+# ---------------------------
+def phash(img):
+    """64-bit DCT perceptual hash; robust to small shifts, blur and
+    JPEG noise between consecutive crops of the same plate."""
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# ---------------------------
+# Bounded LRU cache of OCR results
+# ---------------------------
+class PHashCache:
+    """LRU cache: perceptual hash -> (text, conf), matched within
+    max_distance bits and ttl seconds."""
+
+    def __init__(self, max_entries=CACHE_SIZE, max_distance=MAX_DISTANCE, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.entries = OrderedDict()     # hash -> (text, conf, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, h):
+        """Returns (text, conf) of the closest fresh entry, or None."""
+        now = time.time()
+        with self._lock:
+            best, best_d = None, self.max_distance + 1
+            stale = []
+            for key, (text, conf, stored_at) in self.entries.items():
+                if now - stored_at > self.ttl:
+                    stale.append(key)
+                    continue
+                d = hamming(h, key)
+                if d < best_d:
+                    best, best_d = key, d
+                    if d == 0:
+                        break
+            for key in stale:
+                del self.entries[key]
+            self.expired += len(stale)
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            self.hits += 1
+            text, conf, _ = self.entries[best]
+            return text, conf
+
+    def put(self, h, text, conf):
+        with self._lock:
+            self.entries[h] = (text, conf, time.time())
+            self.entries.move_to_end(h)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
@@ -0,0 +1,284 @@
+"""Accuracy / speed regression harness for OCR configurations.
+
+    python ocr_eval.py --crops labelled_plates                       # built-in CONFIGS
+    python ocr_eval.py --crops labelled_plates --configs my.json --jobs 3
+    python ocr_eval.py --crops labelled_plates --out runs/new.json --baseline runs/old.json
+
+Labels: labelled_plates/labels.csv with "file,plate" rows, or else the
+file name up to the first "_" (MH12AB1234_0007.jpg -> MH12AB1234).
+Each configuration runs in its own process (its own PaddleOCR), so they
+are evaluated in parallel without sharing one engine. Each worker gets a
+fixed share of the cores (--threads, default cores / --jobs) so parallel
+configurations do not slow each other down unevenly; latency is only
+compared against a baseline run with the same budget. Reports exact-match
+rate, character error rate (CER) and per-crop latency side by side, and
+flags configurations that are slower or less accurate than the baseline
+(the first configuration, or --baseline from an earlier run).
+
+A configuration is a dict:
+    name        label in the report
+    pipeline    "full" (PaddleOCR det + rec, what basewindow.py runs) or
+                "rec" (TextRecognition only, crop is one text line)
+    paddle      extra keyword arguments for the PaddleOCR / TextRecognition constructor
+    min_score   recognizer score threshold (basewindow.OCR_MIN_SCORE)
+    preprocess  list of steps from PREPROCESS, applied in order
+    grammar     decode onto the plate format (plate_grammar.py), as the server does"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import ocr_protocol as proto
+import plate_grammar
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+CONFIGS = [
+    {"name": "current", "pipeline": "full", "min_score": 0.3, "preprocess": []},
+    {"name": "full-h48", "pipeline": "full", "min_score": 0.3, "preprocess": ["rec_height"]},
+    {"name": "rec-only", "pipeline": "rec", "min_score": 0.3, "preprocess": ["rec_height"]},
+    {"name": "rec-only-t0.5", "pipeline": "rec", "min_score": 0.5, "preprocess": ["rec_height"]},
+    {"name": "rec-only-clahe", "pipeline": "rec", "min_score": 0.3,
+     "preprocess": ["clahe", "rec_height"]},
+    {"name": "rec-only-grammar", "pipeline": "rec", "min_score": 0.3,
+     "preprocess": ["rec_height"], "grammar": True},
+]
+SLOWER_TOLERANCE = 0.10      # flag if p50 latency grows more than 10%
+ACCURACY_TOLERANCE = 0.01    # flag if exact match drops / CER grows by more than 1 point
+
+
+# ---------------------------
+# Preprocessing variants
+# ---------------------------
+def _clahe(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    out = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 4)).apply(gray)
+    return cv2.cvtColor(out, cv2.COLOR_GRAY2BGR)
+
+
+PREPROCESS = {
+    "rec_height": lambda img: proto.normalize_crop(img, proto.REC_HEIGHT, gray=False),
+    "gray": lambda img: cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR),
+    "clahe": _clahe,
+    "upscale2x": lambda img: cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC),
+    "sharpen": lambda img: cv2.addWeighted(img, 1.5, cv2.GaussianBlur(img, (0, 0), 2), -0.5, 0),
+}
+
+
+# ---------------------------
+# Labelled set
+# ---------------------------
+def load_labels(folder):
+    """[(path, plate)] from labels.csv, else from file names."""
+    csv_path = os.path.join(folder, "labels.csv")
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="") as f:
+            rows = [r for r in csv.reader(f) if r and not r[0].startswith("#")]
+        if rows and rows[0][0].lower() == "file":
+            rows = rows[1:]
+        return [(os.path.join(folder, r[0]), clean(r[1])) for r in rows]
+    files = []
+    for ext in ("*.jpg", "*.jpeg", "*.png"):
+        files += glob.glob(os.path.join(folder, ext))
+    return [(p, clean(os.path.basename(p).split("_")[0].rsplit(".", 1)[0])) for p in sorted(files)]
+
+
+def clean(text):
+    return "".join(c for c in text.upper() if c.isalnum())
+
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+# ---------------------------
+# Engines
+# ---------------------------
+class RecOnly:
+    """TextRecognition behind the PaddleOCR predict() result shape."""
+
+    def __init__(self, **kwargs):
+        from paddleocr import TextRecognition
+        self.model = TextRecognition(**kwargs)
+
+    def predict(self, img):
+        texts, scores = [], []
+        for r in self.model.predict(img):
+            texts.append(r["rec_text"])
+            scores.append(float(r["rec_score"]))
+        return [{"rec_texts": texts, "rec_scores": scores}]
+
+
+def limit_threads(n):
+    """Worker initializer: pin this process's math libraries to n threads."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(n)
+    cv2.setNumThreads(n)
+
+
+def build_engine(cfg, threads=None):
+    paddle = dict(cfg.get("paddle", {}))
+    if threads:
+        paddle.setdefault("cpu_threads", threads)
+    if cfg.get("pipeline", "full") == "rec":
+        return RecOnly(**paddle)
+    from paddleocr import PaddleOCR
+    options = dict(use_doc_orientation_classify=False, use_doc_unwarping=False,
+                   use_textline_orientation=False, lang="en")
+    options.update(paddle)
+    return PaddleOCR(**options)
+
+
+def evaluate(cfg, samples, warmup=2, threads=None):
+    """Runs in a worker process: one engine, every labelled crop."""
+    from basewindow import parse_ocr_result
+    t_load = time.perf_counter()
+    engine = build_engine(cfg, threads)
+    load_s = time.perf_counter() - t_load
+    steps = [PREPROCESS[name] for name in cfg.get("preprocess", [])]
+
+    rows = []
+    for i, (path, truth) in enumerate(samples):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        if i < warmup:
+            engine.predict(img)          # first calls include lazy init
+        t0 = time.perf_counter()
+        for step in steps:
+            img = step(img)
+        text, conf = parse_ocr_result(engine.predict(img), cfg.get("min_score", 0.3))
+        valid = None
+        if cfg.get("grammar") and text:
+            read = plate_grammar.decode_text(text, conf)
+            text, valid = (read["text"] if read["valid"] else text), read["valid"]
+        latency = time.perf_counter() - t0
+        rows.append({"file": os.path.basename(path), "truth": truth, "text": text,
+                     "conf": round(conf, 4), "latency_ms": round(latency * 1000, 2),
+                     "distance": edit_distance(text, truth), "valid": valid})
+    return {"config": cfg, "load_s": round(load_s, 2), "threads": threads, "rows": rows}
+
+
+def summarize(result):
+    rows = result["rows"]
+    n = len(rows)
+    lat = sorted(r["latency_ms"] for r in rows)
+    chars = sum(len(r["truth"]) for r in rows)
+
+    def pct(p):
+        return lat[min(n - 1, int(p / 100.0 * n))] if n else None
+
+    return {
+        "name": result["config"]["name"],
+        "crops": n,
+        "exact_match": round(sum(r["text"] == r["truth"] for r in rows) / n, 4) if n else None,
+        "cer": round(sum(r["distance"] for r in rows) / chars, 4) if chars else None,
+        "empty": sum(1 for r in rows if not r["text"]),
+        "invalid": sum(1 for r in rows if r.get("valid") is False),
+        "latency_p50_ms": pct(50),
+        "latency_p95_ms": pct(95),
+        "latency_mean_ms": round(sum(lat) / n, 2) if n else None,
+        "load_s": result["load_s"],
+        "threads": result.get("threads"),
+    }
+
+
+def flag(summary, base):
+    """Regression flags of one summary against the baseline summary."""
+    flags = []
+    if base is None or summary is base:
+        return flags
+    # Latency is only comparable under the same thread budget
+    if summary.get("threads") == base.get("threads") and \
+            summary["latency_p50_ms"] and base["latency_p50_ms"] and \
+            summary["latency_p50_ms"] > base["latency_p50_ms"] * (1 + SLOWER_TOLERANCE):
+        flags.append("slower")
+    if summary["exact_match"] is not None and base["exact_match"] is not None and \
+            summary["exact_match"] < base["exact_match"] - ACCURACY_TOLERANCE:
+        flags.append("less_accurate")
+    elif summary["cer"] is not None and base["cer"] is not None and \
+            summary["cer"] > base["cer"] + ACCURACY_TOLERANCE:
+        flags.append("less_accurate")
+    return flags
+
+
+def print_table(summaries):
+    cols = ("name", "crops", "exact_match", "cer", "empty", "invalid", "latency_p50_ms",
+            "latency_p95_ms", "flags")
+    widths = [max(len(c), *(len(str(s.get(c, ""))) for s in summaries)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for s in summaries:
+        print("  ".join(str(s.get(c, "")).ljust(w) for c, w in zip(cols, widths)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare OCR configurations on labelled crops")
+    ap.add_argument("--crops", required=True, help="folder of labelled crops")
+    ap.add_argument("--configs", help="JSON list of configurations (default: CONFIGS)")
+    ap.add_argument("--only", help="comma-separated config names to run")
+    ap.add_argument("--jobs", type=int, default=2, help="configurations evaluated at once")
+    ap.add_argument("--threads", type=int, default=None,
+                    help="CPU threads per configuration (default: cores / jobs)")
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--baseline", help="earlier --out report to compare against")
+    ap.add_argument("--out", help="write the JSON report (summaries + per-crop rows)")
+    ap.add_argument("--fail-on-regression", action="store_true",
+                    help="exit 1 if any configuration is flagged")
+    args = ap.parse_args()
+
+    configs = CONFIGS
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    if args.only:
+        wanted = set(args.only.split(","))
+        configs = [c for c in configs if c["name"] in wanted]
+    samples = load_labels(args.crops)[:args.limit]
+    if not samples:
+        raise SystemExit(f"no labelled crops in {args.crops}")
+    jobs = max(1, args.jobs)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // jobs)
+    print(f"[EVAL] {len(samples)} crops x {len(configs)} configurations | "
+          f"{jobs} at once, {threads} threads each", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=limit_threads,
+                             initargs=(threads,)) as pool:
+        results = list(pool.map(evaluate, configs, [samples] * len(configs),
+                                [2] * len(configs), [threads] * len(configs)))
+    summaries = [summarize(r) for r in results]
+
+    baselines = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baselines = {s["name"]: s for s in json.load(f)["summaries"]}
+    for s in summaries:
+        # Same-name config from the earlier run if given, else this run's first config
+        base = baselines.get(s["name"]) if args.baseline else summaries[0]
+        s["flags"] = flag(s, base)
+
+    print_table(summaries)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "crops": len(samples),
+                       "summaries": summaries, "results": results}, f, indent=2)
+    if args.fail_on_regression and any(s["flags"] for s in summaries):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
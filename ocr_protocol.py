@@ -0,0 +1,223 @@
+import json
+import socket
+import struct
+
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+MAGIC = b"ANP2"              # v2 frame marker; legacy frames start with a track id
+REC_HEIGHT = 48              # PaddleOCR recognizer input height
+CODECS = ("jpeg", "png", "raw")
+JPEG_QUALITY = 90
+PNG_COMPRESSION = 1          # fast; crops are tiny
+
+# Legacy one-shot framing (still accepted by the server):
+#   Pi -> server : u32 track_id | u32 size | JPEG bytes
+#   server -> Pi : u32 size | utf-8 plate text
+#
+# v2 framing (persistent connection, any number of requests):
+#   Pi -> server : "ANP2" | u32 header_len | JSON header | u32 size | payload
+#   server -> Pi : u32 size | JSON reply
+# A {"type": "hello"} request negotiates codec / quality / recognizer height.
+
+ENCODE = metrics.histogram("crop_encode_seconds", "Client-side crop normalize + encode")
+
+
+# ---------------------------
+# Socket helpers
+# ---------------------------
+def recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        packet = sock.recv(min(65536, n - len(data)))
+        if not packet:
+            raise ConnectionError("connection closed")
+        data += packet
+    return data
+
+
+def send_frame(sock, header, payload=b""):
+    h = json.dumps(header).encode("utf-8")
+    sock.sendall(MAGIC + struct.pack(">I", len(h)) + h + struct.pack(">I", len(payload)) + payload)
+
+
+def recv_frame_body(sock):
+    """Read the rest of a v2 request after MAGIC. Returns (header, payload)."""
+    hlen = struct.unpack(">I", recv_exact(sock, 4))[0]
+    header = json.loads(recv_exact(sock, hlen).decode("utf-8"))
+    size = struct.unpack(">I", recv_exact(sock, 4))[0]
+    return header, recv_exact(sock, size)
+
+
+def send_reply(sock, obj):
+    body = json.dumps(obj).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(body)) + body)
+
+
+def recv_reply(sock):
+    size = struct.unpack(">I", recv_exact(sock, 4))[0]
+    return recv_exact(sock, size)
+
+
+# ---------------------------
+# Crop encode / decode
+# ---------------------------
+def normalize_crop(crop, height=REC_HEIGHT, gray=True):
+    """Resize to the recognizer's input height (aspect kept), optionally grey."""
+    h, w = crop.shape[:2]
+    if height and h != height:
+        new_w = max(1, int(round(w * height / float(h))))
+        interp = cv2.INTER_AREA if h > height else cv2.INTER_LINEAR
+        crop = cv2.resize(crop, (new_w, height), interpolation=interp)
+    if gray and crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return crop
+
+
+def encode_crop(crop, codec="jpeg", quality=JPEG_QUALITY):
+    if codec == "raw":
+        return np.ascontiguousarray(crop, dtype=np.uint8).tobytes()
+    if codec == "png":
+        ok, buf = cv2.imencode(".png", crop, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+    else:
+        ok, buf = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError(f"{codec} encode failed")
+    return buf.tobytes()
+
+
+def decode_crop(payload, header):
+    """Image from a request payload, or None if it cannot be decoded (the
+    server answers that with an error reply, like a corrupt JPEG)."""
+    codec = header.get("codec", "jpeg")
+    if not payload:
+        return None
+    if codec == "raw":
+        shape = header.get("shape")
+        if (not isinstance(shape, list) or len(shape) not in (2, 3)
+                or not all(isinstance(n, int) and n > 0 for n in shape)
+                or int(np.prod(shape)) != len(payload)):
+            return None
+        return np.frombuffer(payload, np.uint8).reshape(shape)
+    return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def negotiate(hello, server_codecs=CODECS, rec_height=REC_HEIGHT, jpeg_quality=JPEG_QUALITY):
+    """Server side of the hello: first client-preferred codec we support."""
+    wanted = hello.get("codecs") or ["jpeg"]
+    codec = next((c for c in wanted if c in server_codecs), "jpeg")
+    quality = min(int(hello.get("quality") or jpeg_quality), 100)
+    return {"codec": codec, "quality": quality, "rec_height": rec_height,
+            "gray": True, "codecs": list(server_codecs)}
+
+
+# ---------------------------
+# Pi-side client
+# ---------------------------
+class OcrClient:
+    """Sends plate crops to the OCR server.
+
+    Negotiates codec/quality/height with a hello on the first connection,
+    then keeps the connection open (persistent=True). Falls back to the
+    legacy one-shot JPEG framing when the server does not speak v2."""
+
+    def __init__(self, host, port, timeout=5, codecs=CODECS, quality=JPEG_QUALITY,
+                 gray=True, normalize=True, persistent=True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.codecs = list(codecs)
+        self.quality = quality
+        self.gray = gray
+        self.normalize = normalize
+        self.persistent = persistent
+
+        self.sock = None
+        self.caps = None             # negotiated settings, None until hello
+        self.legacy = False
+        self.bytes_sent = 0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _hello(self, sock):
+        send_frame(sock, {"type": "hello", "codecs": self.codecs, "quality": self.quality})
+        raw = recv_reply(sock)
+        try:
+            self.caps = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            self.caps = None
+        if not isinstance(self.caps, dict):
+            # Old server answered our hello as a broken image: use legacy framing
+            self.legacy = True
+            self.caps = None
+            print("[OCR] Server speaks legacy protocol only")
+
+    def _legacy_request(self, crop, track_id):
+        _, img_encoded = cv2.imencode(".jpg", crop)
+        img_bytes = img_encoded.tobytes()
+        sock = self._connect()
+        try:
+            sock.sendall(struct.pack(">I", int(track_id)) + struct.pack(">I", len(img_bytes)) + img_bytes)
+            self.bytes_sent += len(img_bytes) + 8
+            return {"text": recv_reply(sock).decode("utf-8").strip()}
+        finally:
+            sock.close()
+
+    def _v2_request(self, sock, crop, track_id, extra):
+        caps = self.caps
+        height = caps["rec_height"] if self.normalize else None
+        gray = self.gray and caps.get("gray", True)
+        t0 = time.perf_counter()
+        if self.normalize or gray:
+            crop = normalize_crop(crop, height, gray)
+        payload = encode_crop(crop, caps["codec"], caps["quality"])
+        ENCODE.observe(time.perf_counter() - t0)
+        header = {"type": "ocr", "track_id": int(track_id), "codec": caps["codec"],
+                  "shape": list(crop.shape), "height": height, "gray": crop.ndim == 2}
+        header.update(extra or {})
+        send_frame(sock, header, payload)
+        self.bytes_sent += len(payload)
+        return json.loads(recv_reply(sock).decode("utf-8"))
+
+    def recognize(self, crop, track_id, **extra):
+        """Returns the server reply dict ({"text": ..., "conf": ...});
+        raises on network errors."""
+        if self.legacy:
+            return self._legacy_request(crop, track_id)
+        for attempt in (0, 1):
+            try:
+                if self.sock is None:
+                    self.sock = self._connect()
+                    self._hello(self.sock)
+                    if self.legacy:
+                        self.close()
+                        return self._legacy_request(crop, track_id)
+                reply = self._v2_request(self.sock, crop, track_id, extra)
+                if not self.persistent:
+                    self.close()
+                return reply
+            except (ConnectionError, OSError, ValueError):
+                self.close()
+                if attempt:
+                    raise
+        return {"text": ""}
@@ -0,0 +1,163 @@
+import cv2
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+SPRITE_CACHE_SIZE = 256        # max cached text labels / QR tiles
+BOX_COLOR = (0, 200, 255)
+
+
+# ---------------------------
+# Per-frame detection metadata
+# ---------------------------
+def extract_detections(results, names, frame_shape):
+    """Turn a model.track() result into plain dicts, clipped to the frame.
+    Each dict: {box: (x1, y1, x2, y2), track_id, class_id, class_name}."""
+    detections = []
+    if not results or results[0].boxes.id is None:
+        return detections
+
+    ids = results[0].boxes.id.cpu().numpy().astype(int)
+    boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
+    class_ids = results[0].boxes.cls.int().cpu().tolist()
+
+    h, w = frame_shape[:2]
+    for box, track_id, class_id in zip(boxes, ids, class_ids):
+        x1, y1, x2, y2 = box
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(w, int(x2)), min(h, int(y2))
+        detections.append({
+            "box": (x1, y1, x2, y2),
+            "track_id": int(track_id),
+            "class_id": int(class_id),
+            "class_name": names[class_id],
+        })
+    return detections
+
+
+# ---------------------------
+# Sprite cache (text labels, QR tiles)
+# ---------------------------
+_sprites = OrderedDict()
+_sprites_lock = threading.Lock()
+
+
+def _cached(key, render):
+    with _sprites_lock:
+        sprite = _sprites.get(key)
+        if sprite is not None:
+            _sprites.move_to_end(key)
+            return sprite
+    sprite = render()
+    with _sprites_lock:
+        _sprites[key] = sprite
+        while len(_sprites) > SPRITE_CACHE_SIZE:
+            _sprites.popitem(last=False)
+    return sprite
+
+
+def text_sprite(text, scale=1, thickness=1, colorT=(255, 255, 255),
+                colorR=(255, 0, 255), offset=10):
+    """Pre-rendered label matching cvzone.putTextRect's look.
+    Returns (sprite, (dx, dy)) where (dx, dy) is the sprite's top-left
+    relative to the text origin passed to putTextRect."""
+    def render():
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_PLAIN, scale, thickness)
+        sprite = np.full((th + 2 * offset, tw + 2 * offset, 3), colorR, dtype=np.uint8)
+        cv2.putText(sprite, text, (offset, th + offset), cv2.FONT_HERSHEY_PLAIN,
+                    scale, colorT, thickness)
+        return sprite, (-offset, -th - offset)
+
+    return _cached(("text", text, scale, thickness, colorT, colorR, offset), render)
+
+
+def qr_sprite(link, size=180):
+    """QR tile for a payment link, rendered once per link."""
+    def render():
+        import qrcode
+        qr = qrcode.QRCode(box_size=4, border=2)
+        qr.add_data(link)
+        qr.make(fit=True)
+        qr_pil = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+        return cv2.resize(np.array(qr_pil), (size, size))
+
+    return _cached(("qr", link, size), render)
+
+
+def blit(frame, sprite, x, y):
+    """Copy sprite into frame with its top-left at (x, y), clipped to the frame."""
+    h, w = frame.shape[:2]
+    sh, sw = sprite.shape[:2]
+    fx1, fy1 = max(0, x), max(0, y)
+    fx2, fy2 = min(w, x + sw), min(h, y + sh)
+    if fx1 >= fx2 or fy1 >= fy2:
+        return frame
+    frame[fy1:fy2, fx1:fx2] = sprite[fy1 - y:fy2 - y, fx1 - x:fx2 - x]
+    return frame
+
+
+def put_label(frame, text, pos, scale=1, thickness=1):
+    sprite, (dx, dy) = text_sprite(text, scale, thickness)
+    return blit(frame, sprite, pos[0] + dx, pos[1] + dy)
+
+
+def put_qr(frame, link, size=180):
+    """Bottom-right "Scan to Pay" QR tile (same placement as the old overlay_qr)."""
+    qr_img = qr_sprite(link, size)
+    h, w = frame.shape[:2]
+    qh, qw = qr_img.shape[:2]
+    x_off = w - qw - 10
+    y_off = h - qh - 10
+    blit(frame, qr_img, x_off, y_off)
+    cv2.rectangle(frame, (x_off - 2, y_off - 2), (x_off + qw + 2, y_off + qh + 2), (0, 255, 255), 2)
+    cv2.putText(frame, "Scan to Pay", (x_off, y_off - 8),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+    return frame
+
+
+# ---------------------------
+# Lazy annotation (display stage only)
+# ---------------------------
+def annotate(frame, detections, labels=(), qr_links=(), box_color=BOX_COLOR):
+    """Draw boxes and cached sprites on a copy of the raw frame.
+    labels: iterable of (text, (x, y), thickness); qr_links: UPI links to show."""
+    out = frame.copy()
+    for det in detections:
+        x1, y1, x2, y2 = det["box"]
+        cv2.rectangle(out, (x1, y1), (x2, y2), box_color, 2)
+        put_label(out, f"{det['class_name']} ID:{det['track_id']}", (x1, max(0, y1 - 10)))
+    for text, pos, thickness in labels:
+        put_label(out, text, pos, 1, thickness)
+    for link in qr_links:
+        put_qr(out, link)
+    return out
+
+
+# ---------------------------
+# Short-lived per-track overlays
+# ---------------------------
+class OverlayBoard:
+    """Plate labels / payment QR set by later pipeline stages and drawn
+    by the display stage until they expire."""
+
+    def __init__(self, ttl=15):
+        self.ttl = ttl
+        self.items = {}              # track_id -> (labels, qr_link, expire_time)
+        self._lock = threading.Lock()
+
+    def add(self, track_id, labels=(), qr_link=None):
+        with self._lock:
+            self.items[track_id] = (list(labels), qr_link, time.time() + self.ttl)
+
+    def current(self, visible_ids=()):
+        """Labels of all live entries; QR only for a track still in view."""
+        now = time.time()
+        with self._lock:
+            self.items = {k: v for k, v in self.items.items() if now < v[2]}
+            labels = [l for ls, _, _ in self.items.values() for l in ls]
+            links = [q for k, (_, q, _) in self.items.items() if q and k in visible_ids]
+        return labels, links[:1]
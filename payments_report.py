@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+from status_server import json_response
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+DEFAULT_DAYS = 30            # report window when ?from= is not given
+PAGE_SIZE = 100              # unpaid rows per page (keyset: ?before_at=&before_id=)
+MAX_PAGE = 1000
+EXPORT_BATCH = 1000          # rows fetched per cursor step while streaming CSV
+AMOUNT_TOLERANCE = 0.01      # reconcile: a transaction pays a row of this amount +/- this
+
+# Reporting over the payments ledger (piwifitest.py's pi_payment_log.db).
+# Every query is a range / keyset scan on an index created by
+# piwifitest.init_db, so cost follows the rows in the window asked for,
+# not the size of the ledger; exports stream through a cursor.
+EXPORT_COLUMNS = ("id", "track_id", "plate_number", "phone", "amount", "upi_link",
+                  "sms_status", "detected_at", "sent_at", "paid_at", "txn_id")
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _day(value, default):
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def date_range(query):
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive) -> detected_at bounds
+    [lo, hi) as text, matching the "YYYY-MM-DD HH:MM:SS" column."""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    hi = _day(query.get("to", [None])[0], today) + timedelta(days=1)
+    lo = _day(query.get("from", [None])[0], hi - timedelta(days=DEFAULT_DAYS))
+    return lo.strftime("%Y-%m-%d"), hi.strftime("%Y-%m-%d")
+
+
+# ---------------------------
+# Queries
+# ---------------------------
+def daily_totals(db_path, lo, hi):
+    """Per-day count / amount / SMS outcome / paid, from the covering index."""
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT substr(detected_at, 1, 10) AS day,
+                   COUNT(*)                                         AS count,
+                   TOTAL(amount)                                    AS amount,
+                   SUM(sms_status = 'sent')                         AS sms_sent,
+                   SUM(sms_status = 'failed')                       AS sms_failed,
+                   SUM(sms_status = 'no_phone')                     AS no_phone,
+                   SUM(paid_at != '')                               AS paid,
+                   TOTAL(CASE WHEN paid_at != '' THEN amount END)   AS paid_amount
+            FROM payments
+            WHERE detected_at >= ? AND detected_at < ?
+            GROUP BY day ORDER BY day
+        """, (lo, hi)).fetchall()
+    finally:
+        conn.close()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["unpaid_amount"] = d["amount"] - d["paid_amount"]
+        out.append(d)
+    return out
+
+
+def sms_breakdown(db_path, lo, hi):
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT sms_status, COUNT(*) FROM payments
+            WHERE detected_at >= ? AND detected_at < ?
+            GROUP BY sms_status
+        """, (lo, hi)).fetchall()
+    finally:
+        conn.close()
+    return {status or "unknown": n for status, n in rows}
+
+
+def unpaid(db_path, lo, hi, before=None, limit=PAGE_SIZE):
+    """Unpaid rows newest first, one keyset page at a time: a range scan
+    of the partial (detected_at, id) index, resumed below `before`, the
+    (detected_at, id) of the previous page's last row."""
+    before_at, before_id = before or (hi, 0)
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT id, track_id, plate_number, phone, amount, sms_status, detected_at
+            FROM payments
+            WHERE paid_at = '' AND detected_at >= ? AND (detected_at, id) < (?, ?)
+            ORDER BY detected_at DESC, id DESC LIMIT ?
+        """, (lo, min(before_at, hi), before_id, limit)).fetchall()
+    finally:
+        conn.close()
+    rows = [dict(r) for r in rows]
+    last = rows[-1] if len(rows) == limit else None
+    return {"rows": rows,
+            "next": {"before_at": last["detected_at"], "before_id": last["id"]} if last else None}
+
+
+def export_csv(db_path, lo, hi):
+    """CSV of every row in the window, streamed EXPORT_BATCH rows at a time."""
+    conn = _connect(db_path)
+    try:
+        cur = conn.execute(f"""
+            SELECT {', '.join(EXPORT_COLUMNS)} FROM payments
+            WHERE detected_at >= ? AND detected_at < ? ORDER BY detected_at
+        """, (lo, hi))
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
+    finally:
+        conn.close()
+
+
+def reconcile(db_path, transactions):
+    """Mark payments paid from received UPI transactions.
+
+    Each transaction: {"plate": ..., "amount": ..., "paid_at": ..., "txn_id": ...}
+    or {"id": <payment id>, ...}. A plate pays its oldest unpaid row of the
+    same amount (within AMOUNT_TOLERANCE; same plate text as persist_stage
+    stores); an id pays that row if the amount agrees. Anything else is
+    returned in unmatched as {"tx", "reason", "unpaid_amounts"} with reason
+    "no_unpaid" or "amount_mismatch", so over- and underpayments are
+    reviewed by hand. A txn_id already on the ledger is reported as
+    duplicate, so replays are harmless."""
+    matched, duplicate, unmatched = [], [], []
+    conn = _connect(db_path)
+    try:
+        with conn:
+            for tx in transactions:
+                txn_id = str(tx.get("txn_id") or "")
+                paid_at = tx.get("paid_at") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if txn_id and conn.execute("SELECT 1 FROM payments WHERE txn_id != '' AND txn_id = ?",
+                                           (txn_id,)).fetchone():
+                    duplicate.append(txn_id)
+                    continue
+                if tx.get("id") is not None:
+                    candidates = conn.execute("SELECT id, amount FROM payments WHERE id = ? AND paid_at = ''",
+                                              (int(tx["id"]),)).fetchall()
+                else:
+                    plate = str(tx.get("plate", "")).strip().upper()
+                    candidates = conn.execute("""
+                        SELECT id, amount FROM payments
+                        WHERE plate_number = ? AND paid_at = '' ORDER BY id
+                    """, (plate,)).fetchall()
+                amount = float(tx.get("amount") or 0)
+                row = next((r for r in candidates if abs(r["amount"] - amount) <= AMOUNT_TOLERANCE), None)
+                if row is None:
+                    unmatched.append({"tx": tx, "reason": "amount_mismatch" if candidates else "no_unpaid",
+                                      "unpaid_amounts": [r["amount"] for r in candidates]})
+                    continue
+                conn.execute("UPDATE payments SET paid_at = ?, txn_id = ? WHERE id = ?",
+                             (paid_at, txn_id, row["id"]))
+                matched.append(row["id"])
+    finally:
+        conn.close()
+    return {"matched": matched, "duplicate": duplicate, "unmatched": unmatched}
+
+
+# ---------------------------
+# HTTP (status_server routes)
+# ---------------------------
+def routes(db_path):
+    """GET routes for start_status_server; ?from= / ?to= on each."""
+
+    def daily(q):
+        lo, hi = date_range(q)
+        return json_response({"from": lo, "to": hi, "days": daily_totals(db_path, lo, hi)})
+
+    def sms(q):
+        lo, hi = date_range(q)
+        return json_response({"from": lo, "to": hi, "sms_status": sms_breakdown(db_path, lo, hi)})
+
+    def unpaid_page(q):
+        lo, hi = date_range(q)
+        before_at = q.get("before_at", [None])[0]
+        before = (before_at, int(q.get("before_id", [0])[0])) if before_at else None
+        limit = min(MAX_PAGE, int(q.get("limit", [PAGE_SIZE])[0]))
+        return json_response(unpaid(db_path, lo, hi, before, limit))
+
+    def export(q):
+        lo, hi = date_range(q)
+        return 200, "text/csv; charset=utf-8", export_csv(db_path, lo, hi)
+
+    return {
+        "/payments/daily": daily,
+        "/payments/sms": sms,
+        "/payments/unpaid": unpaid_page,
+        "/payments/export.csv": export,
+    }
+
+
+def post_routes(db_path):
+    def reconcile_route(q, body):
+        data = json.loads(body or b"[]")
+        return json_response(reconcile(db_path, data if isinstance(data, list) else [data]))
+
+    return {"/payments/reconcile": reconcile_route}
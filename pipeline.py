@@ -0,0 +1,330 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+import metrics
+import tracer
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+QUEUE_SIZE = 8
+POLL_SECONDS = 0.2           # how often idle workers check for stop
+
+BLOCK = "block"              # producer waits for room (lossless)
+DROP_OLDEST = "drop_oldest"  # evict the oldest queued item (keep latest frames)
+DROP_NEWEST = "drop_newest"  # discard the incoming item
+
+THREAD = "thread"
+PROCESS = "process"
+
+
+class _Stop:
+    """End-of-stream marker passed down the pipeline."""
+
+    def __reduce__(self):
+        return (_get_stop, ())
+
+
+STOP = _Stop()
+
+
+def _get_stop():
+    return STOP
+
+
+# ---------------------------
+# Bounded channel with a drop policy
+# ---------------------------
+class Channel:
+    """Bounded queue in front of a stage. The policy decides what happens
+    when the consumer falls behind, so a slow stage never stalls the ones
+    before it unless it is configured to (BLOCK)."""
+
+    def __init__(self, name, maxsize=QUEUE_SIZE, policy=BLOCK, use_mp=False, on_drop=None):
+        self.name = name
+        self.policy = policy
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.q = mp.Queue(maxsize) if use_mp else queue.Queue(maxsize)
+        self.put_count = mp.Value("q", 0)
+        self.drop_count = mp.Value("q", 0)
+
+    def _dropped(self, item):
+        with self.drop_count.get_lock():
+            self.drop_count.value += 1
+        if self.on_drop is not None:
+            try:
+                self.on_drop(item)
+            except Exception as e:
+                print(f"[PIPELINE] {self.name} on_drop error: {e}")
+
+    def put(self, item, stop_event=None):
+        if item is STOP:
+            self.q.put(STOP)         # never dropped
+            return True
+        if self.policy == BLOCK:
+            while True:
+                try:
+                    self.q.put(item, timeout=POLL_SECONDS)
+                    break
+                except queue.Full:
+                    if stop_event is not None and stop_event.is_set():
+                        return False
+        elif self.policy == DROP_NEWEST:
+            try:
+                self.q.put_nowait(item)
+            except queue.Full:
+                self._dropped(item)
+                return False
+        else:
+            while True:
+                try:
+                    self.q.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        old = self.q.get_nowait()
+                    except queue.Empty:
+                        continue
+                    if old is STOP:
+                        self.q.put(STOP)
+                        self._dropped(item)
+                        return False
+                    self._dropped(old)
+        with self.put_count.get_lock():
+            self.put_count.value += 1
+        return True
+
+    def get(self, timeout=POLL_SECONDS):
+        return self.q.get(timeout=timeout)
+
+    def depth(self):
+        try:
+            return self.q.qsize()
+        except NotImplementedError:      # mp.Queue on macOS
+            return -1
+
+
+# ---------------------------
+# Stage
+# ---------------------------
+class Stage:
+    """One step of the pipeline.
+
+    fn(item) returns the item for the next stage, None to drop it, or a
+    list to fan out. If fn has a setup() method it is called once inside
+    each worker before the first item (so process stages build their
+    heavy state, e.g. a model, in the child). workers / placement /
+    queue_size / drop pick the concurrency and backpressure per stage."""
+
+    def __init__(self, name, fn, workers=1, placement=THREAD, queue_size=QUEUE_SIZE,
+                 drop=BLOCK, on_drop=None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.placement = placement
+        self.queue_size = queue_size
+        self.drop = drop
+        self.on_drop = on_drop
+
+        self.inbox = None
+        self.outbox = None
+        self.processed = mp.Value("q", 0)
+        self.errors = mp.Value("q", 0)
+        self.busy_seconds = mp.Value("d", 0.0)
+        self.alive = mp.Value("i", 0)
+        self.ready = mp.Event()
+        self.setup_error = mp.Queue()
+        self._handles = []
+
+    def stats(self):
+        return {
+            "placement": self.placement,
+            "workers": self.workers,
+            "queue_depth": self.inbox.depth() if self.inbox else 0,
+            "queue_size": self.queue_size,
+            "drop_policy": self.drop,
+            "enqueued": self.inbox.put_count.value if self.inbox else 0,
+            "dropped": self.inbox.drop_count.value if self.inbox else 0,
+            "processed": self.processed.value,
+            "errors": self.errors.value,
+            "busy_seconds": round(self.busy_seconds.value, 3),
+        }
+
+
+def _trace_args(item):
+    """seq / track_id / request_id of a dict item, for correlating spans."""
+    if not isinstance(item, dict):
+        return {}
+    args = {k: item[k] for k in ("seq", "track_id", "request_id") if k in item}
+    if "detections" in item:
+        args["track_ids"] = [d["track_id"] for d in item["detections"]]
+    return args
+
+
+def _stage_worker(stage_name, fn, inbox, outbox, stop_event, processed, errors,
+                  busy_seconds, alive, ready, setup_error, n_workers):
+    try:
+        if hasattr(fn, "setup"):
+            fn.setup()
+    except Exception as e:
+        setup_error.put(f"{stage_name}: {e}")
+        ready.set()
+        with alive.get_lock():
+            alive.value -= 1
+        return
+    ready.set()
+
+    try:
+        while not stop_event.is_set():
+            try:
+                item = inbox.get()
+            except queue.Empty:
+                continue
+            if item is STOP:
+                inbox.q.put(STOP)        # let sibling workers see it too
+                break
+            t0 = time.perf_counter()
+            t_wall = time.time()
+            try:
+                out = fn(item)
+            except Exception as e:
+                with errors.get_lock():
+                    errors.value += 1
+                print(f"[PIPELINE] {stage_name} error: {e}")
+                out = None
+            elapsed = time.perf_counter() - t0
+            with busy_seconds.get_lock():
+                busy_seconds.value += elapsed
+            tracer.TRACER.add(stage_name, t_wall, elapsed, "stage", **_trace_args(item))
+            with processed.get_lock():
+                processed.value += 1
+            if outbox is None or out is None:
+                continue
+            for o in (out if isinstance(out, list) else (out,)):
+                outbox.put(o, stop_event)
+    finally:
+        with alive.get_lock():
+            alive.value -= 1
+            last = alive.value == 0
+        if last and outbox is not None and not stop_event.is_set():
+            outbox.put(STOP)             # last worker forwards end-of-stream
+
+
+# ---------------------------
+# Pipeline
+# ---------------------------
+class Pipeline:
+    """source -> stage -> stage -> ... with a bounded Channel before each stage.
+
+    source() is called in a loop on its own thread and returns one item
+    (None = nothing this time, StopIteration = end of stream)."""
+
+    def __init__(self, name, source, stages, source_interval=0.0):
+        self.name = name
+        self.source = source
+        self.stages = stages
+        self.source_interval = source_interval
+        self.stop_event = mp.Event()
+        self.source_count = 0
+        self.source_thread = None
+
+        use_mp = any(s.placement == PROCESS for s in stages)
+        prev = None
+        for s in stages:
+            s.inbox = Channel(s.name, s.queue_size, s.drop, use_mp=use_mp, on_drop=s.on_drop)
+            if prev is not None:
+                prev.outbox = s.inbox
+            prev = s
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Queue depth / drops / throughput per stage, read at scrape time
+        from the shared counters (so process-placed stages are included)."""
+        for s in self.stages:
+            labels = {"pipeline": self.name, "stage": s.name}
+            metrics.gauge("stage_queue_depth", "Items waiting in front of the stage",
+                          fn=s.inbox.depth, **labels)
+            metrics.gauge("stage_queue_size", "Stage queue capacity",
+                          fn=lambda s=s: s.queue_size, **labels)
+            metrics.counter("stage_dropped", "Items dropped by the stage's queue policy",
+                            fn=lambda s=s: s.inbox.drop_count.value, **labels)
+            metrics.counter("stage_processed", "Items processed by the stage",
+                            fn=lambda s=s: s.processed.value, **labels)
+            metrics.counter("stage_errors", "Items that raised in the stage",
+                            fn=lambda s=s: s.errors.value, **labels)
+            metrics.counter("stage_busy_seconds", "Time the stage's workers spent in fn()",
+                            fn=lambda s=s: s.busy_seconds.value, **labels)
+
+    def start_stages(self, timeout=None):
+        """Start all workers and wait until every stage's setup has run."""
+        for s in self.stages:
+            s.alive.value = s.workers
+            for i in range(s.workers):
+                args = (s.name, s.fn, s.inbox, s.outbox, self.stop_event, s.processed,
+                        s.errors, s.busy_seconds, s.alive, s.ready, s.setup_error, s.workers)
+                if s.placement == PROCESS:
+                    h = mp.Process(target=_stage_worker, args=args, daemon=True,
+                                   name=f"{self.name}-{s.name}-{i}")
+                else:
+                    h = threading.Thread(target=_stage_worker, args=args, daemon=True,
+                                         name=f"{self.name}-{s.name}-{i}")
+                h.start()
+                s._handles.append(h)
+        for s in self.stages:
+            if not s.ready.wait(timeout):
+                raise TimeoutError(f"stage {s.name} not ready")
+            try:
+                raise RuntimeError(s.setup_error.get_nowait())
+            except queue.Empty:
+                pass
+
+    def _run_source(self):
+        first = self.stages[0].inbox
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = self.source()
+                except StopIteration:
+                    break
+                if item is not None:
+                    self.source_count += 1
+                    first.put(item, self.stop_event)
+                if self.source_interval:
+                    time.sleep(self.source_interval)
+        except Exception as e:
+            print(f"[PIPELINE] {self.name} source error: {e}")
+        finally:
+            if not self.stop_event.is_set():
+                first.put(STOP)
+
+    def start_source(self):
+        self.source_thread = threading.Thread(target=self._run_source, daemon=True,
+                                              name=f"{self.name}-source")
+        self.source_thread.start()
+
+    def start(self, timeout=None):
+        self.start_stages(timeout)
+        self.start_source()
+        return self
+
+    def join(self, timeout=None):
+        """Wait until end-of-stream has drained through every stage."""
+        deadline = None if timeout is None else time.time() + timeout
+        for s in self.stages:
+            for h in s._handles:
+                h.join(None if deadline is None else max(0, deadline - time.time()))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def source_alive(self):
+        return self.source_thread is not None and self.source_thread.is_alive()
+
+    def stats(self):
+        return {
+            "source_items": self.source_count,
+            "stages": {s.name: s.stats() for s in self.stages},
+        }
@@ -1,23 +1,23 @@
-import cv2
-from ultralytics import YOLO
-import cvzone
-from picamera2 import Picamera2
-import socket
-import struct
-import time
 import sqlite3
 import os
 import urllib.parse
-import qrcode
-import numpy as np
 from datetime import datetime
 from twilio.rest import Client
+from overlay import OverlayBoard
+from retention import RetentionJob, TableRetention
+from status_server import start_status_server
+import payments_report
+from pipeline import Pipeline, Stage, DROP_OLDEST
+from anpr_stages import (TrackLedger, CameraSource, DetectStage, FrameSlot,
+                         SelectCrops, OcrStage, run_display)
 
 # ==============================================================
 # CONFIG — EDIT THESE
 # ==============================================================
 WINDOWS_IP      = "192.168.0.101"    # Your Windows PC IP
 PORT            = 9999
+OCR_CODECS      = ("jpeg", "png", "raw")   # offered to the OCR server, in order
+OCR_GRAY        = True                     # greyscale, recognizer-height crops
 
 # UPI / GPay details (money goes to YOU)
 UPI_ID          = "yourname@okicici"  # e.g. 9876543210@ybl
@@ -35,6 +35,22 @@ TWILIO_WA_FROM  = "whatsapp:+14155238886"
 
 # SQLite DB on Pi
 DB_FILE         = "pi_payment_log.db"
+PAYMENT_RETENTION_DAYS = 365          # older payments go to archive/payments/ (None = keep)
+REPORT_PORT     = 8081                # /payments/daily, /sms, /unpaid, /export.csv, /reconcile (None = off)
+REPORT_HOST     = "127.0.0.1"         # /reconcile marks tolls paid: keep it off the gate LAN
+
+# "auto" uses an exported best.onnx / OpenVINO / NCNN model when present
+DETECTOR_BACKEND = "auto"
+
+DETECT_PLACEMENT = "thread"      # or "process"
+FRAME_SIZE      = (800, 600)
+
+# Skip YOLO while nothing moves in MOTION_ROI ((x1, y1, x2, y2) or None)
+MOTION_GATE     = True
+MOTION_ROI      = None
+
+# Local preview window; headless sites skip all drawing
+SHOW_WINDOW     = bool(os.environ.get("DISPLAY"))
 # ==============================================================
 
 
@@ -43,6 +59,7 @@ DB_FILE         = "pi_payment_log.db"
 # ==============================================================
 def init_db():
     conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")   # new DBs only; retention.py frees pages stepwise
     conn.execute("""
         CREATE TABLE IF NOT EXISTS payments (
             id           INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,6 +73,22 @@ def init_db():
             sent_at      TEXT DEFAULT ''
         )
     """)
+    # Migration: reconciliation columns on older databases
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(payments)")}
+    for col in ("paid_at", "txn_id"):
+        if col not in columns:
+            conn.execute(f"ALTER TABLE payments ADD COLUMN {col} TEXT DEFAULT ''")
+    # Report queries (payments_report.py) are range scans on these, never
+    # full-table: per-day totals read only the covering index
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_payments_report
+                    ON payments(detected_at, sms_status, amount, paid_at)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_plate ON payments(plate_number, paid_at)")
+    conn.execute("DROP INDEX IF EXISTS idx_payments_unpaid")      # was (id): scanned every unpaid row
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_payments_unpaid_day
+                    ON payments(detected_at, id) WHERE paid_at = ''""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_txn ON payments(txn_id) WHERE txn_id != ''")
+    # WAL: report reads never block the persist stage's inserts
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.commit()
     conn.close()
     print(f"[DB] Pi database ready: {os.path.abspath(DB_FILE)}")
@@ -81,9 +114,9 @@ def log_payment_db(track_id, plate_number, phone, amount, upi_link, sms_status):
     print(f"[DB] Payment logged for plate: {plate_number}")
 
 
-def get_all_payments():
+def get_recent_payments(limit=20):
     conn = sqlite3.connect(DB_FILE)
-    rows = conn.execute("SELECT * FROM payments ORDER BY detected_at DESC").fetchall()
+    rows = conn.execute("SELECT * FROM payments ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
     conn.close()
     return rows
 
@@ -154,30 +187,6 @@ def generate_upi_link(plate, amount=PARKING_AMOUNT):
     return upi_link, gpay_link
 
 
-# ==============================================================
-# QR Code overlay on frame
-# ==============================================================
-def generate_qr_image(link, size=180):
-    qr = qrcode.QRCode(box_size=4, border=2)
-    qr.add_data(link)
-    qr.make(fit=True)
-    qr_pil = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-    qr_np  = np.array(qr_pil)
-    return cv2.resize(qr_np, (size, size))
-
-
-def overlay_qr(frame, qr_img):
-    h, w    = frame.shape[:2]
-    qh, qw  = qr_img.shape[:2]
-    x_off   = w - qw - 10
-    y_off   = h - qh - 10
-    frame[y_off:y_off+qh, x_off:x_off+qw] = qr_img
-    cv2.rectangle(frame, (x_off-2, y_off-2), (x_off+qw+2, y_off+qh+2), (0,255,255), 2)
-    cv2.putText(frame, "Scan to Pay", (x_off, y_off-8),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,255), 1)
-    return frame
-
-
 # ==============================================================
 # Send SMS / WhatsApp
 # ==============================================================
@@ -214,161 +223,119 @@ def send_whatsapp(phone, plate, gpay_link):
 
 
 # ==============================================================
-# Send plate crop to Windows OCR Server
+# Pipeline stages after OCR: payment link -> notify -> persist
 # ==============================================================
-def send_to_ocr_server(crop, track_id):
-    try:
-        _, img_encoded = cv2.imencode(".jpg", crop)
-        img_bytes = img_encoded.tobytes()
+overlays = OverlayBoard(ttl=15)
 
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.settimeout(10)
-        client.connect((WINDOWS_IP, PORT))
 
-        client.sendall(struct.pack(">I", track_id))
-        client.sendall(struct.pack(">I", len(img_bytes)))
-        client.sendall(img_bytes)
+def payment_link_stage(job):
+    plate_text      = job["plate"]
+    x1, y1, x2, y2  = job["box"]
+    labels          = [(f"Plate: {plate_text}", (x1, y2+10), 2)]
 
-        raw_size    = client.recv(4)
-        result_size = struct.unpack(">I", raw_size)[0]
+    # ---- Generate UPI / GPay Link ----
+    clean_plate         = plate_text.strip().upper()
+    upi_link, gpay_link = generate_upi_link(clean_plate)
 
-        result_data = b""
-        while len(result_data) < result_size:
-            packet = client.recv(4096)
-            if not packet:
-                break
-            result_data += packet
+    # ---- Lookup phone from SQLite plates.db ----
+    info   = lookup_plate(clean_plate)
+    phone  = info.get("phone", "")
+    owner  = info.get("owner_name", "Unknown")
 
-        client.close()
-        return result_data.decode("utf-8").strip()
+    if phone:
+        print(f"[INFO] Owner: {owner} | Phone: {phone}")
+        labels.append((f"Owner: {owner}", (x1, y2+40), 1))
+    else:
+        print(f"[WARN] No phone found for plate: {clean_plate}")
 
-    except Exception as e:
-        print(f"[OCR SERVER ERROR] {e}")
-        return ""
+    # ---- Show QR on screen (rendered lazily by the display stage) ----
+    overlays.add(job["track_id"], labels, upi_link)
+
+    job.update(clean_plate=clean_plate, gpay_link=gpay_link, phone=phone)
+    return job
+
+
+def notify_stage(job):
+    job["sms_status"] = "no_phone"
+    if job["phone"]:
+        if USE_WHATSAPP:
+            job["sms_status"] = send_whatsapp(job["phone"], job["clean_plate"], job["gpay_link"])
+        else:
+            job["sms_status"] = send_sms(job["phone"], job["clean_plate"], job["gpay_link"])
+    return job
+
+
+def persist_stage(job):
+    # ---- Log everything to SQLite ----
+    log_payment_db(
+        track_id     = int(job["track_id"]),
+        plate_number = job["clean_plate"],
+        phone        = job["phone"],
+        amount       = PARKING_AMOUNT,
+        upi_link     = job["gpay_link"],
+        sms_status   = job["sms_status"]
+    )
+    return None
 
 
 # ==============================================================
 # MAIN
 # ==============================================================
+def build_pipeline(camera, slot):
+    ledger = TrackLedger()
+    return Pipeline("payment", camera, [
+        Stage("detect", DetectStage(backend=DETECTOR_BACKEND, frame_size=FRAME_SIZE,
+                                    motion_gate=MOTION_GATE, motion_roi=MOTION_ROI),
+              placement=DETECT_PLACEMENT, queue_size=1, drop=DROP_OLDEST),
+        Stage("select", SelectCrops(ledger, (60, 20), slot=slot), queue_size=2, drop=DROP_OLDEST),
+        # Empty reads are retried on a later frame of the same track
+        Stage("ocr", OcrStage(ledger, WINDOWS_IP, PORT, timeout=10, codecs=OCR_CODECS,
+                              gray=OCR_GRAY, mark_on_empty=False),
+              queue_size=8, drop=DROP_OLDEST, on_drop=ledger.release),
+        Stage("payment_link", payment_link_stage, queue_size=16),
+        # SMS goes over the network: its own stage so it never stalls OCR
+        Stage("notify", notify_stage, workers=2, queue_size=16),
+        Stage("persist", persist_stage, queue_size=32),
+    ])
+
+
 def main():
     init_db()
     init_plate_db()
+    if PAYMENT_RETENTION_DAYS:
+        RetentionJob([TableRetention(DB_FILE, "payments", "detected_at", PAYMENT_RETENTION_DAYS)]).start()
+    if REPORT_PORT:
+        start_status_server(REPORT_PORT, payments_report.routes(DB_FILE), host=REPORT_HOST,
+                            post_routes=payments_report.post_routes(DB_FILE))
+        print(f"[REPORT] Payment reports on {REPORT_HOST}:{REPORT_PORT}/payments/daily")
+
+    camera   = CameraSource(FRAME_SIZE, "RGB888", settle=1)
+    slot     = FrameSlot()
+    pipeline = build_pipeline(camera, slot)
+    pipeline.start_stages()
+    camera.open()
+    pipeline.start_source()
 
-    model = YOLO("best.pt")
-    names = model.names
-    print("Model Classes:", names)
-
-    picam2 = Picamera2()
-    picam2.preview_configuration.main.size = (800, 600)
-    picam2.preview_configuration.main.format = "RGB888"
-    picam2.preview_configuration.align()
-    picam2.configure("preview")
-    picam2.start()
-    time.sleep(1)
+    print("=== Detection Running. Press ESC to quit ===")
 
-    processed_ids = set()
-    qr_display    = {}   # track_id → (qr_img, expire_time)
+    # ---- Display stage: draw only when a window is shown ----
+    run_display(slot, "License Detection + Payment", pipeline, overlays, show=SHOW_WINDOW)
+    pipeline.stop()
+    camera.close()
 
-    print("=== Detection Running. Press ESC to quit ===")
+    if slot.detect_stats and slot.detect_stats["motion"]:
+        st = slot.detect_stats["motion"]
+        print(f"[MOTION] {st['skipped']}/{st['frames']} frames skipped ({st['skip_ratio']:.1%})")
 
-    while True:
-        frame   = picam2.capture_array()
-        frame   = cv2.flip(frame, -1)
-        results = model.track(frame, persist=True)
-
-        if results and results[0].boxes.id is not None:
-            ids       = results[0].boxes.id.cpu().numpy().astype(int)
-            boxes     = results[0].boxes.xyxy.cpu().numpy().astype(int)
-            class_ids = results[0].boxes.cls.int().cpu().tolist()
-
-            for box, track_id, class_id in zip(boxes, ids, class_ids):
-                x1, y1, x2, y2 = box
-                class_name      = names[class_id]
-
-                h, w = frame.shape[:2]
-                x1, y1 = max(0, x1), max(0, y1)
-                x2, y2 = min(w, x2), min(h, y2)
-
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
-                cvzone.putTextRect(frame, f"{class_name} ID:{track_id}", (x1, y1), 1, 1)
-
-                if class_name.lower() != "licence":
-                    continue
-
-                # Show QR if already processed and still within 15s window
-                if track_id in processed_ids:
-                    if track_id in qr_display and time.time() < qr_display[track_id][1]:
-                        frame = overlay_qr(frame, qr_display[track_id][0])
-                    continue
-
-                crop = frame[y1:y2, x1:x2]
-                if crop is None or crop.size == 0:
-                    continue
-                if crop.shape[1] < 60 or crop.shape[0] < 20:
-                    continue
-
-                # ---- Send to Windows for OCR ----
-                print(f"[INFO] Sending to OCR server (Track ID: {track_id})...")
-                plate_text = send_to_ocr_server(crop, track_id)
-                print(f"[INFO] Plate: '{plate_text}'")
-
-                if not plate_text:
-                    continue
-
-                cvzone.putTextRect(frame, f"Plate: {plate_text}", (x1, y2+10), 1, 2)
-
-                # ---- Generate UPI / GPay Link ----
-                clean_plate       = plate_text.strip().upper()
-                upi_link, gpay_link = generate_upi_link(clean_plate)
-
-                # ---- Show QR on screen ----
-                qr_img = generate_qr_image(upi_link)
-                qr_display[track_id] = (qr_img, time.time() + 15)
-                frame = overlay_qr(frame, qr_img)
-
-                # ---- Lookup phone from SQLite plates.db ----
-                info   = lookup_plate(clean_plate)
-                phone  = info.get("phone", "")
-                owner  = info.get("owner_name", "Unknown")
-
-                sms_status = "no_phone"
-
-                if phone:
-                    print(f"[INFO] Owner: {owner} | Phone: {phone}")
-                    cvzone.putTextRect(frame, f"Owner: {owner}", (x1, y2+40), 1, 1)
-
-                    if USE_WHATSAPP:
-                        sms_status = send_whatsapp(phone, clean_plate, gpay_link)
-                    else:
-                        sms_status = send_sms(phone, clean_plate, gpay_link)
-                else:
-                    print(f"[WARN] No phone found for plate: {clean_plate}")
-
-                # ---- Log everything to SQLite ----
-                log_payment_db(
-                    track_id     = int(track_id),
-                    plate_number = clean_plate,
-                    phone        = phone,
-                    amount       = PARKING_AMOUNT,
-                    upi_link     = gpay_link,
-                    sms_status   = sms_status
-                )
-
-                processed_ids.add(track_id)
-
-        # Clean up expired QR entries
-        qr_display = {k: v for k, v in qr_display.items() if time.time() < v[1]}
-
-        cv2.imshow("License Detection + Payment", frame)
-        if cv2.waitKey(1) & 0xFF == 27:
-            break
-
-    cv2.destroyAllWindows()
-    picam2.stop()
-
-    # Print payment summary on exit
+    # Print payment summary on exit: today's totals + the latest rows
+    # (full history: /payments/export.csv)
     print("\n===== PAYMENT LOG SUMMARY =====")
-    rows = get_all_payments()
+    today = datetime.now().strftime("%Y-%m-%d")
+    lo, hi = payments_report.date_range({"from": [today], "to": [today]})
+    for day in payments_report.daily_totals(DB_FILE, lo, hi):
+        print(f"{day['day']}: {day['count']} vehicles, Rs{day['amount']:.0f} billed, "
+              f"Rs{day['paid_amount']:.0f} paid, SMS {day['sms_sent']} sent / {day['sms_failed']} failed")
+    rows = get_recent_payments()
     print(f"{'ID':<5} {'TRACK':<7} {'PLATE':<15} {'PHONE':<16} {'AMT':>6}  {'SMS':<10} {'DETECTED AT'}")
     print("-" * 85)
     for r in rows:
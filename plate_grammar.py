@@ -0,0 +1,263 @@
+import math
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+CONFUSION_PROB = 0.15        # probability given to a look-alike of the read character
+MIN_CHAR_PROB = 0.05         # a position below this cannot be repaired -> invalid
+MIN_PLATE_SCORE = 0.3        # geometric-mean probability below this -> invalid
+TRIM_PROB = 0.05             # per character dropped from either end ("IND", borders)
+MAX_TRIM = 3
+EPS = 1e-6
+
+# Indian registration plates:
+#   regular   SS DD LLL NNNN   state code, RTO (1-2 digits), series (0-3 letters),
+#                              number (4 digits, zero-padded)    MH12AB1234, DL3CAB1234
+#   Bharat    YY BH NNNN LL    year, "BH", number, 1-2 letters    22BH1234AA
+# Series letters never use I or O (too close to 1 and 0).
+STATE_CODES = (
+    "AN", "AP", "AR", "AS", "BR", "CG", "CH", "DD", "DL", "DN", "GA", "GJ", "HP", "HR",
+    "JH", "JK", "KA", "KL", "LA", "LD", "MH", "ML", "MN", "MP", "MZ", "NL", "OD", "OR",
+    "PB", "PY", "RJ", "SK", "TN", "TR", "TS", "UK", "UP", "WB",
+)
+SERIES_EXCLUDE = "IO"
+# Rough share of each series length (Bharat: suffix length) on the road;
+# ranks templates against each other and against a read missing a character.
+SERIES_PRIOR = {0: 0.05, 1: 0.15, 2: 0.75, 3: 0.05}
+
+# Look-alikes the recognizer swaps, by the class the position needs
+LETTER_FOR = {"0": "OD", "1": "I", "2": "Z", "4": "A", "5": "S", "6": "G", "7": "T", "8": "B"}
+DIGIT_FOR = {"O": "0", "D": "0", "Q": "0", "U": "0", "I": "1", "L": "1", "J": "1", "Z": "2",
+             "A": "4", "S": "5", "G": "6", "T": "7", "B": "8"}
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+DIGITS = "0123456789"
+
+
+def _templates():
+    """(format name, [position classes]); a class is a char set or a state marker."""
+    series_letters = "".join(c for c in LETTERS if c not in SERIES_EXCLUDE)
+    out = []
+    for rto in (1, 2):
+        for series in range(4):
+            out.append(("regular", ["STATE"] + [DIGITS] * rto + [series_letters] * series
+                        + [DIGITS] * 4))
+    for suffix in (1, 2):
+        out.append(("bharat", [DIGITS, DIGITS, "B", "H"] + [DIGITS] * 4
+                    + [series_letters] * suffix))
+    return out
+
+
+TEMPLATES = _templates()
+_SERIES = "".join(c for c in LETTERS if c not in SERIES_EXCLUDE)
+TEMPLATE_PRIOR = {tuple(classes): SERIES_PRIOR[classes.count(_SERIES)] for _, classes in TEMPLATES}
+
+
+# ---------------------------
+# Per-position distributions
+# ---------------------------
+def distributions_from_text(text, score):
+    """Per-position {char: prob} from a recognized string and its score,
+    for recognizers that only report the best path (PaddleOCR predict()).
+    Each position keeps the read character at `score` and its look-alikes
+    at CONFUSION_PROB."""
+    p = min(1.0, max(MIN_CHAR_PROB, score))
+    dists = []
+    for c in text:
+        d = {c: p}
+        for alt in LETTER_FOR.get(c, "") + DIGIT_FOR.get(c, ""):
+            d.setdefault(alt, CONFUSION_PROB)
+        dists.append(d)
+    return dists
+
+
+def _best_in(dist, allowed):
+    best, best_p = None, 0.0
+    for c, p in dist.items():
+        if c in allowed and p > best_p:
+            best, best_p = c, p
+    return best, best_p
+
+
+def _match(dists, classes):
+    """Best string for one template over exactly len(classes) positions:
+    (log score, text, min position prob)."""
+    text, logp, worst = [], 0.0, 1.0
+    i = 0
+    for cls in classes:
+        if cls == "STATE":
+            best, best_p = None, 0.0
+            for code in STATE_CODES:
+                p = dists[i].get(code[0], 0.0) * dists[i + 1].get(code[1], 0.0)
+                if p > best_p:
+                    best, best_p = code, p
+            if best is None:
+                return None
+            text.append(best)
+            logp += math.log(best_p)
+            worst = min(worst, dists[i][best[0]], dists[i + 1][best[1]])
+            i += 2
+            continue
+        c, p = _best_in(dists[i], cls)
+        if c is None:
+            return None
+        text.append(c)
+        logp += math.log(max(p, EPS))
+        worst = min(worst, p)
+        i += 1
+    return logp, "".join(text), worst
+
+
+def _length(classes):
+    return sum(2 if c == "STATE" else 1 for c in classes)
+
+
+def _top(dist):
+    return max(dist, key=dist.get) if dist else ""
+
+
+def _fits(char, cls):
+    """Could a read character belong to a template position of class cls?
+    A state code is always exactly two letters, so nothing extends it."""
+    return cls != "STATE" and char in cls
+
+
+def _suspect(read, classes, start, n):
+    """Why a candidate is not trusted, or None: a dropped end character
+    fits the template class next to it, so it is more likely a real
+    character than a border / "IND" (MH12OO1234 -> MH120012 would lose
+    the real "34")."""
+    flat = []
+    for cls in classes:
+        flat.extend([cls, cls] if cls == "STATE" else [cls])
+    end = start + len(flat)
+    if start > 0 and _fits(read[start - 1], flat[0]):
+        return "trimmed"
+    if end < n and _fits(read[end], flat[-1]):
+        return "trimmed"
+    return None
+
+
+_GAP = {c: TRIM_PROB for c in LETTERS + DIGITS}
+
+
+def _missing(window):
+    """Best log score of a template one position longer than the window,
+    with the recognizer having dropped one character (scored TRIM_PROB).
+    A letter/digit repair at a block edge is only trusted if it beats
+    this: MH12AB123 is more likely MH12AB12?3 than MH12A8123, while
+    MH12A81234 and MH12ABS234 are plain B/8 and S/5 swaps."""
+    best = None
+    for _, classes in TEMPLATES:
+        if _length(classes) != len(window) + 1:
+            continue
+        prior = math.log(TEMPLATE_PRIOR[tuple(classes)])
+        for k in range(len(window) + 1):
+            m = _match(window[:k] + [_GAP] + window[k:], classes)
+            if m is not None and (best is None or m[0] + prior > best):
+                best = m[0] + prior
+    return best
+
+
+def decode(dists, raw=None):
+    """Most likely plate-format string for per-position distributions.
+
+    Tries every template on every window of the read (dropping up to
+    MAX_TRIM characters at the ends). Returns a dict:
+        text     best format-valid string, or the raw read if none
+        valid    True if a template matched with every position >= MIN_CHAR_PROB,
+                 an overall score >= MIN_PLATE_SCORE, no suspect trim (see
+                 _suspect), and no likelier reading with a character missing
+                 (see _missing); invalid reads are retried by OcrStage
+        format   "regular" | "bharat" | None
+        score    per-character geometric mean probability of the kept characters
+        repairs  [(position, read, repaired)] letter/digit substitutions
+        raw      the read before decoding"""
+    raw = raw if raw is not None else "".join(_top(d) for d in dists if d)
+    n = len(dists)
+    read = raw if len(raw) == n else "".join(_top(d) for d in dists)
+    best = missing = None
+    for start in range(min(MAX_TRIM, n) + 1):
+        for tail in range(min(MAX_TRIM, n - start) + 1):
+            window = dists[start:n - tail]
+            if not window:
+                continue
+            trim_log = (start + tail) * math.log(TRIM_PROB)
+            gap = _missing(window)
+            if gap is not None and (missing is None or gap + trim_log > missing):
+                missing = gap + trim_log
+            for name, classes in TEMPLATES:
+                if _length(classes) != len(window):
+                    continue
+                m = _match(window, classes)
+                if m is None:
+                    continue
+                logp, text, worst = m
+                score = math.exp(logp / max(1, len(text)))
+                valid = (worst >= MIN_CHAR_PROB and score >= MIN_PLATE_SCORE
+                         and _suspect(read, classes, start, n) is None)
+                # A trusted candidate beats any untrusted one
+                key = (valid, logp + trim_log + math.log(TEMPLATE_PRIOR[tuple(classes)]))
+                if best is None or key > best[0]:
+                    best = (key, text, score, name, start)
+    if best is None:
+        return {"text": raw, "valid": False, "format": None, "score": 0.0,
+                "repairs": [], "raw": raw}
+    (valid, logp), text, score, name, start = best
+    if missing is not None and missing > logp:
+        valid = False                # as likely a character short of another template
+    read = read[start:start + len(text)]
+    repairs = [(start + i, r, c) for i, (r, c) in enumerate(zip(read, text)) if r != c]
+    return {
+        "text": text,
+        "valid": valid,
+        "format": name,
+        "score": round(score, 4),
+        "repairs": repairs,
+        "raw": raw,
+    }
+
+
+def decode_text(text, score):
+    """decode() for a best-path string + recognizer score."""
+    text = "".join(c for c in text.upper() if c.isalnum())
+    if not text:
+        return {"text": "", "valid": False, "format": None, "score": 0.0, "repairs": [], "raw": ""}
+    return decode(distributions_from_text(text, score), raw=text)
+
+
+# ---------------------------
+# Self-check: python plate_grammar.py
+# ---------------------------
+CHECKS = [
+    # (read, recognizer score, expected text, expected valid)
+    ("MH12AB1234", 0.9, "MH12AB1234", True),
+    ("MHI2AB1234", 0.9, "MH12AB1234", True),      # repair: I -> 1 in the RTO
+    ("MH12AB12S4", 0.9, "MH12AB1254", True),      # repair: S -> 5 in the number
+    ("DL3CAB1234", 0.9, "DL3CAB1234", True),
+    ("22BH1234AA", 0.9, "22BH1234AA", True),
+    ("INDMH12AB1234", 0.9, "MH12AB1234", True),   # trim: "IND" cannot extend a state code
+    ("MH12AB1234X", 0.9, "MH12AB1234", True),     # trim: a letter cannot extend the number
+    ("7MH12AB1234", 0.9, "MH12AB1234", True),     # trim: a digit cannot extend a state code
+    ("MH12A81234", 0.9, "MH12AB1234", True),      # repair: 8 -> B at the series / number edge
+    ("MH12ABS234", 0.9, "MH12AB5234", True),      # repair: S -> 5 at the series / number edge
+    ("MH12OO1234", 0.9, "MH120012", False),       # trim would drop the real "34"
+    ("MH12AB123", 0.9, "MH12A8123", False),       # missing digit, not a B/8 swap
+    ("MH12AB12345", 0.9, "MH12AB1234", False),    # extra digit
+    ("MH12AB1234", 0.2, "MH12AB1234", False),     # recognizer unsure
+    ("XX", 0.9, "XX", False),
+]
+
+
+def self_check():
+    failures = 0
+    for read, score, text, valid in CHECKS:
+        d = decode_text(read, score)
+        ok = d["text"] == text and d["valid"] == valid
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {read:<14} -> {d['text']:<12} valid={d['valid']}")
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if self_check() else 0)
@@ -0,0 +1,175 @@
+import cv2
+import math
+import numpy as np
+import threading
+
+# ---------------------------
+# CONFIG (defaults, override per site)
+# ---------------------------
+DETECT_EVERY = 3             # run YOLO on every Nth frame (fixed mode)
+DETECT_EVERY_MAX = 8         # upper bound for adaptive mode
+FRAME_BUDGET = 1 / 15        # target seconds per frame for adaptive mode
+IOU_REMATCH = 0.3            # min IoU to carry a track ID across a re-sync
+MIN_FLOW_POINTS = 3          # below this a box is held still instead of moved
+ID_MAP_SIZE = 512            # remembered detector-id -> stable-id aliases
+
+
+def iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+# ---------------------------
+# Detect-every-N with optical-flow propagation
+# ---------------------------
+class TrackPropagator:
+    """Runs the detector on every Nth frame and moves boxes in between.
+
+    In-between frames shift each box by the median sparse optical flow
+    (Lucas-Kanade) of corner points inside it. When the detector runs
+    again, new track IDs that overlap a propagated box of the same class
+    are mapped back to the old ID, so IDs stay stable across re-syncs.
+    With adaptive=True, N follows the measured detector time so the
+    amortised cost per frame stays under frame_budget."""
+
+    def __init__(self, every_n=DETECT_EVERY, adaptive=False, max_n=DETECT_EVERY_MAX,
+                 frame_budget=FRAME_BUDGET, iou_rematch=IOU_REMATCH):
+        self.every_n = max(1, every_n)
+        self.adaptive = adaptive
+        self.max_n = max_n
+        self.frame_budget = frame_budget
+        self.iou_rematch = iou_rematch
+
+        self._prev_gray = None
+        self._tracks = []            # detections as last published
+        self._since_detect = 0
+        self._detect_ema = None
+        self._id_map = {}            # detector track id -> stable track id
+        self._lock = threading.Lock()
+        self.detected = 0
+        self.propagated = 0
+
+    # ---- scheduling ----
+    def should_detect(self):
+        """True when this frame needs a real detector run."""
+        if not self._tracks or self._prev_gray is None:
+            return True
+        return self._since_detect + 1 >= self.every_n
+
+    def _adapt(self, detect_time):
+        if detect_time is None:
+            return
+        if self._detect_ema is None:
+            self._detect_ema = detect_time
+        else:
+            self._detect_ema = 0.8 * self._detect_ema + 0.2 * detect_time
+        if self.adaptive:
+            n = math.ceil(self._detect_ema / self.frame_budget)
+            self.every_n = int(min(self.max_n, max(1, n)))
+
+    # ---- detector frames ----
+    def on_detections(self, frame, detections, detect_time=None):
+        """Feed a real detector result; returns it with stable track IDs."""
+        old = self._tracks
+        seen_ids = set(self._id_map.values())
+        present = set()
+        out = []
+        for det in detections:
+            raw_id = det["track_id"]
+            stable = self._id_map.get(raw_id)
+            if stable is None:
+                stable = raw_id
+                if raw_id not in seen_ids:
+                    best, best_iou = None, self.iou_rematch
+                    for prev in old:
+                        if prev["class_id"] != det["class_id"] or prev["track_id"] in present:
+                            continue
+                        score = iou(prev["box"], det["box"])
+                        if score >= best_iou:
+                            best, best_iou = prev["track_id"], score
+                    if best is not None:
+                        stable = best
+                self._id_map[raw_id] = stable
+            present.add(stable)
+            out.append(dict(det, track_id=stable))
+
+        # Keep the map bounded; oldest aliases go first
+        while len(self._id_map) > ID_MAP_SIZE:
+            self._id_map.pop(next(iter(self._id_map)))
+
+        with self._lock:
+            self._prev_gray = self._gray(frame)
+            self._tracks = out
+            self._since_detect = 0
+            self.detected += 1
+        self._adapt(detect_time)
+        return out
+
+    # ---- in-between frames ----
+    def propagate(self, frame):
+        """Move the last boxes along the optical flow to this frame."""
+        gray = self._gray(frame)
+        h, w = gray.shape[:2]
+        moved = []
+        for det in self._tracks:
+            x1, y1, x2, y2 = det["box"]
+            dx, dy = self._box_flow(self._prev_gray, gray, det["box"])
+            nx1 = int(round(min(max(0, x1 + dx), w - 1)))
+            ny1 = int(round(min(max(0, y1 + dy), h - 1)))
+            nx2 = int(round(min(max(nx1 + 1, x2 + dx), w)))
+            ny2 = int(round(min(max(ny1 + 1, y2 + dy), h)))
+            moved.append(dict(det, box=(nx1, ny1, nx2, ny2), propagated=True))
+
+        with self._lock:
+            self._prev_gray = gray
+            self._tracks = moved
+            self._since_detect += 1
+            self.propagated += 1
+        return moved
+
+    def reset(self):
+        with self._lock:
+            self._prev_gray = None
+            self._tracks = []
+            self._since_detect = 0
+
+    @staticmethod
+    def _gray(frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    @staticmethod
+    def _box_flow(prev, cur, box):
+        x1, y1, x2, y2 = box
+        if x2 - x1 < 4 or y2 - y1 < 4:
+            return 0.0, 0.0
+        mask = np.zeros(prev.shape[:2], dtype=np.uint8)
+        mask[y1:y2, x1:x2] = 255
+        pts = cv2.goodFeaturesToTrack(prev, maxCorners=20, qualityLevel=0.01,
+                                      minDistance=3, mask=mask)
+        if pts is None or len(pts) < MIN_FLOW_POINTS:
+            return 0.0, 0.0
+        nxt, status, _ = cv2.calcOpticalFlowPyrLK(prev, cur, pts, None,
+                                                  winSize=(15, 15), maxLevel=2)
+        good = status.reshape(-1) == 1
+        if good.sum() < MIN_FLOW_POINTS:
+            return 0.0, 0.0
+        flow = (nxt[good] - pts[good]).reshape(-1, 2)
+        dx, dy = np.median(flow, axis=0)
+        return float(dx), float(dy)
+
+    def stats(self):
+        with self._lock:
+            total = self.detected + self.propagated
+            return {
+                "every_n": self.every_n,
+                "detected": self.detected,
+                "propagated": self.propagated,
+                "detect_ratio": round(self.detected / total, 4) if total else 0.0,
+                "detect_ms": round(self._detect_ema * 1000, 1) if self._detect_ema else None,
+            }
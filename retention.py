@@ -0,0 +1,298 @@
+"""Retention for the Pi's SQLite tables and crop folders.
+
+    python retention.py                       # run TASKS once (cron / by hand)
+    python retention.py --days 30 --dry-run   # what would go
+
+Rows older than max_age_days move to per-day gzip JSON-lines files
+(archive/<table>/YYYY-MM-DD.jsonl.gz) and are deleted from the hot DB in
+batches of BATCH_ROWS, each its own short transaction with a pause in
+between, so the pipeline's inserts never wait long. Batches walk the
+primary key (ids rise with time), never the unindexed time column. Freed
+pages go back to the filesystem with incremental vacuum; a DB created
+before auto_vacuum=INCREMENTAL is converted by this CLI only (a full
+VACUUM), never by the service. Old crops are pruned by age.
+Archived days stay readable with read_archive() (app.py /api/history?date=).
+
+A crash between writing an archive batch and deleting it leaves those
+rows in both places; the next run archives them again and read_archive()
+drops the duplicates by id."""
+import argparse
+import functools
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+ARCHIVE_DIR = "archive"
+BATCH_ROWS = 500             # rows archived + deleted per transaction
+BATCH_PAUSE = 0.05           # seconds between batches: writers get the DB lock
+VACUUM_PAGES = 256           # pages released per incremental_vacuum step
+BUSY_TIMEOUT_MS = 5000
+INTERVAL_HOURS = 24
+
+ARCHIVED = metrics.counter("retention_archived_rows", "Rows moved from the hot DB into day archives")
+PRUNED = metrics.counter("retention_pruned_files", "Crop files removed by age")
+VACUUMED = metrics.counter("retention_vacuumed_pages", "Pages released by incremental vacuum")
+LAST_RUN = metrics.gauge("retention_last_run_timestamp", "Unix time the retention job last finished")
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+# ---------------------------
+# Day archives
+# ---------------------------
+def archive_path(archive_dir, table, day):
+    return os.path.join(archive_dir, table, f"{day}.jsonl.gz")
+
+
+def archived_days(archive_dir, table):
+    folder = os.path.join(archive_dir, table)
+    if not os.path.isdir(folder):
+        return []
+    return sorted((n[:-len(".jsonl.gz")] for n in os.listdir(folder) if n.endswith(".jsonl.gz")),
+                  reverse=True)
+
+
+def read_archive(archive_dir, table, day):
+    """Rows archived for one day (newest id first), or [] if none."""
+    path = archive_path(archive_dir, table, day)
+    try:
+        return _read_archive(path, os.path.getmtime(path))
+    except FileNotFoundError:
+        return []
+
+
+@functools.lru_cache(maxsize=8)
+def _read_archive(path, mtime):
+    rows = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:   # reads every appended member
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                rows[row.get("id")] = row
+    return sorted(rows.values(), key=lambda r: r.get("id") or 0, reverse=True)
+
+
+def _append_archive(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # One gzip member per batch; gzip readers concatenate members
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in rows:
+                f.write((json.dumps(row, separators=(",", ":")) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+# ---------------------------
+# Tasks
+# ---------------------------
+class TableRetention:
+    """Archive + delete rows whose time_column day is older than max_age_days.
+    time_column holds ISO-style text ("YYYY-MM-DD..."), compared by day."""
+
+    def __init__(self, db_path, table, time_column, max_age_days, archive_dir=None,
+                 vacuum=True, convert_vacuum=False):
+        self.db_path = db_path
+        self.table = table
+        self.time_column = time_column
+        self.max_age_days = max_age_days
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(db_path) or ".", ARCHIVE_DIR)
+        self.vacuum = vacuum
+        self.convert_vacuum = convert_vacuum
+
+    def __str__(self):
+        return f"{self.db_path}:{self.table}"
+
+    def cutoff_day(self, now=None):
+        return ((now or datetime.now()) - timedelta(days=self.max_age_days)).strftime("%Y-%m-%d")
+
+    def run(self, now=None, dry_run=False):
+        if not os.path.exists(self.db_path):
+            return {"task": str(self), "skipped": "no database"}
+        cutoff = self.cutoff_day(now)
+        # An empty / NULL time is not "old": those rows are left alone
+        where = f"{self.time_column} != '' AND substr({self.time_column}, 1, 10) < ?"
+        conn = _connect(self.db_path)
+        try:
+            if dry_run:
+                n = conn.execute(f"SELECT COUNT(*) FROM {self.table} WHERE {where}", (cutoff,)).fetchone()[0]
+                return {"task": str(self), "cutoff": cutoff, "would_archive": n}
+            archived, days, last_id = 0, set(), 0
+            while True:
+                batch = conn.execute(f"SELECT * FROM {self.table} WHERE id > ? ORDER BY id LIMIT ?",
+                                     (last_id, BATCH_ROWS)).fetchall()
+                if not batch:
+                    break
+                last_id = batch[-1]["id"]
+                stamps = [(r[self.time_column] or "")[:10] for r in batch]
+                rows = [r for r, day in zip(batch, stamps) if day and day < cutoff]
+                if rows:
+                    by_day = {}
+                    for r, day in zip(batch, stamps):
+                        if day and day < cutoff:
+                            by_day.setdefault(day, []).append(dict(r))
+                    for day, day_rows in by_day.items():
+                        _append_archive(archive_path(self.archive_dir, self.table, day), day_rows)
+                    days.update(by_day)
+                    ids = [r["id"] for r in rows]
+                    with conn:        # one short write transaction per batch
+                        conn.execute(f"DELETE FROM {self.table} WHERE id IN ({','.join('?' * len(ids))})", ids)
+                    archived += len(ids)
+                    ARCHIVED.inc(len(ids))
+                if any(day >= cutoff for day in stamps if day):
+                    break                 # ids rise with time: reached rows inside the window
+                time.sleep(BATCH_PAUSE)
+            pages = incremental_vacuum(conn, convert=self.convert_vacuum) \
+                if self.vacuum and archived else 0
+            return {"task": str(self), "cutoff": cutoff, "archived": archived,
+                    "days": sorted(days), "vacuumed_pages": pages}
+        finally:
+            conn.close()
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES, convert=False):
+    """Release free pages in small steps. A DB created without
+    auto_vacuum=INCREMENTAL is skipped (freed pages are reused by SQLite),
+    or with convert=True (CLI) converted once with a full VACUUM."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if not convert:
+            print("[RETENTION] auto_vacuum is not INCREMENTAL; run retention.py once to convert")
+            return 0
+        print("[RETENTION] converting to auto_vacuum=INCREMENTAL (one-time VACUUM)")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return 0
+    released = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        step = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if step <= 0:
+            break
+        released += step
+        time.sleep(BATCH_PAUSE)
+    VACUUMED.inc(released)
+    return released
+
+
+class FolderRetention:
+    """Remove crop files older than max_age_days. With a CropWriter for the
+    folder, prune through it so its index and dedup stay correct; without
+    one (CLI), a running writer re-writes a pruned blob on its next submit."""
+
+    def __init__(self, folder, max_age_days, store=None):
+        self.folder = folder
+        self.max_age_days = max_age_days
+        self.store = store
+
+    def __str__(self):
+        return self.folder
+
+    def run(self, now=None, dry_run=False):
+        store = self.store() if callable(self.store) else self.store
+        cutoff = (now or datetime.now()).timestamp() - self.max_age_days * 86400
+        if store is not None and not dry_run:
+            n = store.prune(self.max_age_days)
+            PRUNED.inc(n)
+            return {"task": str(self), "pruned": n}
+        if not os.path.isdir(self.folder):
+            return {"task": str(self), "skipped": "no folder"}
+        n = 0
+        for e in os.scandir(self.folder):
+            if e.is_file() and e.stat().st_mtime < cutoff:
+                n += 1
+                if not dry_run:
+                    try:
+                        os.remove(e.path)
+                    except FileNotFoundError:
+                        pass
+                    if n % BATCH_ROWS == 0:
+                        time.sleep(BATCH_PAUSE)
+        if dry_run:
+            return {"task": str(self), "would_prune": n}
+        PRUNED.inc(n)
+        return {"task": str(self), "pruned": n}
+
+
+# ---------------------------
+# Scheduled job
+# ---------------------------
+class RetentionJob:
+    def __init__(self, tasks, interval_hours=INTERVAL_HOURS):
+        self.tasks = tasks
+        self.interval = interval_hours * 3600
+        self.last_report = None
+
+    def run_once(self, dry_run=False):
+        t0 = time.time()
+        report = []
+        for task in self.tasks:
+            try:
+                report.append(task.run(dry_run=dry_run))
+            except Exception as e:
+                report.append({"task": str(task), "error": str(e)})
+                print(f"[RETENTION] {task} failed: {e}")
+        if not dry_run:
+            LAST_RUN.set(time.time())
+        self.last_report = {"at": datetime.now().isoformat(timespec="seconds"),
+                            "seconds": round(time.time() - t0, 2), "tasks": report}
+        return self.last_report
+
+    def _loop(self, first_delay):
+        time.sleep(first_delay)
+        while True:
+            report = self.run_once()
+            print(f"[RETENTION] {json.dumps(report['tasks'])}")
+            time.sleep(self.interval)
+
+    def start(self, first_delay=60):
+        """Background thread: first run after first_delay s, then every interval."""
+        threading.Thread(target=self._loop, args=(first_delay,), daemon=True,
+                         name="retention").start()
+        return self
+
+
+# ---------------------------
+# CLI: this Pi's defaults
+# ---------------------------
+TASKS = [
+    TableRetention("plates.db", "plates", "timestamp", 90),
+    TableRetention("pi_payment_log.db", "payments", "detected_at", 365),
+    FolderRetention("plate_blobs", 90),
+    FolderRetention("received_plates", 30),
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Archive old rows, prune old crops, vacuum")
+    ap.add_argument("--days", type=int, help="override every task's max age")
+    ap.add_argument("--dry-run", action="store_true", help="only count what would go")
+    args = ap.parse_args()
+    for task in TASKS:
+        if args.days is not None:
+            task.max_age_days = args.days
+        if isinstance(task, TableRetention):
+            task.convert_vacuum = True      # run by hand: the one-time VACUUM is fine here
+    print(json.dumps(RetentionJob(TASKS).run_once(dry_run=args.dry_run), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import cv2
+import math
+import numpy as np
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+ROI_PAD = 8                  # pixels added around the polygon bounding box
+MIN_PLATE_PX = 12            # plate height the detector still finds reliably
+IMGSZ_MIN = 160
+IMGSZ_MAX = 640
+IMGSZ_STRIDE = 32            # YOLO input sizes must be multiples of the stride
+
+
+# ---------------------------
+# Region of interest
+# ---------------------------
+class RoiCropper:
+    """Crops frames to the bounding box of one or more ROI polygons.
+
+    Pixels outside the polygons are blacked out (mask_outside=True) so the
+    detector cannot fire on the other lane. Boxes found on the crop are
+    mapped back to full-frame coordinates with to_frame()."""
+
+    def __init__(self, polygons, frame_shape, mask_outside=True, pad=ROI_PAD):
+        h, w = frame_shape[:2]
+        self.polygons = [np.array(p, dtype=np.int32).reshape(-1, 2) for p in polygons]
+        pts = np.concatenate(self.polygons)
+        self.x1 = max(0, int(pts[:, 0].min()) - pad)
+        self.y1 = max(0, int(pts[:, 1].min()) - pad)
+        self.x2 = min(w, int(pts[:, 0].max()) + pad)
+        self.y2 = min(h, int(pts[:, 1].max()) + pad)
+        self.frame_shape = (h, w)
+
+        self.mask = None
+        if mask_outside:
+            mask = np.zeros((self.y2 - self.y1, self.x2 - self.x1), dtype=np.uint8)
+            shifted = [p - (self.x1, self.y1) for p in self.polygons]
+            cv2.fillPoly(mask, shifted, 255)
+            self.mask = mask
+
+    @property
+    def rect(self):
+        return (self.x1, self.y1, self.x2, self.y2)
+
+    @property
+    def size(self):
+        return (self.x2 - self.x1, self.y2 - self.y1)
+
+    def crop(self, frame):
+        roi = frame[self.y1:self.y2, self.x1:self.x2]
+        if self.mask is not None:
+            return cv2.bitwise_and(roi, roi, mask=self.mask)
+        return np.ascontiguousarray(roi)
+
+    def to_frame(self, detections):
+        """Shift detections found on the crop back into frame coordinates."""
+        h, w = self.frame_shape
+        out = []
+        for det in detections:
+            x1, y1, x2, y2 = det["box"]
+            box = (min(w, x1 + self.x1), min(h, y1 + self.y1),
+                   min(w, x2 + self.x1), min(h, y2 + self.y1))
+            out.append(dict(det, box=box))
+        return out
+
+
+def roi_for_camera(roi_polygons, camera_id, frame_shape, **kw):
+    """RoiCropper for camera_id, or None when no ROI is configured."""
+    polygons = (roi_polygons or {}).get(camera_id)
+    if not polygons:
+        return None
+    return RoiCropper(polygons, frame_shape, **kw)
+
+
+# ---------------------------
+# Adaptive detector input size
+# ---------------------------
+def pick_imgsz(roi_w, roi_h, expected_plate_px, min_plate_px=MIN_PLATE_PX,
+               lo=IMGSZ_MIN, hi=IMGSZ_MAX, stride=IMGSZ_STRIDE):
+    """Smallest model input size that still keeps an expected plate
+    (expected_plate_px tall in the camera image) at least min_plate_px
+    tall after the detector's letterbox resize."""
+    long_side = max(roi_w, roi_h)
+    scale = min(1.0, min_plate_px / float(max(1, expected_plate_px)))
+    size = math.ceil(long_side * scale / stride) * stride
+    return int(min(hi, max(lo, size)))
@@ -0,0 +1,171 @@
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+SLOTS = 4                    # frames kept; a reader may lag SLOTS - 1 frames
+META_BYTES = 16384           # per-frame JSON (detections) stored next to the pixels
+MAGIC = b"ANPF"
+
+# Shared-memory frame ring: one writer (the detector process), any number
+# of readers (web processes) reading the latest frame in place.
+#
+#   header : magic | version | slots | h | w | c | meta_bytes | generation | writes
+#   slot i : lock | frame_seq | t_capture | meta_len | meta JSON | h*w*c pixels
+#
+# Each slot is guarded by a seqlock: the writer makes `lock` odd while it
+# writes and even when done; a reader that sees the same even value before
+# and after its read knows the slot was not overwritten underneath it.
+#
+# Python has no memory barrier to put around these plain stores, so the
+# seqlock assumes other CPUs see them in program order. x86 keeps stores
+# in order; ARM (the Pi) may not. The reader therefore also re-reads the
+# whole slot header (lock, frame_seq, t_capture, meta_len) after using the
+# frame, and rejects the read if the writes counter shows the writer may
+# have come round to the slot. A torn frame would only be shown, never
+# stored: the detector writes the DB from its own frames, not the ring.
+_HEADER = struct.Struct("<4sIIIIIIQQ")
+_HEADER_SIZE = 64
+_SLOT = struct.Struct("<QQdI4x")
+_SLOT_HEADER = 64
+_WRITES_OFFSET = _HEADER.size - 8
+
+
+def _slot_stride(h, w, c, meta_bytes):
+    size = _SLOT_HEADER + meta_bytes + h * w * c
+    return (size + 63) // 64 * 64
+
+
+class _Ring:
+    def _map(self):
+        buf = self.shm.buf
+        magic, _, self.slots, h, w, c, self.meta_bytes, self.generation, _ = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.shm.name} is not a frame ring")
+        self.shape = (h, w, c)
+        self.stride = _slot_stride(h, w, c, self.meta_bytes)
+        self.frames = []
+        for i in range(self.slots):
+            off = _HEADER_SIZE + i * self.stride + _SLOT_HEADER + self.meta_bytes
+            self.frames.append(np.ndarray(self.shape, np.uint8, buffer=buf, offset=off))
+
+    def _slot_offset(self, slot):
+        return _HEADER_SIZE + slot * self.stride
+
+    def writes(self):
+        return struct.unpack_from("<Q", self.shm.buf, _WRITES_OFFSET)[0]
+
+
+class FrameRingWriter(_Ring):
+    """Owned by the detector process. Creates (or replaces) the segment."""
+
+    def __init__(self, name, shape, slots=SLOTS, meta_bytes=META_BYTES):
+        h, w, c = shape
+        size = _HEADER_SIZE + slots * _slot_stride(h, w, c, meta_bytes)
+        try:
+            old = shared_memory.SharedMemory(name)      # left over from a crashed run
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        _HEADER.pack_into(self.shm.buf, 0, MAGIC, 1, slots, h, w, c, meta_bytes,
+                          time.time_ns(), 0)
+        self._map()
+        self.count = 0
+
+    def write(self, frame, frame_seq, t_capture, meta=None):
+        slot = self.count % self.slots
+        off = self._slot_offset(slot)
+        buf = self.shm.buf
+        blob = json.dumps(meta or {}, separators=(",", ":")).encode("utf-8")
+        if len(blob) > self.meta_bytes:
+            blob = b'{"truncated":true}'
+        lock = struct.unpack_from("<Q", buf, off)[0]
+        struct.pack_into("<Q", buf, off, lock + 1)                  # odd: writing
+        if frame.shape == self.shape:
+            np.copyto(self.frames[slot], frame)
+        else:
+            self.frames[slot][:] = 0
+            h, w = min(frame.shape[0], self.shape[0]), min(frame.shape[1], self.shape[1])
+            self.frames[slot][:h, :w] = frame[:h, :w]
+        meta_off = off + _SLOT_HEADER
+        buf[meta_off:meta_off + len(blob)] = blob
+        _SLOT.pack_into(buf, off, lock + 1, frame_seq, t_capture, len(blob))
+        struct.pack_into("<Q", buf, off, lock + 2)                  # even: consistent
+        self.count += 1
+        struct.pack_into("<Q", buf, _WRITES_OFFSET, self.count)
+
+    def close(self):
+        self.frames = []
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameRingReader(_Ring):
+    """Attaches to an existing ring; reads the newest frame without copying it."""
+
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name)
+        try:
+            # Readers must not unlink the writer's segment when they exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        self._map()
+
+    def current_generation(self):
+        """Generation in the segment now at this name (changes when the
+        detector restarts and recreates it)."""
+        try:
+            shm = shared_memory.SharedMemory(self.shm.name)
+        except FileNotFoundError:
+            return None
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        gen = _HEADER.unpack_from(shm.buf, 0)[7]
+        shm.close()
+        return gen
+
+    def read(self, fn, retries=3):
+        """fn(frame_view, meta) on the newest complete frame.
+        Returns (frame_seq, t_capture, fn result) or None if nothing
+        consistent could be read (no frames yet, or the writer lapped us)."""
+        buf = self.shm.buf
+        for _ in range(retries):
+            writes = self.writes()
+            if writes == 0:
+                return None
+            slot = (writes - 1) % self.slots
+            off = self._slot_offset(slot)
+            header = _SLOT.unpack_from(buf, off)
+            lock, frame_seq, t_capture, meta_len = header
+            if lock & 1 or meta_len > self.meta_bytes:
+                continue
+            meta_off = off + _SLOT_HEADER
+            try:
+                meta = json.loads(bytes(buf[meta_off:meta_off + meta_len]) or b"{}")
+            except ValueError:
+                continue
+            result = fn(self.frames[slot], meta)
+            # Same slot header, and the writer has not reached this slot
+            # again (it does at writes + slots - 1): see the note above
+            if _SLOT.unpack_from(buf, off) == header and self.writes() - writes < self.slots - 1:
+                return frame_seq, t_capture, result
+        return None
+
+    def close(self):
+        self.frames = []
+        self.shm.close()
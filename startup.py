@@ -0,0 +1,93 @@
+import threading
+import time
+
+# ---------------------------
+# Startup phases + readiness
+# ---------------------------
+class Startup:
+    """Tracks named startup phases (db, detector, camera, ...).
+
+    Each phase records how long it took and whether it succeeded, so
+    /readyz can report per-component readiness and the process can
+    print a startup timing report once everything is up."""
+
+    def __init__(self, name):
+        self.name = name
+        self.t0 = time.time()
+        self.components = {}         # name -> {ready, seconds, error}
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+
+    def expect(self, *names):
+        """Declare components up front so /readyz lists them as pending."""
+        with self._lock:
+            for n in names:
+                self.components.setdefault(n, {"ready": False, "seconds": None, "error": None})
+
+    def run(self, name, fn, *args):
+        """Run one phase, recording its duration and outcome. Returns fn's result."""
+        self.expect(name)
+        start = time.time()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.components[name].update(ready=False, error=str(e),
+                                             seconds=round(time.time() - start, 3))
+            print(f"[STARTUP] {name} FAILED after {time.time() - start:.2f}s: {e}")
+            raise
+        with self._lock:
+            self.components[name].update(ready=True, error=None,
+                                         seconds=round(time.time() - start, 3))
+        print(f"[STARTUP] {name} ready in {time.time() - start:.2f}s")
+        return result
+
+    def run_parallel(self, phases):
+        """phases: {name: fn}. Runs them on threads and waits for all.
+        Returns {name: result}; re-raises the first failure."""
+        results, errors = {}, []
+
+        def worker(n, f):
+            try:
+                results[n] = self.run(n, f)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n, f), daemon=True)
+                   for n, f in phases.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def set_ready(self, name, ready=True, error=None):
+        with self._lock:
+            c = self.components.setdefault(name, {"ready": False, "seconds": None, "error": None})
+            c.update(ready=ready, error=error)
+
+    def finish(self):
+        self.done.set()
+        print(self.report_text())
+
+    def report(self):
+        with self._lock:
+            return {
+                "service": self.name,
+                "ready": bool(self.components) and all(c["ready"] for c in self.components.values()),
+                "started": self.done.is_set(),
+                "uptime": round(time.time() - self.t0, 1),
+                "components": {k: dict(v) for k, v in self.components.items()},
+            }
+
+    def report_text(self):
+        rep = self.report()
+        lines = [f"===== STARTUP TIMING ({self.name}) ====="]
+        for name, c in rep["components"].items():
+            secs = f"{c['seconds']:.2f}s" if c["seconds"] is not None else "—"
+            state = "ok" if c["ready"] else (c["error"] or "pending")
+            lines.append(f"  {name:<18} {secs:>8}  {state}")
+        lines.append(f"  {'total':<18} {time.time() - self.t0:>7.2f}s")
+        return "\n".join(lines)
@@ -0,0 +1,72 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# ---------------------------
+# Tiny HTTP status server for non-Flask processes (OCR server)
+# ---------------------------
+def json_response(obj, status=200):
+    return status, "application/json", json.dumps(obj).encode("utf-8")
+
+
+def start_status_server(port, routes, host="0.0.0.0", post_routes=None):
+    """Serve GET (and POST) routes on a daemon thread.
+
+    routes:      {path: handler(query_dict) -> (status, content_type, body[, headers])}
+    post_routes: {path: handler(query_dict, body_bytes) -> (status, content_type, body[, headers])}
+    body is bytes, or an iterable of bytes chunks streamed until the
+    connection closes (large exports without building them in memory);
+    headers is an optional dict of extra response headers."""
+    post_routes = post_routes or {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            handler = routes.get(url.path)
+            self._respond(None if handler is None else lambda: handler(parse_qs(url.query)))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            handler = post_routes.get(url.path)
+            data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._respond(None if handler is None else lambda: handler(parse_qs(url.query), data))
+
+        def _respond(self, call):
+            if call is None:
+                result = json_response({"error": "not found"}, 404)
+            else:
+                try:
+                    result = call()
+                except Exception as e:
+                    result = json_response({"error": str(e)}, 500)
+            status, ctype, body = result[:3]
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            for name, value in (result[3] if len(result) > 3 else {}).items():
+                self.send_header(name, value)
+            if isinstance(body, (bytes, bytearray)):
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for chunk in body:
+                    self.wfile.write(chunk)
+            except (ConnectionError, OSError):
+                pass                       # client went away mid-stream
+            finally:
+                close = getattr(body, "close", None)
+                if close:
+                    close()                # generators release their DB cursor
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[STATUS] http://{host}:{port} {sorted(routes)}")
+    return server
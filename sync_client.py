@@ -0,0 +1,197 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import metrics
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+BATCH_EVENTS = 200           # plates rows per POST
+PUSH_SECONDS = 2.0           # how often new rows are pushed while the link is up
+DIGEST_SECONDS = 10.0        # how often the other sites' digest is pulled
+TIMEOUT = 5.0                # per request; the detection loop never waits on it
+MAX_BACKOFF = 60.0           # seconds between attempts while the aggregator is unreachable
+
+# Pushes this Pi's plates rows to aggregator.py and keeps a digest of plates
+# seen at the other sites. The plates table is the outbox: its AUTOINCREMENT
+# id is the sequence number and sync_state holds the last acknowledged id, so
+# nothing extra is written on the hot path and a link drop (or a restart)
+# only grows the backlog, which is sent oldest first once the link is back.
+# Rows archived by retention before they were acknowledged are not sent.
+
+PUSHED = metrics.counter("sync_pushed_events", "Plate events acknowledged by the aggregator")
+FAILURES = metrics.counter("sync_failures", "Failed push / digest requests")
+
+
+class SyncClient:
+    def __init__(self, db_path, site, url, batch_events=BATCH_EVENTS, push_seconds=PUSH_SECONDS,
+                 digest_seconds=DIGEST_SECONDS, timeout=TIMEOUT):
+        self.db_path = db_path
+        self.site = site
+        self.url = url.rstrip("/")
+        self.batch_events = batch_events
+        self.push_seconds = push_seconds
+        self.digest_seconds = digest_seconds
+        self.timeout = timeout
+
+        self.remote = {}             # plate -> (timestamp, site), other sites only
+        self.window = 0
+        self.digest_cursor = 0
+        self.link_up = False
+        self.last_error = None
+        self.last_push = None
+        self.backoff = 0.0
+        self._lock = threading.Lock()
+        self.epoch, self.acked = self._load_state()
+        metrics.gauge("sync_backlog", "Plates rows not yet acknowledged by the aggregator",
+                      fn=self.backlog)
+        metrics.gauge("sync_link_up", "1 while the aggregator answers", fn=lambda: int(self.link_up))
+        metrics.gauge("sync_remote_plates", "Plates in the other sites' digest",
+                      fn=lambda: len(self.remote))
+
+    # --- local state (same DB as the rows it tracks) ---
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _load_state(self):
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+            # A new epoch whenever this DB (and so its id sequence) is new
+            conn.execute("INSERT OR IGNORE INTO sync_state VALUES ('epoch', ?)", (os.urandom(6).hex(),))
+            conn.execute("INSERT OR IGNORE INTO sync_state VALUES ('acked', '0')")
+            conn.commit()
+            state = dict(conn.execute("SELECT key, value FROM sync_state"))
+        finally:
+            conn.close()
+        return state["epoch"], int(state["acked"])
+
+    def _save_acked(self, acked):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE sync_state SET value = ? WHERE key = 'acked'", (str(acked),))
+            conn.commit()
+        finally:
+            conn.close()
+        self.acked = acked
+
+    def backlog(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM plates WHERE id > ?", (self.acked,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    # --- network ---
+    def _request(self, path, body=None):
+        req = urllib.request.Request(self.url + path, data=body, method="POST" if body else "GET")
+        if body:
+            req.add_header("Content-Type", "application/json")
+            req.add_header("Content-Encoding", "gzip")
+        with urllib.request.urlopen(req, timeout=self.timeout) as r:
+            data = r.read()
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def push_once(self):
+        """Send the oldest unacknowledged batch; returns rows acknowledged."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT id, plate, timestamp, track_id FROM plates
+                WHERE id > ? ORDER BY id LIMIT ?
+            """, (self.acked, self.batch_events)).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return 0
+        batch = {"site": self.site, "epoch": self.epoch, "events": [list(r) for r in rows]}
+        body = gzip.compress(json.dumps(batch, separators=(",", ":")).encode("utf-8"))
+        reply = self._request("/sync/events", body)
+        acked = min(int(reply["acked"]), rows[-1][0])
+        if acked > self.acked:
+            self._save_acked(acked)
+        PUSHED.inc(len(rows))
+        self.last_push = datetime.now().isoformat(timespec="seconds")
+        return len(rows)
+
+    def pull_digest(self):
+        reply = self._request(f"/sync/digest?site={urllib.parse.quote(self.site)}"
+                              f"&since={self.digest_cursor}")
+        cutoff = datetime.now().timestamp() - reply["window"]
+        with self._lock:
+            for plate, ts, site in reply["plates"]:
+                if plate not in self.remote or ts > self.remote[plate][0]:
+                    self.remote[plate] = (ts, site)
+            self.remote = {p: v for p, v in self.remote.items()
+                           if _epoch_seconds(v[0]) >= cutoff}
+            self.window = reply["window"]
+            self.digest_cursor = reply["cursor"]
+
+    # --- lookups (persist stage) ---
+    def seen_elsewhere(self, plate, within=None):
+        """Latest sighting of plate at another site within `within` seconds
+        (default: the digest window) as a last_record-style dict, or None."""
+        with self._lock:
+            hit = self.remote.get(plate)
+        if hit is None:
+            return None
+        ts, site = hit
+        age = time.time() - _epoch_seconds(ts)
+        if age > (within if within is not None else self.window):
+            return None
+        seen = datetime.fromisoformat(ts)
+        return {"date": seen.strftime("%d %b %Y"), "time": seen.strftime("%H:%M:%S"),
+                "timestamp": ts, "site": site, "age": age}
+
+    # --- background loop ---
+    def _loop(self):
+        next_digest = 0.0
+        while True:
+            try:
+                # Drain the backlog batch by batch, then idle until the next push
+                while self.push_once() == self.batch_events:
+                    pass
+                if time.monotonic() >= next_digest:
+                    self.pull_digest()
+                    next_digest = time.monotonic() + self.digest_seconds
+                if not self.link_up:
+                    print(f"[SYNC] aggregator {self.url} reachable")
+                self.link_up, self.last_error, self.backoff = True, None, 0.0
+                time.sleep(self.push_seconds)
+            except Exception as e:
+                # Anything (dropped link mid-response, a locked DB, a bad reply)
+                # must end in backoff, never kill the thread
+                FAILURES.inc()
+                if self.link_up or self.last_error is None:
+                    print(f"[SYNC] sync with {self.url} failing: {type(e).__name__}: {e}")
+                self.link_up, self.last_error = False, f"{type(e).__name__}: {e}"
+                self.backoff = min(MAX_BACKOFF, max(self.push_seconds, self.backoff * 2))
+                time.sleep(self.backoff)
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True, name="sync").start()
+        return self
+
+    def stats(self):
+        return {
+            "site": self.site,
+            "link_up": self.link_up,
+            "acked": self.acked,
+            "backlog": self.backlog(),
+            "last_push": self.last_push,
+            "last_error": self.last_error,
+            "remote_plates": len(self.remote),
+        }
+
+
+def _epoch_seconds(ts):
+    return datetime.fromisoformat(ts).timestamp()
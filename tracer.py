@@ -0,0 +1,121 @@
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# ---------------------------
+# CONFIG (defaults)
+# ---------------------------
+CAPACITY = 50000             # spans kept (oldest overwritten); ~a few minutes at 30 fps
+DUMP_SECONDS = 30            # default window for dumps
+DUMP_FOLDER = "traces"
+
+# Always-on per-frame span recorder. Spans are appended to a bounded deque
+# (one lock-free append per span) and exported as Chrome trace JSON, which
+# opens in Perfetto / chrome://tracing. Timestamps are wall-clock so a Pi
+# trace and an OCR server trace can be loaded side by side; OCR requests
+# carry a request_id in both.
+
+
+class TraceRecorder:
+    def __init__(self, process_name, capacity=CAPACITY):
+        self.process_name = process_name
+        self.events = deque(maxlen=capacity)   # (name, cat, t_start, dur, tid, args)
+        self.thread_names = {}
+        self.pid = os.getpid()
+        self.enabled = True
+
+    def _tid(self):
+        tid = threading.get_native_id()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def add(self, name, t_start, duration, cat="", **args):
+        """Record a finished span (wall-clock start, seconds)."""
+        if self.enabled:
+            self.events.append((name, cat, t_start, duration, self._tid(), args))
+
+    def instant(self, name, cat="", **args):
+        if self.enabled:
+            self.events.append((name, cat, time.time(), None, self._tid(), args))
+
+    @contextmanager
+    def span(self, name, cat="", **args):
+        """with span("ocr", track_id=7) as a: a["text"] = ... adds args on the way out."""
+        t0 = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, t0, time.time() - t0, cat, **args)
+
+    def dump(self, seconds=DUMP_SECONDS):
+        """Chrome trace dict for the last `seconds` (None = whole buffer)."""
+        cutoff = time.time() - seconds if seconds else 0
+        events = [
+            {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": self.process_name}},
+        ]
+        for tid, tname in list(self.thread_names.items()):
+            events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                           "args": {"name": tname}})
+        for name, cat, t0, dur, tid, args in list(self.events):
+            if t0 < cutoff:
+                continue
+            ev = {"name": name, "cat": cat or "anpr", "ts": int(t0 * 1e6), "pid": self.pid,
+                  "tid": tid, "args": args}
+            if dur is None:
+                ev.update(ph="i", s="t")
+            else:
+                ev.update(ph="X", dur=max(1, int(dur * 1e6)))
+            events.append(ev)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, folder=DUMP_FOLDER, seconds=DUMP_SECONDS):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.process_name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w") as f:
+            json.dump(self.dump(seconds), f, default=str)
+        return path
+
+
+# ---------------------------
+# Process-wide recorder
+# ---------------------------
+TRACER = TraceRecorder("anpr")
+_ids = itertools.count(1)
+
+
+def set_process_name(name):
+    TRACER.process_name = name
+
+
+def span(name, cat="", **args):
+    return TRACER.span(name, cat, **args)
+
+
+def instant(name, cat="", **args):
+    TRACER.instant(name, cat, **args)
+
+
+def new_request_id():
+    """Unique per process run; sent in the OCR header and echoed in the reply."""
+    return f"{TRACER.pid:x}-{next(_ids):x}"
+
+
+def install_signal_dump(folder=DUMP_FOLDER, seconds=DUMP_SECONDS):
+    """kill -USR1 <pid> writes the last `seconds` to folder (no-op on Windows).
+    Must be called from the main thread."""
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+
+    def handler(signum, frame):
+        # Write off the signal handler so a slow disk can't stall the main thread
+        threading.Thread(target=lambda: print(f"[TRACE] {TRACER.write(folder, seconds)}"),
+                         daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, handler)
+    return True